@@ -0,0 +1,109 @@
+import random
+import re
+import sys
+import time
+
+from cleaner import clean_batch, iter_clean
+
+# =========================
+# 清洗基准：编译后的单遍规则引擎 vs 旧的逐行实现
+# - 合成语料：中英文正文行，夹杂页码、图表标题、公式、空行，按页分单元
+# - 对比单进程吞吐（行/秒）并核对输出一致，再测 clean_batch 多进程批量清洗
+# 用法：python bench_cleaner.py [文档数] [每篇页数]
+# =========================
+
+_ZH = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定"
+_EN = ("the of and to in is that for it as was with be by on not he this are or his from at which "
+       "but have an they you were her she there been one all we their has would when if so no").split()
+
+
+def _line(rnd: random.Random) -> str:
+    r = rnd.random()
+    if r < 0.05:
+        return str(rnd.randint(1, 400))
+    if r < 0.08:
+        return f"Figure {rnd.randint(1, 20)}. " + " ".join(rnd.choices(_EN, k=8))
+    if r < 0.10:
+        return f"x_{rnd.randint(1, 9)} = " + " + ".join(rnd.choices("abcdefgh", k=4))
+    if r < 0.13:
+        return ""
+    if r < 0.55:
+        return "  " + "".join(rnd.choices(_ZH, k=rnd.randint(20, 45))) + "。"
+    return " ".join(rnd.choices(_EN, k=rnd.randint(8, 16))).capitalize() + "."
+
+
+def make_corpus(docs: int, pages: int, lines_per_page=40, seed=0):
+    """返回 [[页文本, ...], ...]，每篇最后一页末尾带参考文献"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(docs):
+        doc = ["\n".join(_line(rnd) for _ in range(lines_per_page)) + "\n" for _ in range(pages)]
+        doc[-1] += "References\n[1] A. Author. Some title. 2020.\n"
+        corpus.append(doc)
+    return corpus
+
+
+# ---------- 旧实现（规则引擎之前的 cleaner），作为对照 ----------
+def _legacy_clean_lines(lines, cleaned):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if re.fullmatch(r"\d+", line):
+            continue
+        if line.lower().startswith(("figure", "fig.", "table")):
+            continue
+        if re.match(r"(references|bibliography)", line.lower()):
+            return True
+        if any(sym in line for sym in ["=", "∑", "∫", "λ"]):
+            continue
+        cleaned.append(line)
+    return False
+
+
+def legacy_iter_clean(texts):
+    for raw in texts:
+        cleaned = []
+        stop = _legacy_clean_lines(raw.splitlines(), cleaned)
+        if cleaned:
+            yield re.sub(r"\s{2,}", " ", " ".join(cleaned))
+        if stop:
+            return
+
+
+def bench(name, fn, corpus, lines):
+    t0 = time.perf_counter()
+    out = [list(fn(doc)) for doc in corpus]
+    elapsed = time.perf_counter() - t0
+    print(f"{name:<8} {elapsed:.3f}s  {lines / elapsed:>12,.0f} 行/s")
+    return elapsed, out
+
+
+def main():
+    docs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    corpus = make_corpus(docs, pages)
+    lines = sum(page.count("\n") for doc in corpus for page in doc)
+    chars = sum(len(page) for doc in corpus for page in doc)
+    print(f"{docs} 篇 × {pages} 页，共 {lines:,} 行 / {chars / 1024 ** 2:.1f} MB")
+
+    t_old, old = bench("逐行", legacy_iter_clean, corpus, lines)
+    t_new, new = bench("规则引擎", iter_clean, corpus, lines)
+    print(f"加速比：{t_old / t_new:.1f}×")
+    same = all(" ".join(a) == " ".join(b) for a, b in zip(old, new))
+    print(f"输出一致：{'✅' if same else '❌'}")
+
+    # 批量：每篇整段文本（页之间换行）
+    texts = ["".join(doc) for doc in corpus]
+    t0 = time.perf_counter()
+    clean_batch(texts, workers=1)
+    t_serial = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    clean_batch(texts)
+    t_pool = time.perf_counter() - t0
+    print(f"clean_batch 单进程 {t_serial:.3f}s / 进程池 {t_pool:.3f}s（{lines / t_pool:,.0f} 行/s）")
+
+
+if __name__ == "__main__":
+    main()
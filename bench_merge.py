@@ -0,0 +1,49 @@
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_tts import fake_mp3
+from merge_chapters import SEGMENTS_PER_CHAPTER, concat_mp3_ffmpeg
+import mp3frames
+
+# =========================
+# 章节合并基准：进程内按帧拼接 vs ffmpeg concat
+# 用法：python bench_merge.py [章节数] [每段秒数]
+# =========================
+
+
+def bench(name, fn, files, out_dir, chapters):
+    t0 = time.perf_counter()
+    for c in range(chapters):
+        fn(files, out_dir / f"{name}_{c:02d}.mp3")
+    elapsed = time.perf_counter() - t0
+    print(f"{name:<10} {chapters} 章  共 {elapsed:.3f}s  每章 {elapsed / chapters * 1000:.1f}ms")
+    return elapsed
+
+
+def main():
+    chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 90
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        files = []
+        for i in range(SEGMENTS_PER_CHAPTER):
+            f = tmp / f"{i:03d}.mp3"
+            f.write_bytes(fake_mp3(seconds, seed=i))
+            files.append(f)
+        size = sum(f.stat().st_size for f in files) / 1024 ** 2
+        print(f"每章 {SEGMENTS_PER_CHAPTER} 段 × {seconds:.0f}s，约 {size:.1f} MB")
+
+        t_frames = bench("mp3frames", mp3frames.concat, files, tmp, chapters)
+        if shutil.which("ffmpeg"):
+            t_ffmpeg = bench("ffmpeg", concat_mp3_ffmpeg, files, tmp, chapters)
+            print(f"加速比：{t_ffmpeg / t_frames:.1f}×")
+        else:
+            print("未找到 ffmpeg，跳过对比")
+
+
+if __name__ == "__main__":
+    main()
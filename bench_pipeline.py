@@ -0,0 +1,289 @@
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_tts import FakeBackend
+from ingest import iter_document, iter_texts
+from cleaner import RunningLines, iter_clean
+from splitter import iter_split_for_audio, iter_split_balanced
+from metrics import RunMetrics
+import pipeline
+import tts
+
+# =========================
+# 端到端基准：合成语料 + 本地假 TTS，完全离线
+# - 按指定字数、中英文比例生成 TXT / DOCX / EPUB / PDF
+# - 分别测 读取 / 清洗 / 切分 的单阶段吞吐，再跑完整流水线（TTS 用 FakeBackend）
+# - 结果存 --out 指定的文件，缺省为系统临时目录下的 bench_results/<提交>-<时间>.json（不写进仓库），
+#   --compare 与旧结果对比
+# 用法：python bench_pipeline.py [--chars 200000] [--formats txt,pdf] [--compare 旧.json]
+# =========================
+
+RESULTS_DIR = Path(tempfile.gettempdir()) / "bench_results"
+
+_ZH_CHARS = ("的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动"
+             "同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严")
+_EN_WORDS = ("the of and to in is that for it as was with be by on not he this are or his from at which "
+             "but have an they you were her she there been one all we their has would when if so no will "
+             "more about what up out them can some could time into only do other than then its these "
+             "people may first new very over such after most also made many must before through back "
+             "years where much your way well down should because each just those how too little state "
+             "good very make world still own see men work long get here between both life being under").split()
+
+
+# =========================
+# 合成语料
+# =========================
+def make_paragraphs(chars: int, zh_ratio: float, seed: int):
+    """生成约 chars 字的段落列表，每句按 zh_ratio 的概率是中文句子"""
+    rnd = random.Random(seed)
+    paragraphs, total = [], 0
+    while total < chars:
+        sentences = []
+        for _ in range(rnd.randint(3, 8)):
+            if rnd.random() < zh_ratio:
+                s = "".join(rnd.choice(_ZH_CHARS) for _ in range(rnd.randint(8, 30)))
+                s += rnd.choice("。。。！？") if rnd.random() < 0.7 else "，" + s[:6] + "。"
+            else:
+                words = [rnd.choice(_EN_WORDS) for _ in range(rnd.randint(5, 18))]
+                s = " ".join(words).capitalize() + rnd.choice("..?!") + " "
+            sentences.append(s)
+        p = "".join(sentences).strip()
+        paragraphs.append(p)
+        total += len(p)
+    return paragraphs
+
+
+def write_txt(paragraphs, path: Path):
+    path.write_text("\n".join(paragraphs) + "\n", encoding="utf-8")
+
+
+def write_docx(paragraphs, path: Path):
+    import docx
+    doc = docx.Document()
+    for p in paragraphs:
+        doc.add_paragraph(p)
+    doc.save(str(path))
+
+
+def write_epub(paragraphs, path: Path, per_chapter=40):
+    from ebooklib import epub
+    book = epub.EpubBook()
+    book.set_identifier("bench")
+    book.set_title("bench")
+    book.set_language("zh")
+    chapters = []
+    for c, start in enumerate(range(0, len(paragraphs), per_chapter)):
+        ch = epub.EpubHtml(title=f"第{c + 1}章", file_name=f"ch{c:03d}.xhtml", lang="zh")
+        body = "".join(f"<p>{p}</p>" for p in paragraphs[start:start + per_chapter])
+        ch.content = f"<html><body><h1>第{c + 1}章</h1>{body}</body></html>"
+        book.add_item(ch)
+        chapters.append(ch)
+    book.toc = chapters
+    book.spine = chapters
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    epub.write_epub(str(path), book)
+
+
+def write_pdf(paragraphs, path: Path):
+    # reportlab 只用于生成语料，不是运行依赖；内置 CID 字体无需联网或系统字体
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+    pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+    c = canvas.Canvas(str(path))
+    font_size, line_chars, top, bottom = 11, 45, 800, 50
+    y = top
+    c.setFont("STSong-Light", font_size)
+    for p in paragraphs:
+        for i in range(0, len(p), line_chars):
+            if y < bottom:
+                c.showPage()
+                c.setFont("STSong-Light", font_size)
+                y = top
+            c.drawString(50, y, p[i:i + line_chars])
+            y -= font_size * 1.6
+    c.showPage()
+    c.save()
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "epub": write_epub, "pdf": write_pdf}
+
+
+# =========================
+# 测量
+# =========================
+def bench_stages(path: Path, split_mode: str):
+    """单独跑 读取 → 清洗 → 切分，各阶段串行，分别计时"""
+    t0 = time.perf_counter()
+    units = list(iter_document(path))
+    t1 = time.perf_counter()
+    running = RunningLines()
+    cleaned = [t for t in iter_clean(iter_texts(running.filter(units))) if isinstance(t, str)]
+    t2 = time.perf_counter()
+    if split_mode == "duration":
+        chunks = list(iter_split_balanced(cleaned))
+    else:
+        chunks = list(iter_split_for_audio(cleaned))
+    t3 = time.perf_counter()
+
+    raw_chars = sum(len(u.text) for u in units)
+    clean_chars = sum(len(t) for t in cleaned)
+
+    def rate(n, dt):
+        return round(n / dt, 1) if dt > 0 else None
+
+    return {
+        "units": len(units),
+        "raw_chars": raw_chars,
+        "clean_chars": clean_chars,
+        "running_chars": running.removed_chars,
+        "chunks": len(chunks),
+        "ingest": {"seconds": round(t1 - t0, 4), "chars_per_s": rate(raw_chars, t1 - t0)},
+        "clean": {"seconds": round(t2 - t1, 4), "chars_per_s": rate(raw_chars, t2 - t1)},
+        "split": {"seconds": round(t3 - t2, 4), "chars_per_s": rate(clean_chars, t3 - t2)},
+    }
+
+
+def bench_pipeline(path: Path, work: Path, args):
+    """完整流水线：缓存全部关闭，每次都从头解析、合成、合并"""
+    backend = FakeBackend(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          seconds_per_char=args.seconds_per_char, seed=args.seed)
+    tts.configure_engine(backend=backend, concurrency=args.concurrency, rate=args.tts_rate,
+                         burst=args.concurrency, cache=None, adaptive=args.adaptive)
+
+    book_dir = work / f"book_{path.suffix[1:]}"
+    metrics = RunMetrics(book_dir.name, metrics_dir=work / "metrics", profile=())
+    first = []
+    t0 = time.perf_counter()
+
+    def on_segment(idx, ok):
+        if not first:
+            first.append(time.perf_counter() - t0)
+
+    result = pipeline.run_pipeline(path, book_dir, split_mode=args.split_mode,
+                                   on_segment=on_segment, metrics=metrics)
+    elapsed = time.perf_counter() - t0
+    summary = metrics.summary()
+    metrics.close()
+
+    audio_seconds = sum(c["duration"] for c in
+                        json.loads((book_dir / "book.json").read_text(encoding="utf-8"))["chapters"])
+    counters = {name: sum(i["value"] for i in items) for name, items in summary["counters"].items()}
+    return {
+        "seconds": round(elapsed, 4),
+        "first_audio": round(first[0], 4) if first else None,
+        "segments": result["chunks"],
+        "failed": len(result["failed"]),
+        "chapters": result["chapters"],
+        "segments_per_s": round(result["chunks"] / elapsed, 2),
+        "audio_seconds": round(audio_seconds, 1),
+        "realtime_factor": round(audio_seconds / elapsed, 1),
+        "tts_calls": backend.calls,
+        "tts_errors": backend.errors,
+        "stages": summary["stages"],
+        "counters": counters,
+        "tts_latency": summary["histograms"].get("tts_latency"),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict, new: dict):
+    print(f"\n📈 对比 {old['commit']} → {new['commit']}（耗时，越小越好）")
+    ignore = {"out", "compare"}
+    diff = [k for k in new["params"] if k not in ignore and old["params"].get(k) != new["params"][k]]
+    if diff:
+        print(f"⚠️ 两次参数不同（{', '.join(diff)}），对比仅供参考")
+    for fmt, r in new["results"].items():
+        o = old["results"].get(fmt)
+        if not o:
+            continue
+        for stage in ("ingest", "clean", "split"):
+            a, b = o["stages"][stage]["seconds"], r["stages"][stage]["seconds"]
+            print(f"  {fmt:<5}{stage:<9}{a:>9.3f}s → {b:>8.3f}s  {a / b if b else float('inf'):>6.2f}×")
+        a, b = o["pipeline"]["seconds"], r["pipeline"]["seconds"]
+        print(f"  {fmt:<5}{'端到端':<7}{a:>9.3f}s → {b:>8.3f}s  {a / b if b else float('inf'):>6.2f}×")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准（合成语料 + 假 TTS）")
+    parser.add_argument("--chars", type=int, default=200_000, help="每份语料的字数")
+    parser.add_argument("--zh-ratio", type=float, default=0.8, help="中文句子所占比例")
+    parser.add_argument("--formats", default="txt,docx,epub,pdf")
+    parser.add_argument("--split-mode", default="chars", choices=["chars", "duration"])
+    parser.add_argument("--latency", type=float, default=0.05, help="假 TTS 每次请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假 TTS 请求失败概率（失败会走 2s 起的重试等待）")
+    parser.add_argument("--seconds-per-char", type=float, default=0.05, help="假 TTS 输出音频时长（秒/字）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--adaptive", action="store_true", help="开启自适应并发（默认固定并发，结果更稳定）")
+    parser.add_argument("--tts-rate", type=float, default=1000.0, help="令牌桶速率，默认基本不限速")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help=f"结果 JSON 路径，缺省写到 {RESULTS_DIR}")
+    parser.add_argument("--compare", type=Path, help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    # 基准要测的是真实解析和合成，不能命中文本缓存
+    pipeline.TEXT_CACHE = False
+
+    report = {
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "results": {},
+    }
+
+    paragraphs = make_paragraphs(args.chars, args.zh_ratio, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        for fmt in args.formats.split(","):
+            path = work / f"corpus.{fmt}"
+            try:
+                t = time.perf_counter()
+                WRITERS[fmt](paragraphs, path)
+            except ImportError as e:
+                print(f"⚠️ 生成 {fmt} 语料需要 {e.name}，跳过")
+                continue
+            print(f"📄 {fmt}: {path.stat().st_size / 1024:.0f} KB（生成 {time.perf_counter() - t:.1f}s）")
+
+            stages = bench_stages(path, args.split_mode)
+            for stage in ("ingest", "clean", "split"):
+                s = stages[stage]
+                print(f"   {stage:<7}{s['seconds']:>8.3f}s  {s['chars_per_s'] or 0:>12,.0f} 字/s")
+
+            result = bench_pipeline(path, work, args)
+            print(f"   端到端 {result['seconds']:>7.3f}s  {result['segments']} 段 "
+                  f"{result['segments_per_s']} 段/s  首段 {result['first_audio']}s  "
+                  f"音频 {result['audio_seconds']:.0f}s（{result['realtime_factor']}× 实时）")
+
+            report["results"][fmt] = {"file_bytes": path.stat().st_size, "stages": stages,
+                                      "pipeline": result}
+
+    out = args.out or RESULTS_DIR / f"{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n💾 结果已保存：{out}")
+
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
+import argparse
 from pathlib import Path
+import time
 from tqdm import tqdm
 
-from ingest import load_document
-from cleaner import clean_text
-from splitter import split_for_audio
-from tts import text_to_mp3
+from pipeline import PACKED_STORE, run_pipeline
+from scheduler import POLICIES, SCHEDULE_POLICY, run_books
+from transcode import COMPACT_FORMAT, DROP_SEGMENTS, FORMATS, format_size
+from tts import get_engine
 
 # =========================
 # 路径配置
@@ -13,72 +15,116 @@ BASE_DIR = Path(__file__).parent
 UPLOADS = BASE_DIR / "uploads"
 BOOKS = BASE_DIR / "books"
 
+# 切分方式："chars" 按 700 字；"duration" 按预估朗读时长均衡（各段时长更接近）
+SPLIT_MODE = "chars"
+# 朗读声音和语速（edge-tts 的 voice / rate）
+VOICE = "zh-CN-YunxiNeural"
+RATE = "0%"
+
 UPLOADS.mkdir(exist_ok=True)
 BOOKS.mkdir(exist_ok=True)
 
 
-def build_audiobook(file_path: Path):
+def build_audiobook(file_path: Path, voice=VOICE, rate=RATE):
     """
-    从单个文档生成听书：
-    - 支持断点续跑
-    - 已存在 mp3 自动跳过
+    从单个文档生成听书（流水线方式）：
+    - 读取、清洗、切分、TTS、合并章节同时进行，首段音频几秒内即可产出
+    - 支持断点续跑，已合成过的段落直接复用；中途崩溃后重跑只补合成没写完的段
     - 单段失败不影响整体
+    - 按 transcode.COMPACT_FORMAT / DROP_SEGMENTS 转码章节、删掉逐段音频
     """
     print(f"\n📖 Processing: {file_path.name}")
 
-    # 1. 读取文档
-    raw_text = load_document(file_path)
-
-    # 2. 清洗文本
-    cleaned_text = clean_text(raw_text)
-
-    # 3. 切分为适合听的 chunk
-    chunks = split_for_audio(cleaned_text)
-
-    # 4. 创建输出目录
     book_dir = BOOKS / file_path.stem
-    book_dir.mkdir(exist_ok=True)
-
-    print(f"🔹 总段落数: {len(chunks)}")
     print(f"🔹 输出目录: {book_dir}")
 
-    # 5. 逐段生成音频（断点续跑）
-    for idx, chunk in enumerate(tqdm(chunks)):
-        output_mp3 = book_dir / f"{idx:03d}.mp3"
-
-        # 已存在则跳过（核心：支持断点续跑）
-        if output_mp3.exists():
-            continue
-
-        try:
-            text_to_mp3(chunk, output_mp3)
-        except Exception as e:
-            # 理论上 tts.py 已经兜底，这里再保险一次
-            print(f"❌ 段落 {idx} 生成失败，已跳过。错误：{e}")
-            continue
-
+    bar = tqdm(unit="段")
+    t0 = time.time()
+
+    def on_segment(idx, ok):
+        if bar.n == 0:
+            bar.write(f"🎧 首段音频就绪，用时 {time.time() - t0:.1f}s")
+        if not ok:
+            bar.write(f"❌ 段落 {idx} 重试后仍失败。")
+        bar.update(1)
+
+    result = run_pipeline(file_path, book_dir, voice=voice, rate=rate, split_mode=SPLIT_MODE, on_segment=on_segment)
+    bar.close()
+
+    print(f"🔹 总段落数: {result['chunks']}，章节数: {result['chapters']}")
+    if result["running_chars"]:
+        print(f"🔹 去掉重复的页眉页脚 {result['running_chars']} 字")
+    if result["failed"]:
+        print(f"⚠️ {len(result['failed'])} 段重试后仍失败：{result['failed']}，重新运行即可只补这些段")
+    d = result["durations"]
+    if d.get("count"):
+        print(f"🔹 段落时长(秒)：均值 {d['mean']} ± {d['std']}，最短 {d['min']}，最长 {d['max']}")
+
+    cache = get_engine().cache
+    if cache is not None:
+        stats = cache.stats()
+        print(f"🔹 音频缓存：命中 {stats['hits']} / 未命中 {stats['misses']}（累计）")
+    if result["sizes"]:
+        print(f"🔹 书目录大小：{format_size(result['sizes']['before'])} → {format_size(result['sizes']['after'])}")
+    if result["metrics"]:
+        print(f"🔹 运行指标：{result['metrics']}（python metrics.py 查看汇总）")
     print(f"✅ Audiobook ready: {book_dir}")
 
 
 def main():
     """
     主入口：
-    - 顺序处理 uploads 目录下所有文件
+    - 并行解析 uploads 目录下所有文件，按调度策略共享 TTS（见 scheduler.py）
     - 一个文件失败不影响其他文件
     """
-    files = [f for f in UPLOADS.iterdir() if f.is_file()]
+    parser = argparse.ArgumentParser(description="批量生成听书")
+    parser.add_argument("--policy", default=SCHEDULE_POLICY, choices=POLICIES,
+                        help="sjf 短的先做 / fifo 按顺序 / rr 各书轮流")
+    parser.add_argument("--voice", default=VOICE, help="朗读声音，如 zh-CN-XiaoxiaoNeural")
+    parser.add_argument("--rate", default=RATE, help="语速，如 +20%% / -10%%")
+    parser.add_argument("--packed", action="store_true", default=PACKED_STORE,
+                        help="逐段音频/文本写入每本书一个的打包存储（见 segment_pack.py）")
+    parser.add_argument("--format", default=COMPACT_FORMAT, choices=sorted(FORMATS),
+                        help="章节合并后转成紧凑格式（aac / opus / 低码率单声道 mp3，见 transcode.py）")
+    parser.add_argument("--drop-segments", action="store_true", default=DROP_SEGMENTS,
+                        help="全部完成后删掉逐段音频，只留章节音频（之后重新转化需要重新合成）")
+    args = parser.parse_args()
+
+    files = sorted((f for f in UPLOADS.iterdir() if f.is_file()), key=lambda f: f.stat().st_mtime)
 
     if not files:
         print("⚠️ uploads 目录中没有可处理的文件。")
         return
 
-    print(f"📚 共发现 {len(files)} 个文件待处理。\n")
-
-    for f in files:
-        try:
-            build_audiobook(f)
-        except Exception as e:
-            print(f"❌ 文件 {f.name} 处理失败，已跳过。错误：{e}")
+    print(f"📚 共发现 {len(files)} 个文件待处理，调度策略：{args.policy}\n")
+    if args.drop_segments:
+        print("⚠️ 已开启 --drop-segments：完成后删掉逐段音频，之后重新转化这些书时每一段都要重新合成\n")
+
+    bar = tqdm(unit="段")
+    finished = []
+
+    def on_segment(name, idx, ok):
+        if not ok:
+            bar.write(f"❌ {name} 段落 {idx} 重试后仍失败。")
+        bar.update(1)
+
+    def on_book_done(name, result, seconds):
+        if isinstance(result, Exception):
+            bar.write(f"❌ 文件 {name} 处理失败，已跳过。错误：{result}")
+            return
+        finished.append(seconds)
+        bar.write(f"✅ {name}：{result['chunks']} 段，{result['chapters']} 章，第 {seconds:.1f}s 完成")
+        if result["sizes"]:
+            sizes = result["sizes"]
+            bar.write(f"   📦 {format_size(sizes['before'])} → {format_size(sizes['after'])}")
+
+    run_books(files, BOOKS, policy=args.policy, split_mode=SPLIT_MODE, voice=args.voice, rate=args.rate,
+              packed=args.packed, compact=args.format, drop_segments=args.drop_segments,
+              on_segment=on_segment, on_book_done=on_book_done)
+    bar.close()
+
+    if finished:
+        print(f"🔹 平均完成时间 {sum(finished) / len(finished):.1f}s，全部完成 {max(finished):.1f}s")
 
 
 if __name__ == "__main__":
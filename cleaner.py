@@ -1,34 +1,240 @@
+import multiprocessing
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
+# 清洗规则有变化时加 1，使已缓存的解析文本失效（见 text_cache.py）
+CLEANER_VERSION = 4
 
-def clean_text(raw: str) -> str:
-    lines = raw.splitlines()
-    cleaned = []
+# ===== 可调参数 =====
+RUNNING_EDGE_LINES = 2     # 每页开头、结尾各取几行作为页眉/页脚候选
+RUNNING_RATIO = 0.3        # 候选行在至少这么多比例的页上出现才算页眉页脚（奇偶页不同的页眉各占不到一半）
+RUNNING_MIN_PAGES = 3      # 且至少出现这么多页
+RUNNING_WINDOW = 8         # 先攒这么多页再开始判断，之后每页来了就判断
+RUNNING_MAX_CHARS = 120    # 更长的行是正文，不当作页眉页脚
+CLEAN_WORKERS = os.cpu_count() or 2   # clean_batch 的进程数
+# ===================
 
-    for line in lines:
-        line = line.strip()
 
-        if not line:
-            continue
+_DIGITS = re.compile(r"\d+")
+# str.splitlines 认的所有换行（\r\n、\r、\v、\f、\x1c-\x1e、\x85、\u2028、\u2029），规则引擎只认 \n
+_BREAKS = re.compile("\r\n?|[\v\f\x1c-\x1e\x85\u2028\u2029]")
+_BREAK_CHARS = re.compile("[\r\v\f\x1c-\x1e\x85\u2028\u2029]")
 
-        # 页码
-        if re.fullmatch(r"\d+", line):
-            continue
 
-        # 图表
-        if line.lower().startswith(("figure", "fig.", "table")):
-            continue
+def _normalize_breaks(text: str) -> str:
+    # 绝大多数文本只有 \n：先找一遍，没有别的换行就原样返回
+    return _BREAKS.sub("\n", text) if _BREAK_CHARS.search(text) else text
+
+
+def _fingerprint(line: str) -> int:
+    # 忽略大小写、数字和空白差异：页码、卷期号、"Page 3 of 12" 在各页上的指纹相同
+    return hash(" ".join(_DIGITS.sub("", line.lower()).split()))
+
+
+class RunningLines:
+    """
+    去掉 PDF 每页重复的页眉页脚（期刊名、DOI、作者、版权行……），避免每页都读一遍
+    - 只看每页开头/结尾 RUNNING_EDGE_LINES 个非空行，逐页累计它们的指纹出现在多少页上
+    - 指纹出现的页数 ≥ max(RUNNING_MIN_PAGES, RUNNING_RATIO × 已读页数) 时，该行在页边出现就删掉
+    - 只遍历一遍：先攒 RUNNING_WINDOW 页统计，之后的页到了即判断，不必等整本书读完
+    只处理 kind == "page" 的单元（PDF）；其他单元原样透传。纯文本（str）按页处理
+    removed_chars / removed_lines 为已删掉的字数、行数
+    """
+
+    def __init__(self, edge_lines=RUNNING_EDGE_LINES, ratio=RUNNING_RATIO, min_pages=RUNNING_MIN_PAGES,
+                 window=RUNNING_WINDOW):
+        self.edge_lines = edge_lines
+        self.ratio = ratio
+        self.min_pages = min_pages
+        self.window = window
+        self.counts = {}
+        self.pages = 0
+        self.removed_chars = 0
+        self.removed_lines = 0
+
+    def _learn(self, text: str):
+        # 记下这一页页边候选行的指纹，返回 (各行, {行号: 指纹})
+        lines = _normalize_breaks(text).split("\n")
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        edges = set(filled[:self.edge_lines] + filled[-self.edge_lines:])
+        fps = {i: _fingerprint(lines[i]) for i in edges if len(lines[i].strip()) <= RUNNING_MAX_CHARS}
+        for fp in set(fps.values()):
+            self.counts[fp] = self.counts.get(fp, 0) + 1
+        self.pages += 1
+        return lines, fps
+
+    def _strip(self, lines, fps) -> str:
+        need = max(self.min_pages, self.ratio * self.pages)
+        kept = []
+        for i, line in enumerate(lines):
+            if i in fps and self.counts[fps[i]] >= need:
+                self.removed_chars += len(line.strip())
+                self.removed_lines += 1
+            else:
+                kept.append(line)
+        return "\n".join(kept)
+
+    def _emit(self, unit, lines, fps):
+        text = self._strip(lines, fps)
+        return text if isinstance(unit, str) else unit._replace(text=text)
+
+    def filter(self, units):
+        pending = []   # 攒够 window 页之前的单元：(单元, 各行, 指纹)，非页单元不统计
+        for unit in units:
+            is_page = isinstance(unit, str) or unit.kind == "page"
+            if not is_page:
+                if pending:
+                    pending.append((unit, None, None))
+                else:
+                    yield unit
+                continue
+
+            lines, fps = self._learn(unit if isinstance(unit, str) else unit.text)
+            if self.pages < self.window:
+                pending.append((unit, lines, fps))
+                continue
+            for item in pending:
+                yield item[0] if item[1] is None else self._emit(*item)
+            pending.clear()
+            yield self._emit(unit, lines, fps)
+
+        for item in pending:
+            yield item[0] if item[1] is None else self._emit(*item)
+
+
+# =========================
+# 行规则引擎
+# 规则按顺序排列，每条是 (动作, 名称, 正则, 范围)：
+#   动作 keep  保留该行（写在 drop 规则前面，作为例外）
+#        drop  丢掉该行
+#        stop  从该行起后面的内容都不要（参考文献）
+#   范围 line      正则匹配去掉首尾空白后的整行（写成单行的正则，不要匹配换行）
+#        contains  正则在行内任意位置出现即可（只判定没有被整行规则命中的行）
+# 整行规则编译成一个正则、行内规则编译成另一个，每个单元（页/章节）各扫描一遍，
+# 都在正则引擎里完成，只有命中的行才回到 Python；一行同时满足多条整行规则时按顺序取第一条
+# =========================
+RULES = [
+    ("drop", "page_number", r"\d+", "line"),
+    ("drop", "figure", r"(?i:figure|fig\.|table).*", "line"),
+    ("stop", "references", r"(?i:references|bibliography).*", "line"),
+    # 公式（简单过滤）
+    ("drop", "formula", r"[=∑∫λ]", "contains"),
+]
+ACTIONS = ("keep", "drop", "stop")
+_NEVER = re.compile(r"(?!)")
+
+
+@lru_cache(maxsize=16)
+def _compile(rules):
+    # 同一套规则在每个进程里只编译一次；Cleaner 实例只多一个 stopped 状态
+    lines, contains = [], []
+    actions = {}
+    for i, (action, name, pattern, scope) in enumerate(rules):
+        if action not in ACTIONS:
+            raise ValueError(f"未知的规则动作: {action}（规则 {name}）")
+        if scope not in ("line", "contains"):
+            raise ValueError(f"未知的规则范围: {scope}（规则 {name}）")
+        actions[f"r{i}"] = action
+        (lines if scope == "line" else contains).append(f"(?P<r{i}>{pattern})")
+    # 整行规则以换行符开头（不用 ^）：正则引擎可以直接跳到下一个换行符，而不是逐个位置尝试
+    line_rules = re.compile(r"\n[^\S\n]*(?:" + "|".join(lines) + r")[^\S\n]*(?=\n)") if lines else _NEVER
+    contains_rules = re.compile("|".join(contains)) if contains else _NEVER
+    return actions, line_rules, contains_rules
+
+
+class Cleaner:
+    """
+    编译好的清洗规则；同一个实例依次 feed 一本书的各个单元，遇到 stop 规则后记住状态，
+    之后的单元都返回空串
+    """
+
+    def __init__(self, rules=RULES):
+        self.actions, self.line_rules, self.contains_rules = _compile(tuple(rules))
+        self.stopped = False
+
+    def feed(self, raw: str) -> str:
+        """清洗一个单元，返回去掉多余空白、各行以空格相连的文本"""
+        if self.stopped:
+            return ""
+        # 各种换行统一成 \n，与按 splitlines 逐行判断的结果一致；首尾补换行，第一行和最后一行也是"两个换行之间"
+        text = "\n" + _normalize_breaks(raw) + "\n"
+        pieces = []
+        kept = 0   # text[kept:] 还没有被规则去掉
+        pos = 0
+        line = self.line_rules.search(text)
+        inner = self.contains_rules.search(text)
+        while line or inner:
+            # 行内命中在前面：它所在的行没有被整行规则命中（否则整行规则的匹配会更早开始）
+            if inner and (not line or inner.start() < line.start()):
+                m = inner
+                start = text.rfind("\n", 0, m.start()) + 1
+                end = text.find("\n", m.end())
+            else:
+                m = line
+                start, end = m.start() + 1, m.end()
+            action = self.actions[m.lastgroup]
+            if action != "keep":
+                pieces.append(text[kept:start])
+                kept = end
+                if action == "stop":
+                    self.stopped = True
+                    break
+            pos = end
+            if line and line.start() < pos:
+                line = self.line_rules.search(text, pos)
+            if inner and inner.start() < pos:
+                inner = self.contains_rules.search(text, pos)
+        else:
+            pieces.append(text[kept:])
+        return " ".join("".join(pieces).split())
+
+    def clean(self, raw: str) -> str:
+        """
+        整段文本清洗；raw 里用换页符（\\f）分隔各页时（见 ingest.load_document），先去掉重复的页眉页脚
+        """
+        if "\f" in raw:
+            raw = "\n".join(RunningLines().filter(raw.split("\f")))
+        return self.feed(raw)
+
+
+def clean_text(raw: str) -> str:
+    return Cleaner().clean(raw)
+
+
+def clean_batch(texts, workers=CLEAN_WORKERS, chunksize=8):
+    """
+    批量清洗多篇文档（各自独立，互不影响参考文献截断），按输入顺序返回
+    篇数多时分给进程池并行；workers <= 1 或只有一篇时在当前进程里做
+    """
+    texts = list(texts)
+    if workers <= 1 or len(texts) < 2:
+        return [clean_text(t) for t in texts]
+    # spawn 启动：调用方可能有别的线程在跑（如 TTS 引擎），fork 带锁的线程可能死锁
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(clean_text, texts, chunksize=chunksize))
 
-        # 参考文献
-        if re.match(r"(references|bibliography)", line.lower()):
-            break
 
-        # 公式（简单过滤）
-        if any(sym in line for sym in ["=", "∑", "∫", "λ"]):
+def iter_clean(texts, rules=RULES):
+    """
+    流式清洗：逐个单元（页/章节）清洗后产出
+    遇到参考文献即停止，后续单元不再读取
+    章节标记（ingest.ChapterMark）不是文本，原样传下去
+    """
+    cleaner = Cleaner(rules)
+    for raw in texts:
+        if not isinstance(raw, str):
+            yield raw
             continue
+        text = cleaner.feed(raw)
+        if text:
+            yield text
+        if cleaner.stopped:
+            return
 
-        cleaned.append(line)
 
-    text = " ".join(cleaned)
-    text = re.sub(r"\s{2,}", " ", text)
-    return text
+def cache_params():
+    """影响清洗结果的全部版本号和参数，text_cache.text_key 据此判断缓存是否失效"""
+    return [CLEANER_VERSION, RUNNING_EDGE_LINES, RUNNING_RATIO, RUNNING_MIN_PAGES,
+            RUNNING_WINDOW, RUNNING_MAX_CHARS, RULES]
@@ -0,0 +1,61 @@
+import asyncio
+import random
+from pathlib import Path
+
+# edge-tts 的输出格式：MPEG-2 Layer III，24 kHz，48 kbps，单声道
+# 每帧 576 个采样 = 24 ms，帧长 144 字节
+FRAME_HEADER = b"\xff\xf3\x64\xc4"
+FRAME_SECONDS = 576 / 24000
+
+
+def fake_mp3(seconds: float, seed=None) -> bytes:
+    """
+    生成指定时长、帧结构合法的 mp3 字节（内容是随机噪声）
+    """
+    rnd = random.Random(seed)
+    frames = max(1, round(seconds / FRAME_SECONDS))
+    return b"".join(FRAME_HEADER + rnd.randbytes(140) for _ in range(frames))
+
+
+class FakeBackend:
+    """
+    本地假 TTS 后端，不联网，用来测试/压测并发引擎：
+    - 每次请求等待 latency ± jitter 秒，模拟网络往返
+    - 以 error_rate 的概率抛出 ConnectionError，模拟网络抖动（走引擎的重试）
+    - 输出帧结构合法的 mp3：给了 seconds_per_char 时按文字长度生成对应时长的音频，
+      否则输出固定的 payload；并返回均匀分布的逐词时间
+    - seed 固定后，延迟、失败和音频内容都可复现
+
+    用法：
+        from tts import configure_engine
+        configure_engine(backend=FakeBackend(latency=0.5), rate=100, burst=100)
+    """
+
+    def __init__(self, latency=0.3, jitter=0.1, payload=FRAME_HEADER + b"\x00" * 140,
+                 error_rate=0.0, seconds_per_char=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.payload = payload
+        self.error_rate = error_rate
+        self.seconds_per_char = seconds_per_char
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    async def __call__(self, text: str, voice: str, rate: str, output: Path):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise ConnectionError("fake backend: simulated network error")
+
+        if self.seconds_per_char:
+            payload = fake_mp3(len(text) * self.seconds_per_char, seed=self.random.random())
+        else:
+            payload = self.payload
+        Path(output).write_bytes(payload)
+
+        # 逐词时间：按空白切词（中文按字），均匀铺满整段音频
+        words = text.split() if " " in text.strip() else list(text.strip())
+        step = int(len(payload) // 144 * FRAME_SECONDS * 1000 / max(1, len(words)))
+        return [[i * step, step, w] for i, w in enumerate(words)]
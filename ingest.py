@@ -1,62 +1,411 @@
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
 import pdfplumber
 import docx
+import multiprocessing
 import os
+import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
 from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import unquote
 
-def load_document(file_path):
+# ===== 可调参数 =====
+TXT_BLOCK_SIZE = 1 << 20   # TXT 每次读取的字符数（按整行切块）；MOBI 解出的 HTML 也按这个大小分块解析
+PDF_WORKERS = os.cpu_count() or 1   # PDF 并行解析的进程数
+PDF_PARALLEL_MIN_PAGES = 40         # 少于这么多页的 PDF 直接单进程解析
+PDF_SHARD_PAGES = 16                # 每个进程一次解析的最少页数
+# ===================
+
+# 抽取结果有变化时加 1，使已缓存的解析文本失效（见 text_cache.py）
+INGEST_VERSION = 2
+
+
+class DocUnit(NamedTuple):
+    """
+    文档的一个单元（页 / 段落 / 章节 / 文本块）
+    - text 自带结尾换行，直接拼接即得到整本书
+    - kind + index 记录它在源文件中的位置，index 从 0 开始
+    - chapter 不为 None 表示书里的一章从这个单元开始，值为章节标题（可能为空串）
+    """
+    text: str
+    kind: str
+    index: int
+    chapter: Optional[str] = None
+
+
+class ChapterMark:
+    """
+    文本流里的章节边界（标题可能为空）
+    清洗、切分阶段原样传下去；流水线据此让音频章节跟随书的章节
+    """
+
+    def __init__(self, title=""):
+        self.title = title
+
+    def __repr__(self):
+        return f"ChapterMark({self.title!r})"
+
+
+def iter_texts(units):
+    # DocUnit 流 → 文本流，章节开始处插入 ChapterMark
+    for unit in units:
+        if unit.chapter is not None:
+            yield ChapterMark(unit.chapter)
+        yield unit.text
+
+
+# =========================
+# 流式 HTML 抽取（EPUB / MOBI）
+# 标准库 HTMLParser 的状态机：边喂边产出文本，跳过脚本/样式/脚注，块级元素换行
+# =========================
+_SKIP_TAGS = {"script", "style", "head", "noscript", "svg", "math", "rt", "rp"}
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "blockquote", "section", "article", "pre", "dd", "dt",
+               "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol", "hr", "mbp:pagebreak"}
+_HEADING_TAGS = {"h1", "h2"}
+# epub:type / role 里出现这些词的元素是脚注、尾注或注释角标，不朗读
+_NOTE_WORDS = {"footnote", "footnotes", "endnote", "endnotes", "rearnote", "rearnotes", "noteref",
+               "doc-footnote", "doc-endnote", "doc-endnotes", "doc-noteref"}
+
+
+class _HtmlText(HTMLParser):
+    """
+    anchors：元素 id → 章节标题，遇到这些元素时插入 ChapterMark（EPUB 目录指向文件内锚点时用）
+    heading_marks：h1/h2 处插入 ChapterMark，标题取标题元素的文字（MOBI 没有目录时用）
+    解析结果在 out 里：文本片段和 ChapterMark 交替，take() 取走已确定的部分
+    """
+
+    def __init__(self, anchors=None, heading_marks=False):
+        super().__init__(convert_charrefs=True)
+        self.anchors = anchors or {}
+        self.heading_marks = heading_marks
+        self.out = []
+        self.skip = None        # 正在跳过的元素名及嵌套层数
+        self.skip_depth = 0
+        self.heading = None     # 正在读取标题的 ChapterMark
+        self.heading_text = []
+
+    def _is_note(self, attrs):
+        for name, value in attrs:
+            if name in ("epub:type", "role") and value and _NOTE_WORDS & set(value.split()):
+                return True
+        return False
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip is not None:
+            if tag == self.skip:
+                self.skip_depth += 1
+            return
+        if tag in _SKIP_TAGS or self._is_note(attrs):
+            self.skip, self.skip_depth = tag, 1
+            return
+        anchor = dict(attrs).get("id")
+        if anchor in self.anchors:
+            self.out.append(ChapterMark(self.anchors[anchor]))
+        if tag in _BLOCK_TAGS:
+            self.out.append("\n")
+        if self.heading_marks and tag in _HEADING_TAGS and self.heading is None:
+            self.heading = ChapterMark()
+            self.heading_text = []
+            self.out.append(self.heading)
+
+    def handle_startendtag(self, tag, attrs):
+        # <a id="ch2"/>、<br/> 这类自闭合元素
+        if self.skip is not None:
+            return
+        anchor = dict(attrs).get("id")
+        if anchor in self.anchors:
+            self.out.append(ChapterMark(self.anchors[anchor]))
+        if tag in _BLOCK_TAGS:
+            self.out.append("\n")
+
+    def handle_endtag(self, tag):
+        if self.skip is not None:
+            if tag == self.skip:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip = None
+            return
+        if tag in _BLOCK_TAGS:
+            self.out.append("\n")
+        if self.heading is not None and tag in _HEADING_TAGS:
+            self.heading.title = re.sub(r"\s+", " ", "".join(self.heading_text)).strip()
+            self.heading = None
+
+    def handle_data(self, data):
+        if self.skip is not None:
+            return
+        data = re.sub(r"\s+", " ", data)
+        self.out.append(data)
+        if self.heading is not None:
+            self.heading_text.append(data)
+
+    def take(self):
+        # 标题还没读完时，它的 ChapterMark 及之后的内容先留着
+        cut = len(self.out) if self.heading is None else self.out.index(self.heading)
+        items, self.out = self.out[:cut], self.out[cut:]
+        return items
+
+
+def _html_units(chunks, kind, start_index=0, anchors=None, heading_marks=False, chapter=None):
+    """
+    把分块到来的 HTML 解析成 DocUnit：每遇到一个 ChapterMark 就开始一个新单元
+    chapter 为第一个单元的章节标题（None 表示接着上一章）
+    内存里只有当前块和当前单元的文本
+    """
+    parser = _HtmlText(anchors, heading_marks)
+    index = start_index
+    text = []
+
+    def flush(final=False):
+        # 没有文字的章节（如只有一张图的扉页）不单独产出，标题被下一个章节标记取代；
+        # 只有到了结尾才产出空单元，把章节边界传下去
+        nonlocal text, index, chapter
+        body = "".join(text)
+        # 折叠块级元素之间多余的换行和行首尾空白
+        body = re.sub(r"[ \t]*\n[\s]*", "\n", body).strip()
+        text = []
+        if not body and (chapter is None or not final):
+            return None
+        unit = DocUnit(body + "\n" if body else "", kind, index, chapter)
+        index += 1
+        chapter = None
+        return unit
+
+    def drain(items):
+        nonlocal chapter
+        for item in items:
+            if isinstance(item, ChapterMark):
+                unit = flush()
+                if unit is not None:
+                    yield unit
+                chapter = item.title
+            else:
+                text.append(item)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from drain(parser.take())
+        # 单元太长（没有章节标记的大文件）时按块产出，内存有界
+        if sum(map(len, text)) >= TXT_BLOCK_SIZE:
+            unit = flush()
+            if unit is not None:
+                yield unit
+    parser.close()
+    parser.heading = None
+    yield from drain(parser.take())
+    unit = flush(final=True)
+    if unit is not None:
+        yield unit
+
+
+def _toc_targets(toc):
+    """
+    把嵌套目录拍平成 {文件名: [(锚点 或 None, 标题), ...]}（按目录顺序）
+    """
+    targets = {}
+
+    def walk(entries):
+        for entry in entries:
+            if isinstance(entry, tuple):
+                section, children = entry
+                if getattr(section, "href", None):
+                    add(section.href, section.title)
+                walk(children)
+            elif getattr(entry, "href", None):
+                add(entry.href, entry.title)
+
+    def add(href, title):
+        name, _, anchor = unquote(href).partition("#")
+        targets.setdefault(name, []).append((anchor or None, title or ""))
+
+    walk(toc)
+    return targets
+
+
+def _iter_epub(path):
+    """
+    按 spine（阅读顺序）逐个文档解析
+    - 目录指向的文件（或文件内锚点）开始新的一章，标题取目录里的标题
+    - 没有可用目录时，每个 spine 文档算一章，文档内的 h1/h2 也分章
+    - 跳过导航文档和非线性（linear="no"，如脚注页）的文档
+    """
+    book = epub.read_epub(str(path))
+    targets = _toc_targets(book.toc)
+    docs = []
+    for idref, linear in book.spine:
+        item = book.get_item_with_id(idref)
+        if (item is None or item.get_type() != ebooklib.ITEM_DOCUMENT or isinstance(item, epub.EpubNav)
+                or linear == "no"):
+            continue
+        docs.append(item)
+    use_toc = any(item.get_name() in targets for item in docs)
+
+    index = 0
+    for n, item in enumerate(docs):
+        entries = targets.get(item.get_name(), []) if use_toc else [(None, "")]
+        chapter = next((title for anchor, title in entries if anchor is None), None)
+        if use_toc and n == 0 and chapter is None:
+            chapter = ""   # 目录之前的内容（封面、版权页）单独算一章
+        anchors = {anchor: title for anchor, title in entries if anchor}
+        content = item.get_content().decode("utf-8", errors="ignore")
+        for unit in _html_units([content], "chapter", index, anchors, heading_marks=not use_toc, chapter=chapter):
+            yield unit
+            index = unit.index + 1
+
+
+def _iter_mobi(path):
+    """
+    MOBI：mobi 库把书解到临时目录，解出的 HTML 按块读取、流式解析，不整本读进内存
+    h1/h2 处分章；KF8 格式解出来是 EPUB，按 EPUB 处理
+    """
+    # 只有 MOBI 用到 mobi 库：没装时不影响其他格式
+    import mobi
+
+    temp_dir, book_file = mobi.extract(str(path))
+    try:
+        if book_file.lower().endswith(".epub"):
+            yield from _iter_epub(book_file)
+            return
+
+        def blocks():
+            with open(book_file, "r", encoding="utf-8", errors="ignore") as f:
+                while True:
+                    block = f.read(TXT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+
+        yield from _html_units(blocks(), "chapter", heading_marks=True, chapter="")
+    finally:
+        # 清理临时解压出的文件夹，保持环境干净
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+
+def _extract_pdf_pages(path, start, stop):
+    # 子进程里执行：独立打开 PDF，解析 [start, stop) 页
+    texts = []
+    with pdfplumber.open(path) as pdf:
+        for i in range(start, stop):
+            page = pdf.pages[i]
+            texts.append(page.extract_text() or "")
+            # 释放已解析页面的缓存，避免整本书的对象常驻内存
+            page.flush_cache()
+    return texts
+
+
+def _iter_pdf(path, workers=None):
+    """
+    按页产出 PDF 文本：
+    - 大文件把页码区间分片交给进程池，各进程独立打开文件，结果按页序拼回
+    - 小文件或只有一个核时单进程解析
+    - 进程池用 spawn 启动：这里是在流水线线程里，TTS 事件循环线程同时在跑，fork 带锁的线程可能死锁
+    """
+    workers = workers or PDF_WORKERS
+    with pdfplumber.open(path) as pdf:
+        total = len(pdf.pages)
+        if workers <= 1 or total < PDF_PARALLEL_MIN_PAGES:
+            for idx, page in enumerate(pdf.pages):
+                content = page.extract_text()
+                if content:
+                    yield DocUnit(content + "\n", "page", idx)
+                page.flush_cache()
+            return
+
+    shard = max(PDF_SHARD_PAGES, total // (workers * 4))
+    starts = list(range(0, total, shard))
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # 最多提前提交 2 × workers 个分片，保证按页序产出的同时内存有界
+        pending = []
+        for start in starts:
+            pending.append((start, pool.submit(_extract_pdf_pages, str(path), start, min(start + shard, total))))
+            if len(pending) < workers * 2:
+                continue
+            yield from _pdf_units(*pending.pop(0))
+        for start, fut in pending:
+            yield from _pdf_units(start, fut)
+
+
+def _pdf_units(start, fut):
+    for offset, content in enumerate(fut.result()):
+        if content:
+            yield DocUnit(content + "\n", "page", start + offset)
+
+
+def _txt_cut(block: str) -> int:
+    # 超长行的切点：最后一个句末标点之后，其次最后一个空白之后，都没有就整块切下
+    cut = max(block.rfind(c) for c in "。！？；.!?") + 1
+    if cut == 0:
+        cut = max(block.rfind(c) for c in " \t\u3000") + 1
+    return cut or len(block)
+
+
+def iter_document(file_path, workers=None):
+    """
+    逐单元读取文档，内存只保留当前单元：
+    PDF 按页、DOCX 按段落、EPUB / MOBI 按阅读顺序逐章（带章节边界，见 DocUnit.chapter）、TXT 按整行文本块
+    workers 为 PDF 并行解析的进程数，默认 PDF_WORKERS
+    """
     path = Path(file_path)
     ext = path.suffix.lower()
 
     # --- 1. 处理 TXT ---
     if ext == '.txt':
         with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+            idx, rest = 0, ""
+            while True:
+                block = f.read(TXT_BLOCK_SIZE)
+                if not block:
+                    break
+                # 只在整行处切开，行不会被拆到两个单元里
+                block = rest + block
+                cut = block.rfind("\n") + 1
+                if cut == 0:
+                    if len(block) < TXT_BLOCK_SIZE:
+                        rest = block
+                        continue
+                    # 超长的一行（整个文件没有换行）：在最后一个句末标点、其次空白处切开，内存不随文件增长
+                    cut = _txt_cut(block)
+                rest = block[cut:]
+                yield DocUnit(block[:cut], "block", idx)
+                idx += 1
+            if rest:
+                yield DocUnit(rest, "block", idx)
 
     # --- 2. 处理 PDF ---
     elif ext == '.pdf':
-        text = ""
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                content = page.extract_text()
-                if content:
-                    text += content + "\n"
-        return text
+        yield from _iter_pdf(path, workers)
 
     # --- 3. 处理 DOCX ---
     elif ext == '.docx':
         doc = docx.Document(path)
-        return "\n".join([p.text for p in doc.paragraphs])
+        for idx, p in enumerate(doc.paragraphs):
+            yield DocUnit(p.text + "\n", "paragraph", idx)
 
     # --- 4. 处理 EPUB ---
     elif ext == '.epub':
-        book = epub.read_epub(str(path))
-        chapters = []
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                chapters.append(soup.get_text())
-        return "\n".join(chapters)
-
-    # --- 5. 处理 MOBI (新增) ---
+        yield from _iter_epub(path)
+
+    # --- 5. 处理 MOBI ---
     elif ext == '.mobi':
-        # mobi 库会将内容解压到一个临时目录
-        temp_dir, html_file = mobi.extract(str(path))
-        with open(html_file, 'r', encoding='utf-8', errors='ignore') as f:
-            html_content = f.read()
-        
-        # 提取纯文本并清理临时文件
-        soup = BeautifulSoup(html_content, 'html.parser')
-        text = soup.get_text()
-        
-        # 清理临时解压出的文件夹，保持环境干净
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        return text
+        yield from _iter_mobi(path)
 
     else:
 
         raise ValueError(f"暂不支持的文件格式: {ext}")
+
+
+def load_document(file_path, workers=None):
+    # 一次性读取整本书：就是把 iter_document 的各单元拼起来；PDF 各页之间加换页符，
+    # cleaner.clean_text 据此识别重复的页眉页脚
+    return "".join(("\f" if unit.kind == "page" and unit.index else "") + unit.text
+                   for unit in iter_document(file_path, workers))
+
+
+def cache_params():
+    """影响抽取结果的全部版本号和参数，text_cache.text_key 据此判断缓存是否失效"""
+    return [INGEST_VERSION, TXT_BLOCK_SIZE]
@@ -0,0 +1,242 @@
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+
+from pipeline import run_pipeline
+import shelf_index
+
+# ===== 可调参数 =====
+BASE_DIR = Path(__file__).parent.resolve()
+JOBS_DB = BASE_DIR / "jobs.sqlite"
+JOB_WORKERS = 2        # 同时转化的书数；TTS 总并发由共享引擎统一限制
+HEARTBEAT = 10         # 运行中任务的心跳间隔（秒）
+STALE_AFTER = 60       # 心跳超过这么久没更新，视为 worker 已退出，任务重新排队
+# ===================
+
+
+class JobQueue:
+    """
+    持久化的转化任务队列（SQLite）：
+    - 页面只负责入队和查询进度，转化在 worker 线程里进行
+    - 进程重启后，中断的任务重新排队，流水线会跳过已完成的段落继续做
+    - 状态：queued / running / done / partial（有段落重试后仍失败）/ failed（任务出错）
+    """
+
+    def __init__(self, db_path=JOBS_DB):
+        self.db_path = str(db_path)
+        with self._db() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    book_dir TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    voice TEXT NOT NULL,
+                    rate TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    done INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    total_final INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    started REAL,
+                    updated REAL,
+                    finished REAL
+                )
+            """)
+
+    @contextmanager
+    def _db(self):
+        # 每次操作一个连接，各线程/进程互不干扰
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def active_job(self, book_dir: Path):
+        """这本书排队中/运行中的任务，没有时返回 None"""
+        with self._db() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE book_dir = ? AND status IN ('queued', 'running') ORDER BY id LIMIT 1",
+                (str(book_dir),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def enqueue(self, book_dir: Path, source: Path, voice: str, rate: str) -> int:
+        with self._db() as db:
+            # 同一本书已在排队/运行时不重复入队
+            row = db.execute(
+                "SELECT id FROM jobs WHERE book_dir = ? AND status IN ('queued', 'running')",
+                (str(book_dir),)
+            ).fetchone()
+            if row:
+                return row["id"]
+            cur = db.execute(
+                "INSERT INTO jobs (book_dir, source, voice, rate, created) VALUES (?, ?, ?, ?, ?)",
+                (str(book_dir), str(source), voice, rate, time.time())
+            )
+            return cur.lastrowid
+
+    def claim(self):
+        """原子地领取一个排队中的任务"""
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # 心跳超时的 running 任务重新排队（worker 崩溃或进程被杀）
+            db.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated < ?",
+                (time.time() - STALE_AFTER,)
+            )
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row:
+                now = time.time()
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, updated = ?, error = NULL WHERE id = ?",
+                    (now, now, row["id"])
+                )
+            db.execute("COMMIT")
+            return dict(row) if row else None
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        with self._db() as db:
+            db.execute(
+                f"UPDATE jobs SET updated = ? WHERE id IN ({','.join('?' * len(job_ids))})",
+                (time.time(), *job_ids)
+            )
+
+    def progress(self, job_id: int, done: int, total: int, total_final: bool):
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET done = ?, total = ?, total_final = ?, updated = ? WHERE id = ?",
+                (done, total, int(total_final), time.time(), job_id)
+            )
+
+    def finish(self, job_id: int, error=None, failed=0):
+        """error 为任务出错的原因；failed 为重试后仍失败的段数，非 0 时任务记为 partial"""
+        if error:
+            status = "failed"
+        elif failed:
+            status, error = "partial", f"{failed} 段合成失败，重新转化可补齐"
+        else:
+            status = "done"
+        with self._db() as db:
+            now = time.time()
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ?, finished = ? WHERE id = ?",
+                (status, error, now, now, job_id)
+            )
+
+    def list_jobs(self, limit=20):
+        """最近的任务，附带进度比例和预计剩余时间（秒）"""
+        with self._db() as db:
+            rows = db.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["fraction"] = job["done"] / job["total"] if job["total"] else 0.0
+            job["eta"] = None
+            if job["status"] == "running" and job["done"] and job["total_final"]:
+                elapsed = time.time() - job["started"]
+                job["eta"] = elapsed / job["done"] * (job["total"] - job["done"])
+            jobs.append(job)
+        return jobs
+
+    def active_books(self):
+        """有任务在排队/运行的书目录（字符串集合）"""
+        with self._db() as db:
+            rows = db.execute("SELECT DISTINCT book_dir FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return {row["book_dir"] for row in rows}
+
+    def has_active(self) -> bool:
+        with self._db() as db:
+            return db.execute(
+                "SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1"
+            ).fetchone() is not None
+
+
+class WorkerPool:
+    """
+    本地 worker 线程池，不断从队列领取任务并运行流水线
+    所有任务共用 tts.get_engine() 的并发上限与令牌桶
+    """
+
+    def __init__(self, queue: JobQueue, workers=JOB_WORKERS, poll=1.0):
+        self.queue = queue
+        self.poll = poll
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self.threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for t in self.threads:
+            t.start()
+
+    def _heartbeat(self):
+        while not self.stop.wait(HEARTBEAT):
+            with self.lock:
+                ids = list(self.running)
+            self.queue.heartbeat(ids)
+
+    def _work(self):
+        while not self.stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stop.wait(self.poll)
+                continue
+
+            with self.lock:
+                self.running.add(job["id"])
+            try:
+                result = self._run(job)
+                self.queue.finish(job["id"], failed=len(result["failed"]))
+            except Exception as e:
+                traceback.print_exc()
+                self.queue.finish(job["id"], error=f"{type(e).__name__}: {e}")
+            finally:
+                with self.lock:
+                    self.running.discard(job["id"])
+
+    def _run(self, job):
+        book_dir = Path(job["book_dir"])
+        last = [0.0]
+
+        def on_progress(done, total, total_final):
+            # 写库限频，避免每段都写一次
+            now = time.time()
+            if (total_final and done == total) or now - last[0] >= 1:
+                last[0] = now
+                self.queue.progress(job["id"], done, total, total_final)
+
+        result = run_pipeline(Path(job["source"]), book_dir, voice=job["voice"], rate=job["rate"],
+                              on_progress=on_progress)
+        self.queue.progress(job["id"], result["chunks"], result["chunks"], True)
+        shelf_index.update_book(book_dir)
+        return result
+
+    def close(self):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+
+
+if __name__ == "__main__":
+    # 独立运行 worker：python jobs.py
+    pool = WorkerPool(JobQueue())
+    print(f"🛠 worker 已启动（{JOB_WORKERS} 个），等待任务…")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        # 未完成的任务会在心跳超时后重新排队，下次启动接着做
+        pass
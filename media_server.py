@@ -0,0 +1,183 @@
+import mimetypes
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+from segment_pack import PACK_DIR, SegmentPack, has_pack
+
+# ===== 可调参数 =====
+# 监听地址：缺省跟 Streamlit 一致（server.address 没配置时 Streamlit 监听所有网卡，这里也一样），
+# 只想给本机用时设为 127.0.0.1
+MEDIA_HOST = os.environ.get("LISTEN_MEDIA_HOST", "")
+MEDIA_PORT = int(os.environ.get("LISTEN_MEDIA_PORT", "8599"))
+# 有反向代理/HTTPS 时可指定对外地址，如 https://example.com/media
+MEDIA_BASE_URL = os.environ.get("LISTEN_MEDIA_URL", "")
+# 允许跨域读取（timing.json、播放列表）的页面来源，逗号分隔；缺省只允许与媒体服务同一主机名的页面
+MEDIA_ALLOW_ORIGINS = [o.strip().rstrip("/") for o in os.environ.get("LISTEN_MEDIA_ORIGINS", "").split(",") if o.strip()]
+COPY_BLOCK = 256 * 1024
+# ===================
+
+mimetypes.add_type("audio/mpeg", ".mp3")
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+# 转码后的紧凑章节（见 transcode.py）
+mimetypes.add_type("audio/mp4", ".m4a")
+mimetypes.add_type("audio/ogg", ".opus")
+
+
+# 只对外提供播放需要的文件：音频、播放列表、章节逐词时间；源文档、清单、日志等一律 404
+SERVED_SUFFIXES = (".mp3", ".m4a", ".opus", ".m3u8", ".timing.json")
+
+
+def servable(name: str) -> bool:
+    return name.lower().endswith(SERVED_SUFFIXES) and ".part" not in name
+
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    """
+    只读静态文件服务，支持 HTTP Range：
+    浏览器可以边下边播、任意拖动进度条，不必一次性拿到整个文件
+    只提供 SERVED_SUFFIXES 里的文件；跨域读取只放行 _allowed_origin 认可的页面
+    <书>/pack/<段号>.mp3 是打包存储里的一段，按索引从 audio.bin 的对应区间读取
+    """
+
+    root: Path = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self):
+        rel = unquote(urlsplit(self.path).path).lstrip("/")
+        path = (self.root / rel).resolve()
+        # 只允许访问 root 目录之内的文件
+        if self.root != path and self.root not in path.parents:
+            return None
+        if not servable(path.name):
+            return None
+        if path.is_file():
+            return path, 0, path.stat().st_size
+        book = path.parent.parent
+        if path.parent.name == PACK_DIR and path.suffix == ".mp3" and path.stem.isdigit() and has_pack(book):
+            with SegmentPack(book, readonly=True) as pack:
+                loc = pack.locate(int(path.stem))
+            if loc:
+                return path.parent / "audio.bin", loc[0], loc[1]
+        return None
+
+    def _allowed_origin(self):
+        """
+        请求页面的来源可以跨域读取时返回它，否则返回 None：
+        配置了 MEDIA_ALLOW_ORIGINS 时按列表放行；缺省只放行与媒体服务同一主机名的页面（即 Streamlit 本身）
+        """
+        origin = self.headers.get("Origin", "").rstrip("/")
+        if not origin or origin == "null":
+            return None
+        if MEDIA_ALLOW_ORIGINS:
+            return origin if origin in MEDIA_ALLOW_ORIGINS else None
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0].strip("[]")
+        return origin if host and urlsplit(origin).hostname == host else None
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        found = self._resolve()
+        if found is None:
+            self.send_error(404)
+            return
+
+        path, base, size = found
+        start, end = 0, size - 1
+        status = 200
+
+        m = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "").strip())
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:
+                # bytes=-N：最后 N 个字节
+                start = max(0, size - int(m.group(2)))
+            if start > end or start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        name = unquote(urlsplit(self.path).path)
+        self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        origin = self._allowed_origin()
+        if origin:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+        self.send_header("Cache-Control", "no-cache")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+
+        remaining = end - start + 1
+        try:
+            with open(path, "rb") as f:
+                f.seek(base + start)
+                while remaining > 0:
+                    block = f.read(min(COPY_BLOCK, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            # 浏览器拖动进度条时会主动断开旧连接
+            pass
+
+
+def start_media_server(root: Path, host=MEDIA_HOST, port=MEDIA_PORT):
+    """
+    在后台线程启动媒体服务，返回 server；端口已被占用（例如另一个进程已启动）时返回 None
+    host 为空时监听所有网卡
+    """
+    handler = type("MediaHandler", (_MediaHandler,), {"root": Path(root).resolve()})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError:
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="media-server", daemon=True).start()
+    return server
+
+
+def media_path(path: Path, root: Path) -> str:
+    """
+    文件相对 root 的 URL 路径（已转义），附带 mtime 避免浏览器用到旧缓存
+    打包存储里的段没有实际文件，用索引文件的 mtime
+    """
+    path = Path(path)
+    rel = path.resolve().relative_to(Path(root).resolve()).as_posix()
+    stat_path = path if path.exists() else path.parent / "index.bin"
+    return f"/{quote(rel)}?v={int(stat_path.stat().st_mtime)}"
+
+
+def media_base_js() -> str:
+    """
+    生成在 Streamlit 组件 iframe 中求值的 JS 表达式，得到媒体服务的根地址：
+    默认用当前页面的协议、主机名 + 媒体端口，配置了 LISTEN_MEDIA_URL 时直接用它
+    （页面走 HTTPS 时媒体端口前面也要有 TLS 终结，否则请用 LISTEN_MEDIA_URL 指向反向代理）
+    """
+    if MEDIA_BASE_URL:
+        return f'"{MEDIA_BASE_URL.rstrip("/")}"'
+    return f'window.parent.location.protocol + "//" + window.parent.location.hostname + ":{MEDIA_PORT}"'
+
+
+def media_url_js(rel: str) -> str:
+    # 单个文件的完整 URL（JS 表达式）
+    return f'{media_base_js()} + "{rel}"'
@@ -1,54 +1,259 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import argparse
+import json
+import os
 import subprocess
+import tempfile
+
+import mp3frames
+import shelf_index
+import timing
+from transcode import chapter_audio, discard_compact
+from segment_pack import SegmentPack, has_pack
+from segment_store import load_ids
 
 # ===== 可调参数 =====
 SEGMENTS_PER_CHAPTER = 12   # 每章包含多少段 mp3
+MAX_CHAPTER_SEGMENTS = SEGMENTS_PER_CHAPTER * 4   # 按书本身的章节分章时，一章最多多少段（过长的章拆成几部分）
+MERGE_WORKERS = os.cpu_count() or 4   # 并发合并章节的线程数
 # ===================
 
 BOOKS_DIR = Path("books")
 
 
-def merge_book(book_dir: Path):
-    mp3_files = sorted(book_dir.glob("*.mp3"))
-    if not mp3_files:
-        return
+def _audio(src):
+    # 散文件是路径本身，打包存储里的段（segment_pack.Segment）是它的音频字节
+    return src if isinstance(src, (str, Path)) else src.audio
+
+
+def concat_mp3(mp3_files, output_mp3: Path):
+    """
+    把若干段 mp3 无损拼接成一个文件：
+    - 同一播音员/码率的分段直接在进程内按帧拼接（见 mp3frames.py）
+    - 流参数不一致或无法解析时退回 ffmpeg（内存里的段先写成临时文件）
+    """
+    try:
+        mp3frames.concat(mp3_files, output_mp3)
+    except mp3frames.Mp3FormatError:
+        if all(isinstance(m, (str, Path)) for m in mp3_files):
+            concat_mp3_ffmpeg(mp3_files, output_mp3)
+            return
+        with tempfile.TemporaryDirectory(dir=output_mp3.parent) as tmp:
+            files = []
+            for i, m in enumerate(mp3_files):
+                if not isinstance(m, (str, Path)):
+                    path = Path(tmp) / f"{i}.mp3"
+                    path.write_bytes(m)
+                    m = path
+                files.append(m)
+            concat_mp3_ffmpeg(files, output_mp3)
+
+
+def merge_chapter(mp3_files, output_mp3: Path):
+    """
+    合并一章，并生成该章的逐词时间索引（供同步阅读使用）
+    mp3_files 为书目录下的分段 mp3，或打包存储里的段
+    """
+    concat_mp3([_audio(m) for m in mp3_files], output_mp3)
+    discard_compact(output_mp3)
+    timing.write_chapter_timing(output_mp3, mp3_files)
+
+
+def concat_mp3_ffmpeg(mp3_files, output_mp3: Path):
+    """
+    用 ffmpeg concat 把若干段 mp3 无损拼接成一个文件
+    """
+    list_file = output_mp3.with_name(f"list_{output_mp3.stem}.txt")
+
+    # 生成 ffmpeg concat 列表
+    with open(list_file, "w", encoding="utf-8") as f:
+        for mp3 in mp3_files:
+            # 注意路径中的反斜杠和空格
+            f.write(f"file '{Path(mp3).resolve()}'\n")
+
+    # 调用 ffmpeg 合并
+    cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(list_file),
+        "-c", "copy",
+        str(output_mp3)
+    ]
+
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    list_file.unlink(missing_ok=True)
+
+
+# =========================
+# 增量合并：chapters/manifest.json 记录每章的输入段（段号和段落 ID），输入没变且章节文件还在，就跳过
+# 散文件和打包存储记的是同一种签名，两种存储之间切换不会让章节全部重做
+# =========================
+MANIFEST = "manifest.json"
+
+
+def _inputs(mp3_files, ids=()):
+    """
+    章节的输入签名 [[段号, 段落 ID], ...]
+    散文件的段落 ID 按段号从 ids（segments.json 的顺序）里取；没有记录的旧书退回文件大小和 mtime
+    """
+    sig = []
+    for mp3 in mp3_files:
+        if isinstance(mp3, (str, Path)):
+            mp3 = Path(mp3)
+            idx = int(mp3.stem)
+            if idx < len(ids):
+                sig.append([idx, ids[idx]])
+            else:
+                st = mp3.stat()
+                sig.append([idx, st.st_size, st.st_mtime_ns])
+        else:
+            sig.append([int(mp3.name), mp3.id])
+    return sig
+
+
+def load_manifest(book_dir: Path):
+    try:
+        return json.loads((book_dir / "chapters" / MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"chapters": {}}
+
+
+def save_manifest(book_dir: Path, manifest):
+    path = book_dir / "chapters" / MANIFEST
+    tmp = path.with_name(MANIFEST + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def record_chapter(book_dir: Path, output_mp3: Path, mp3_files, ids=()):
+    """
+    流水线边转化边合并时调用：把刚合并的章节记进清单，之后的 merge_chapters 不会重做
+    ids 为全书的段落 ID（散文件时用来生成签名）
+    """
+    manifest = load_manifest(book_dir)
+    manifest["chapters"][output_mp3.name] = _inputs(mp3_files, ids)
+    save_manifest(book_dir, manifest)
+
+
+def save_layout(book_dir: Path, starts, titles):
+    """
+    流水线结束时调用：记下各章第一段的段号和章节标题
+    之后单独运行本脚本时按同样的分章合并，书架据此显示章节标题
+    """
+    manifest = load_manifest(book_dir)
+    manifest["starts"] = list(starts)
+    manifest["titles"] = list(titles)
+    save_manifest(book_dir, manifest)
+
+
+def chapter_up_to_date(book_dir: Path, output_mp3: Path, mp3_files, ids=()) -> bool:
+    """章节文件（或它转码后的紧凑文件）存在，且清单里记录的输入段与现在一致"""
+    manifest = load_manifest(book_dir)
+    return (chapter_audio(output_mp3).exists()
+            and manifest["chapters"].get(output_mp3.name) == _inputs(mp3_files, ids))
+
+
+def plan_book(book_dir: Path, force=False):
+    """
+    返回 (需要合并的 [(章节文件, 输入段列表, 输入签名)], 当前清单)
+    """
+    # 段号 → 该段音频
+    ids = ()
+    if has_pack(book_dir):
+        with SegmentPack(book_dir, readonly=True) as pack:
+            segments = {i: seg for i, seg in enumerate(map(pack.segment, range(len(pack)))) if seg is not None}
+    else:
+        # 按段号的数值取：超过 999 段后 "1000.mp3" 按字符串会排在 "101.mp3" 前面
+        segments = {int(m.stem): m for m in book_dir.glob("*.mp3") if m.stem.isdigit()}
+        ids = load_ids(book_dir) or ()
+    manifest = load_manifest(book_dir)
+    if not segments:
+        return [], manifest
 
     chapters_dir = book_dir / "chapters"
     chapters_dir.mkdir(exist_ok=True)
 
-    for i in range(0, len(mp3_files), SEGMENTS_PER_CHAPTER):
-        chunk = mp3_files[i:i + SEGMENTS_PER_CHAPTER]
-        chapter_idx = i // SEGMENTS_PER_CHAPTER
+    # 流水线记下的分章（按书的章节），没有时每 SEGMENTS_PER_CHAPTER 段一章
+    total = max(segments) + 1
+    starts = manifest.get("starts") or list(range(0, total, SEGMENTS_PER_CHAPTER))
+    bounds = list(zip(starts, starts[1:] + [max(total, starts[-1])]))
+
+    tasks = []
+    for chapter_idx, (start, end) in enumerate(bounds):
+        chunk = [segments[i] for i in range(start, end) if i in segments]
+        if not chunk:
+            continue
 
-        list_file = chapters_dir / f"list_{chapter_idx:02d}.txt"
         output_mp3 = chapters_dir / f"chapter_{chapter_idx:02d}.mp3"
+        sig = _inputs(chunk, ids)
+        if not force and chapter_audio(output_mp3).exists() and manifest["chapters"].get(output_mp3.name) == sig:
+            continue
+        tasks.append((output_mp3, chunk, sig))
 
-        # 生成 ffmpeg concat 列表
-        with open(list_file, "w", encoding="utf-8") as f:
-            for mp3 in chunk:
-                # 注意路径中的反斜杠和空格
-                f.write(f"file '{mp3.resolve()}'\n")
+    return tasks, manifest
 
-        # 调用 ffmpeg 合并
-        cmd = [
-            "ffmpeg", "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", str(list_file),
-            "-c", "copy",
-            str(output_mp3)
-        ]
 
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def merge_book(book_dir: Path, force=False):
+    tasks, manifest = plan_book(book_dir, force)
+    for output_mp3, chunk, sig in tasks:
+        merge_chapter(chunk, output_mp3)
+        manifest["chapters"][output_mp3.name] = sig
+        save_manifest(book_dir, manifest)
 
         print(f"✅ 生成章节：{output_mp3.name}")
 
 
+def merge_all(books_dir=BOOKS_DIR, workers=MERGE_WORKERS, force=False):
+    """
+    所有书的待合并章节放进同一个线程池并发执行
+    """
+    plans = {}
+    for book in sorted(Path(books_dir).iterdir()):
+        if book.is_dir() and not book.name.startswith("."):
+            tasks, manifest = plan_book(book, force)
+            if tasks:
+                plans[book] = (tasks, manifest)
+
+    total = sum(len(tasks) for tasks, _ in plans.values())
+    if not total:
+        print("✅ 所有章节都是最新的，无需合并。")
+        return 0
+
+    print(f"📘 {len(plans)} 本书共 {total} 章需要合并（{workers} 个线程）")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(merge_chapter, chunk, output_mp3): (book, output_mp3, sig)
+            for book, (tasks, _) in plans.items()
+            for output_mp3, chunk, sig in tasks
+        }
+        # 清单只在主线程里写，每完成一章就落盘一次
+        for fut in as_completed(futures):
+            book, output_mp3, sig = futures[fut]
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"❌ {book.name}/{output_mp3.name} 合并失败：{e}")
+                continue
+            manifest = plans[book][1]
+            manifest["chapters"][output_mp3.name] = sig
+            save_manifest(book, manifest)
+            print(f"✅ {book.name}/{output_mp3.name}")
+
+    for book in plans:
+        shelf_index.update_book(book)
+    return total
+
+
 def main():
-    for book in BOOKS_DIR.iterdir():
-        if book.is_dir():
-            print(f"\n📘 合并章节：{book.name}")
-            merge_book(book)
+    parser = argparse.ArgumentParser(description="把每本书的分段 mp3 合并成章节（只合并有变化的章节）")
+    parser.add_argument("books_dir", nargs="?", default=str(BOOKS_DIR))
+    parser.add_argument("-j", "--workers", type=int, default=MERGE_WORKERS, help="并发合并的线程数")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新合并")
+    args = parser.parse_args()
+
+    merge_all(Path(args.books_dir), args.workers, args.force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,349 @@
+import argparse
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+# =========================
+# 流水线运行指标
+# - 每次转化一个 RunMetrics：各阶段墙钟/CPU 时间、TTS 延迟直方图、
+#   重试/失败次数（按异常类型）、文本输入/音频输出字节数、队列深度
+# - 结束时写 metrics/<书名>-<时间>.jsonl；设置 LISTEN_PROM_DIR 时再写 Prometheus textfile
+# - 设置 LISTEN_PROFILE=cpu / mem / cpu,mem 时按阶段做 cProfile / tracemalloc
+# - python metrics.py [文件] 汇总一次运行
+# =========================
+
+# ===== 可调参数 =====
+METRICS_DIR = Path(__file__).parent / "metrics"
+# node_exporter textfile collector 的目录，每本书写一个 listen_<书名>.prom；留空不写
+PROMETHEUS_DIR = os.environ.get("LISTEN_PROM_DIR", "")
+PROFILE = {p for p in os.environ.get("LISTEN_PROFILE", "").split(",") if p}
+QUEUE_SAMPLE_INTERVAL = 1.0     # 队列深度采样间隔（秒）
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)   # TTS 延迟直方图上界（秒）
+# ===================
+
+# tracemalloc 是全进程的：多本书同时运行时按引用计数共用，最后一个结束的运行才停止
+_mem_lock = threading.Lock()
+_mem_users = 0
+_mem_owned = False   # 是不是这里启动的（外部已经在跟踪时不替它停止）
+
+
+def _mem_acquire():
+    global _mem_users, _mem_owned
+    with _mem_lock:
+        if _mem_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _mem_owned = True
+        _mem_users += 1
+
+
+def _mem_release():
+    global _mem_users, _mem_owned
+    with _mem_lock:
+        _mem_users -= 1
+        if _mem_users == 0 and _mem_owned:
+            tracemalloc.stop()
+            _mem_owned = False
+
+
+class Histogram:
+    """固定桶直方图，桶上界与 Prometheus 的 le 一致（最后一个桶为 +Inf）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        # 按桶估算分位数（取所在桶的上界）
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": round(self.sum, 4),
+                "count": self.count}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class RunMetrics:
+    """
+    一次转化的指标；各方法线程安全，流水线各阶段和 TTS 引擎线程都可以直接调用
+    """
+
+    def __init__(self, name: str, metrics_dir=METRICS_DIR, profile=None):
+        self.name = name
+        self.run_id = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+        self.metrics_dir = Path(metrics_dir)
+        self.profile = PROFILE if profile is None else set(profile)
+        self.lock = threading.Lock()
+
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.children_cpu0 = self._children_cpu()
+        self.stages = {}
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+        self.queues = {}
+        self.queue_stats = {}
+        self.samples = []
+
+        self.closed = threading.Event()
+        self.sampler = None
+        self.mem_tracing = "mem" in self.profile
+        if self.mem_tracing:
+            _mem_acquire()
+
+    @staticmethod
+    def _children_cpu():
+        # 子进程（PDF 并行解析）的 CPU 时间
+        t = os.times()
+        return t.children_user + t.children_system
+
+    # ----- 记录 -----
+    def count(self, name: str, value=1, **labels):
+        with self.lock:
+            self.counters[(name, _label_key(labels))] += value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        统计一个阶段的墙钟时间和 CPU 时间（当前线程）
+        开启 profile 时该阶段的 cProfile / tracemalloc 结果另存文件
+        """
+        prof = None
+        if "cpu" in self.profile:
+            # cProfile 只统计调用 enable 的线程，正好对应一个阶段
+            prof = cProfile.Profile()
+            prof.enable()
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+            stat = {"wall": round(wall, 4), "cpu": round(cpu, 4)}
+            if prof is not None:
+                prof.disable()
+                path = self._artifact(f"{name}.prof")
+                prof.dump_stats(str(path))
+                stat["profile"] = str(path)
+            if "mem" in self.profile and tracemalloc.is_tracing():
+                # tracemalloc 是全进程的，阶段结束时的快照包含同时运行的其它阶段
+                current, peak = tracemalloc.get_traced_memory()
+                path = self._artifact(f"{name}.tracemalloc")
+                tracemalloc.take_snapshot().dump(str(path))
+                stat.update({"mem_current": current, "mem_peak": peak, "snapshot": str(path)})
+            with self.lock:
+                self.stages[name] = stat
+
+    def _artifact(self, suffix: str) -> Path:
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        return self.metrics_dir / f"{self.run_id}.{suffix}"
+
+    def watch_queue(self, name: str, q):
+        """定期采样队列深度（qsize）"""
+        with self.lock:
+            self.queues[name] = q
+            self.queue_stats[name] = {"max": 0, "sum": 0, "n": 0}
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, name="metrics-sampler", daemon=True)
+                self.sampler.start()
+
+    def _sample(self):
+        while not self.closed.wait(QUEUE_SAMPLE_INTERVAL):
+            with self.lock:
+                depths = {name: q.qsize() for name, q in self.queues.items()}
+                for name, depth in depths.items():
+                    s = self.queue_stats[name]
+                    s["max"] = max(s["max"], depth)
+                    s["sum"] += depth
+                    s["n"] += 1
+                self.samples.append({"type": "queue", "t": round(time.perf_counter() - self.t0, 2),
+                                     "depths": depths})
+
+    # ----- 输出 -----
+    def summary(self):
+        with self.lock:
+            counters = defaultdict(list)
+            for (name, labels), value in sorted(self.counters.items()):
+                counters[name].append({"labels": dict(labels), "value": value})
+            return {
+                "type": "run",
+                "run_id": self.run_id,
+                "book": self.name,
+                "started": self.started,
+                "wall": round(time.perf_counter() - self.t0, 4),
+                "children_cpu": round(self._children_cpu() - self.children_cpu0, 4),
+                "stages": dict(self.stages),
+                "counters": dict(counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+                "queues": {
+                    name: {"max": s["max"], "mean": round(s["sum"] / s["n"], 2) if s["n"] else 0}
+                    for name, s in self.queue_stats.items()
+                },
+            }
+
+    def close(self) -> Path:
+        """停止采样，写 jsonl（和 Prometheus textfile），返回 jsonl 路径"""
+        self.closed.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        if self.mem_tracing:
+            self.mem_tracing = False
+            _mem_release()
+
+        summary = self.summary()
+        path = self._artifact("jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for line in self.samples + [summary]:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        if PROMETHEUS_DIR:
+            write_prometheus(summary, Path(PROMETHEUS_DIR) / f"listen_{self.name}.prom")
+        return path
+
+
+def _prom_labels(**labels):
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"')
+    inner = ",".join(f'{k}="{esc(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def write_prometheus(summary, path: Path):
+    """按 node_exporter textfile 格式写出这本书最近一次运行的指标（原子替换）"""
+    book = summary["book"]
+    lines = [
+        "# TYPE listen_run_wall_seconds gauge",
+        f"listen_run_wall_seconds{_prom_labels(book=book)} {summary['wall']}",
+        "# TYPE listen_stage_wall_seconds gauge",
+        "# TYPE listen_stage_cpu_seconds gauge",
+    ]
+    for stage, s in summary["stages"].items():
+        lines.append(f"listen_stage_wall_seconds{_prom_labels(book=book, stage=stage)} {s['wall']}")
+        lines.append(f"listen_stage_cpu_seconds{_prom_labels(book=book, stage=stage)} {s['cpu']}")
+
+    for name, items in summary["counters"].items():
+        lines.append(f"# TYPE listen_{name}_total counter")
+        for item in items:
+            lines.append(f"listen_{name}_total{_prom_labels(book=book, **item['labels'])} {item['value']}")
+
+    for name, h in summary["histograms"].items():
+        lines.append(f"# TYPE listen_{name}_seconds histogram")
+        cumulative = 0
+        for bound, n in zip(h["buckets"] + ["+Inf"], h["counts"]):
+            cumulative += n
+            lines.append(f"listen_{name}_seconds_bucket{_prom_labels(book=book, le=bound)} {cumulative}")
+        lines.append(f"listen_{name}_seconds_sum{_prom_labels(book=book)} {h['sum']}")
+        lines.append(f"listen_{name}_seconds_count{_prom_labels(book=book)} {h['count']}")
+
+    lines.append("# TYPE listen_queue_depth_max gauge")
+    for name, q in summary["queues"].items():
+        lines.append(f"listen_queue_depth_max{_prom_labels(book=book, queue=name)} {q['max']}")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# =========================
+# 汇总 CLI
+# =========================
+def load_run(path: Path):
+    summary, samples = None, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            if item["type"] == "run":
+                summary = item
+            else:
+                samples.append(item)
+    return summary, samples
+
+
+def _fmt_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def summarize(path: Path):
+    summary, samples = load_run(path)
+    if summary is None:
+        print(f"⚠️ {path} 中没有运行汇总（转化可能未结束）")
+        return
+
+    print(f"📊 {summary['run_id']}：总用时 {summary['wall']:.1f}s，子进程 CPU {summary['children_cpu']:.1f}s")
+
+    print("\n阶段        墙钟(s)    CPU(s)   CPU占比")
+    for stage, s in summary["stages"].items():
+        share = s["cpu"] / s["wall"] if s["wall"] else 0
+        print(f"{stage:<10}{s['wall']:>9.2f}{s['cpu']:>10.2f}{share:>10.0%}")
+
+    counters = summary["counters"]
+    if counters:
+        print("\n计数")
+        for name, items in counters.items():
+            for item in items:
+                labels = ",".join(f"{k}={v}" for k, v in item["labels"].items())
+                value = _fmt_bytes(item["value"]) if name.endswith("bytes") else f"{item['value']:.0f}"
+                print(f"  {name}{'{' + labels + '}' if labels else ''}: {value}")
+
+    for name, h in summary["histograms"].items():
+        hist = Histogram(h["buckets"])
+        hist.counts, hist.sum, hist.count = h["counts"], h["sum"], h["count"]
+        if hist.count:
+            print(f"\n{name}：{hist.count} 次，平均 {hist.sum / hist.count:.2f}s，"
+                  f"p50 ≤ {hist.quantile(0.5)}s，p95 ≤ {hist.quantile(0.95)}s")
+
+    if summary["queues"]:
+        print("\n队列深度（采样 %d 次）" % len(samples))
+        for name, q in summary["queues"].items():
+            print(f"  {name}: 平均 {q['mean']}，最大 {q['max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总一次转化的运行指标")
+    parser.add_argument("file", nargs="?", type=Path, help="metrics/*.jsonl，缺省为最近一次")
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        runs = sorted(METRICS_DIR.glob("*.jsonl"), key=lambda p: p.stat().st_mtime)
+        if not runs:
+            print("⚠️ metrics 目录中没有运行记录。")
+            return
+        path = runs[-1]
+    summarize(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+
+# =========================
+# MP3 帧级处理（纯 Python，无需 ffmpeg）
+# - 解析帧头，跳过 ID3v2 / ID3v1 / Xing / Info / VBRI
+# - 同一播音员、同一码率的分段可直接按帧拼接
+# =========================
+
+# 码率表（kbps），按 [MPEG-1, MPEG-2/2.5] × Layer III
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# 采样率表，按版本位：3 = MPEG-1，2 = MPEG-2，0 = MPEG-2.5
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+class Mp3FormatError(ValueError):
+    """文件无法按帧解析，或几个文件的流参数不一致"""
+
+
+def parse_header(b0, b1, b2, b3):
+    """
+    解析 4 字节帧头，返回 dict；不是合法的 Layer III 帧头时返回 None
+    """
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 0x3
+    layer_bits = (b1 >> 1) & 0x3
+    bitrate_idx = b2 >> 4
+    sr_idx = (b2 >> 2) & 0x3
+    if version_bits == 1 or layer_bits != 1 or bitrate_idx in (0, 15) or sr_idx == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    bitrate = _BITRATES[1 if mpeg1 else 2][bitrate_idx] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sr_idx]
+    padding = (b2 >> 1) & 0x1
+    mono = (b3 >> 6) == 3
+
+    return {
+        "version_bits": version_bits,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "mono": mono,
+        "samples": 1152 if mpeg1 else 576,
+        "length": (144 if mpeg1 else 72) * bitrate // sample_rate + padding,
+        # 流参数：拼接时这几项必须一致
+        "stream": (version_bits, sample_rate, b3 >> 6),
+    }
+
+
+def _side_info_size(h):
+    if h["version_bits"] == 3:
+        return 17 if h["mono"] else 32
+    return 9 if h["mono"] else 17
+
+
+def _id3v2_size(buf):
+    if len(buf) >= 10 and buf[:3] == b"ID3":
+        size = (buf[6] << 21) | (buf[7] << 14) | (buf[8] << 7) | buf[9]
+        footer = 10 if buf[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _is_info_frame(buf, offset, h):
+    # Xing / Info 在边信息之后，VBRI 固定在帧头后 32 字节处
+    tag_at = offset + 4 + _side_info_size(h)
+    return buf[tag_at:tag_at + 4] in (b"Xing", b"Info") or buf[offset + 36:offset + 40] == b"VBRI"
+
+
+def _xing_frames(buf, offset, h):
+    # Xing / Info 帧里记录的总帧数；没有记录时返回 None
+    tag_at = offset + 4 + _side_info_size(h)
+    if buf[tag_at:tag_at + 4] not in (b"Xing", b"Info"):
+        return None
+    flags, = struct.unpack(">I", buf[tag_at + 4:tag_at + 8])
+    if not flags & 0x1:
+        return None
+    frames, = struct.unpack(">I", buf[tag_at + 8:tag_at + 12])
+    return frames
+
+
+def scan(buf):
+    """
+    扫描一个 mp3 的字节内容（bytes / mmap），返回音频帧所在区域：
+    {"start", "end", "frames", "samples", "stream", "bitrates", "first"}
+    遇到尾部垃圾数据（如 ID3v1、APE 标签）即停止
+    """
+    size = len(buf)
+    if size >= 128 and buf[size - 128:size - 125] == b"TAG":
+        size -= 128
+
+    pos = _id3v2_size(buf[:10])
+    start = end = None
+    frames = samples = 0
+    stream = first = None
+    bitrates = set()
+
+    # 同一文件的帧头几乎都一样，缓存解析结果
+    cache = {}
+
+    while pos + 4 <= size:
+        key = buf[pos:pos + 4]
+        h = cache.get(key)
+        if h is None:
+            h = cache[key] = parse_header(*key)
+        if h is None or pos + h["length"] > size:
+            if start is None:
+                # 还没找到第一帧：逐字节向后同步
+                pos += 1
+                continue
+            break
+        if stream is None:
+            stream, first = h["stream"], h
+            if _is_info_frame(buf, pos, h):
+                pos += h["length"]
+                continue
+        elif h["stream"] != stream:
+            raise Mp3FormatError("同一文件内流参数变化")
+
+        if start is None:
+            start = pos
+        frames += 1
+        samples += h["samples"]
+        bitrates.add(h["bitrate"])
+        pos += h["length"]
+        end = pos
+
+    if start is None:
+        raise Mp3FormatError("找不到 MP3 帧")
+
+    return {
+        "start": start, "end": end, "frames": frames, "samples": samples,
+        "stream": stream, "bitrates": bitrates, "first": first,
+    }
+
+
+def _open(path):
+    # 已经在内存里的字节内容（bytes / memoryview，例如打包存储 mmap 出来的一段）原样使用
+    if isinstance(path, (bytes, bytearray, memoryview)):
+        if not len(path):
+            raise Mp3FormatError("空内容")
+        return None, path
+    f = open(path, "rb")
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # 空文件无法 mmap
+        f.close()
+        raise Mp3FormatError(f"空文件: {path}")
+
+
+def _info_frame(first, frames, total_bytes, cbr):
+    """
+    生成 Xing/Info 帧：告诉播放器总帧数和总字节数，时长和拖动才准确
+    """
+    b1 = 0xE0 | (first["version_bits"] << 3) | (1 << 1) | 1   # Layer III，无 CRC
+    bitrate_table = _BITRATES[1 if first["version_bits"] == 3 else 2]
+    sr_idx = _SAMPLE_RATES[first["version_bits"]].index(first["sample_rate"])
+    mode = first["stream"][2]
+
+    # 找一个能放下 Xing 数据的最小码率
+    side = _side_info_size(first)
+    for idx in range(1, 15):
+        bitrate = bitrate_table[idx] * 1000
+        length = (144 if first["version_bits"] == 3 else 72) * bitrate // first["sample_rate"]
+        if length >= 4 + side + 16:
+            break
+
+    frame = bytearray(length)
+    frame[0:4] = bytes([0xFF, b1, (idx << 4) | (sr_idx << 2), mode << 6])
+    tag = b"Info" if cbr else b"Xing"
+    # flags = 0x3：包含总帧数、总字节数
+    frame[4 + side:4 + side + 16] = tag + struct.pack(">III", 3, frames, total_bytes + length)
+    return bytes(frame)
+
+
+def concat(mp3_files, output: Path):
+    """
+    按帧拼接若干 mp3，写入 output，返回时长（秒）
+    - mp3_files 可以是路径，也可以是字节内容（bytes / memoryview）
+    - 去掉各文件自带的 ID3/Xing 头，只拷贝音频帧区域
+    - 用 mmap + memoryview，文件内容不会整段复制到内存
+    - 流参数（版本/采样率/声道）不一致时抛出 Mp3FormatError
+    """
+    output = Path(output)
+    opened = []
+    try:
+        infos = []
+        for path in mp3_files:
+            f, mm = _open(path)
+            opened.append((f, mm))
+            infos.append(scan(mm))
+
+        streams = {info["stream"] for info in infos}
+        if len(streams) != 1:
+            raise Mp3FormatError(f"流参数不一致: {streams}")
+
+        frames = sum(i["frames"] for i in infos)
+        samples = sum(i["samples"] for i in infos)
+        total_bytes = sum(i["end"] - i["start"] for i in infos)
+        cbr = len(set().union(*(i["bitrates"] for i in infos))) == 1
+
+        tmp = output.with_name(output.name + ".part")
+        with open(tmp, "wb") as out:
+            out.write(_info_frame(infos[0]["first"], frames, total_bytes, cbr))
+            for (_, mm), info in zip(opened, infos):
+                with memoryview(mm) as view:
+                    out.write(view[info["start"]:info["end"]])
+        os.replace(tmp, output)
+
+        return samples / infos[0]["first"]["sample_rate"]
+    finally:
+        for f, mm in opened:
+            if f is not None:
+                mm.close()
+                f.close()
+
+
+def duration(path: Path) -> float:
+    """
+    精确时长（秒）：优先读 Xing/Info 帧，否则逐帧累计采样数；文件不是 mp3 时返回 0
+    path 也可以是字节内容
+    """
+    try:
+        f, mm = _open(path)
+    except (OSError, Mp3FormatError):
+        return 0.0
+    try:
+        # 有 Xing/Info 帧（例如本模块拼出的章节）直接读总帧数
+        pos = _id3v2_size(mm[:10])
+        while pos + 4 <= len(mm):
+            h = parse_header(*mm[pos:pos + 4])
+            if h is not None:
+                frames = _xing_frames(mm, pos, h)
+                if frames is not None:
+                    return frames * h["samples"] / h["sample_rate"]
+                break
+            pos += 1
+
+        info = scan(mm)
+        return info["samples"] / info["first"]["sample_rate"]
+    except Mp3FormatError:
+        return 0.0
+    finally:
+        if f is not None:
+            mm.close()
+            f.close()
@@ -0,0 +1,472 @@
+import concurrent.futures
+import queue
+import threading
+import time
+from pathlib import Path
+
+from ingest import iter_document, iter_texts
+from cleaner import RunningLines, iter_clean
+from splitter import iter_split_for_audio, iter_split_balanced, estimate_duration, duration_stats
+from tts import get_engine
+from merge_chapters import (SEGMENTS_PER_CHAPTER, MAX_CHAPTER_SEGMENTS, chapter_up_to_date, merge_chapter,
+                            record_chapter, save_layout)
+from segment_store import (segment_id, store_path, position_path, load_ids, save_ids, old_id, adopt,
+                           place, cleanup, remove_extra_chapters, STORE_DIR)
+from segment_journal import Journal, verify_book
+from segment_pack import COMPACT_RATIO, SegmentPack, drop_loose, drop_segment_audio, export_book, has_pack
+from text_cache import TextCache, file_hash, text_key
+from metrics import RunMetrics
+from playlist import Playlist, playlist_path
+from transcode import (COMPACT_FORMAT, DROP_SEGMENTS, TRANSCODE_WORKERS, book_size, collect, needs_transcode,
+                       transcode_chapter)
+import mp3frames
+import shelf_index
+
+# ===== 可调参数 =====
+QUEUE_SIZE = 32   # 每两个阶段之间队列的最大长度（背压）
+TEXT_CACHE = True # 是否缓存切分结果，断点续跑时跳过读取/清洗/切分（见 text_cache.py）
+METRICS = True    # 是否为每次运行记录指标（见 metrics.py）
+RETRY_ROUNDS = 2  # 失败段落在整本书提交完后集中重试的轮数
+PACKED_STORE = False  # 逐段音频/文本写入每本书一个的打包存储，而不是逐段小文件（见 segment_pack.py）
+PROGRESSIVE = True    # 维护边转边听的播放列表，第一段合成好就能开始听（见 playlist.py）
+# ===================
+
+_DONE = object()
+
+
+class _Pipeline:
+    """
+    极简的多阶段流水线：
+    - 每个阶段一个线程，阶段之间用有界队列相连
+    - 任一阶段出错，所有阶段尽快退出，join 时把异常抛回调用方
+    - 传入 metrics 时统计每个阶段的墙钟/CPU 时间
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, metrics=None):
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.stop = threading.Event()
+        self.errors = []
+        self.threads = []
+
+    def queue(self):
+        return queue.Queue(maxsize=self.queue_size)
+
+    def put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(self, q):
+        while not self.stop.is_set():
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def spawn(self, name, fn, out_q=None):
+        def run():
+            try:
+                if self.metrics:
+                    with self.metrics.stage(name):
+                        fn()
+                else:
+                    fn()
+            except BaseException as e:
+                if self.metrics:
+                    self.metrics.count("stage_errors", stage=name, error=type(e).__name__)
+                self.errors.append(e)
+                self.stop.set()
+            finally:
+                if out_q is not None:
+                    self.put(out_q, _DONE)
+
+        t = threading.Thread(target=run, name=name, daemon=True)
+        self.threads.append(t)
+        t.start()
+
+    def join(self):
+        for t in self.threads:
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+def run_pipeline(file_path: Path, book_dir: Path, voice="zh-CN-YunxiNeural", rate="0%",
+                 segments_per_chapter=SEGMENTS_PER_CHAPTER, queue_size=QUEUE_SIZE,
+                 split_mode="chars", on_segment=None, on_progress=None, metrics=None, tts_slots=None,
+                 packed=PACKED_STORE, compact=COMPACT_FORMAT, drop_segments=DROP_SEGMENTS):
+    """
+    流式生成听书：读取 → 清洗 → 切分 → TTS → 合并章节 同时进行
+    - 第 0 段的 TTS 不必等整本书切分完
+    - 某一章的所有段落就绪后立即合并该章；EPUB / MOBI 按书本身的章节分章（过长的章拆成几部分），
+      其他格式每 segments_per_chapter 段一章
+    - 前面的段都就绪后按顺序追加进播放列表（playlist.m3u8），书架可边转边听
+    - 段落按内容寻址（见 segment_store.py）：内容没变的段直接复用，只合成新内容，
+      只重新合并输入有变化的章节（也即断点续跑）
+    - TTS 先写临时文件再改名，校验完整后记进完成日志（见 segment_journal.py），
+      续跑时按日志判断哪些段已完成；崩溃时写了一半的段不会被当成已完成
+    - 失败的段落在整本书提交完后集中重试 RETRY_ROUNDS 轮
+    - 同一源文件、同样参数切分过的，直接读缓存的段落，不再解析文档
+
+    split_mode："chars" 按 700 字切分；"duration" 按预估朗读时长均衡切分
+    on_segment(idx, ok) 在每段音频完成（或跳过）后回调，可用于刷新进度
+    on_progress(done, total, total_final) 同上，total 为目前已切出的段数，切分结束后 total_final 为 True
+    metrics 为 metrics.RunMetrics；不传时按 METRICS 开关自动创建，运行结束写入 metrics/ 目录
+    tts_slots 为在途 TTS 请求的名额（有 acquire/release），多本书共用时由调度器决定谁先发（见 scheduler.py）
+    packed 为 True 时逐段数据写入打包存储（by_id 只作合成时的暂存，完成后删除）
+    compact 为紧凑格式（见 transcode.FORMATS）时，每章合并好就交给 ffmpeg 线程池转码，原章节 mp3 删掉
+    drop_segments 为 True 时，整本没有失败段落就在最后删掉逐段音频，只留章节音频
+    返回 {"chunks": 段数, "failed": [重试后仍失败的段号], "chapters": 章节数, "durations": 段落时长统计,
+          "synthesized": 本次送去合成的段数, "rewritten": 本次重新合并的章节数,
+          "running_chars": 本次解析时去掉的页眉页脚字数（命中文本缓存时为 0）,
+          "sizes": 转码/删段前后书目录的字节数 {"before", "after"}（两者都没开时为 None），
+          "metrics": 指标文件路径（未记录时为 None）}
+    """
+    t_start = time.perf_counter()
+    book_dir = Path(book_dir)
+    seg_dir = book_dir / "segments"
+    chapters_dir = book_dir / "chapters"
+    for d in (book_dir, seg_dir, chapters_dir, book_dir / STORE_DIR):
+        d.mkdir(parents=True, exist_ok=True)
+
+    own_metrics = metrics is None and METRICS
+    if own_metrics:
+        metrics = RunMetrics(book_dir.name)
+
+    p = _Pipeline(queue_size, metrics)
+    q_raw, q_clean, q_chunks = p.queue(), p.queue(), p.queue()
+    # TTS 完成回调在引擎线程里执行，不能阻塞，所以这个队列不设上限
+    q_done = queue.Queue()
+    result = {"chunks": 0, "failed": [], "chapters": 0, "durations": {}, "synthesized": 0, "rewritten": 0,
+              "running_chars": 0, "sizes": None, "metrics": None}
+    # 上次转化时各位置的段落 ID，以及本次切分出的 ID（按位置）
+    if not packed and has_pack(book_dir):
+        # 之前打包过、这次不打包：先还原成散文件，已有音频照常复用
+        export_book(book_dir)
+    pack = SegmentPack(book_dir, create=True) if packed else None
+    old_ids = pack.ids() if pack is not None and len(pack) else load_ids(book_dir)
+    # 完成日志：记着哪些段的音频已完整写好，续跑时只读这一个文件
+    journal = Journal(book_dir)
+    if not journal.exists and any((book_dir / STORE_DIR).glob("*.mp3")):
+        # 没有日志的旧书（或从打包存储导出的）：先并行校验已有音频，完整的记进日志，坏的删掉重做
+        print(f"🔎 {book_dir.name}：校验已有的逐段音频")
+        verify_book(book_dir, repair=True)
+        journal = Journal(book_dir)
+    ids = []
+    texts = []   # 打包时段落文本随音频一起写入，先留在内存里
+    # 上次就在这个位置、且已记进完成日志的段（按 segments.json 和日志判断）：
+    # 位置文件和逐段文本都是现成的，续跑时不再逐个 stat / 链接
+    placed = set()
+    # 各章第一段的段号和章节标题（切分阶段追加，合并阶段读取）
+    starts, titles = [0], [""]
+    live = Playlist(book_dir) if PROGRESSIVE else None
+    # 章节转码与后续章节的合成、合并并行进行
+    transcoder = concurrent.futures.ThreadPoolExecutor(TRANSCODE_WORKERS, "transcode") if compact else None
+    transcodes = []
+    if metrics:
+        for name, q in (("raw", q_raw), ("clean", q_clean), ("chunks", q_chunks), ("done", q_done)):
+            metrics.watch_queue(name, q)
+        metrics.count("source_bytes", Path(file_path).stat().st_size)
+
+    # 清洗阶段遇到参考文献后置位，读取阶段据此提前结束
+    enough = threading.Event()
+    split_finished = threading.Event()
+
+    # 解析文本缓存：命中时不启动读取、清洗阶段
+    text_cache = key = cached = None
+    if TEXT_CACHE:
+        text_cache = TextCache()
+        key = text_key(file_hash(file_path), split_mode, rate)
+        cached = text_cache.load(key)
+        if metrics:
+            metrics.count("text_cache", result="miss" if cached is None else "hit")
+
+    # 1. 逐页/逐章读取文档（章节边界以 ChapterMark 的形式夹在文本之间），
+    #    PDF 每页重复的页眉页脚在这里去掉（须按页判断，清洗阶段拿到的已是纯文本）
+    running = RunningLines()
+
+    def ingest():
+        for text in iter_texts(running.filter(iter_document(file_path))):
+            if enough.is_set() or not p.put(q_raw, text):
+                break
+        result["running_chars"] = running.removed_chars
+        if metrics:
+            metrics.count("running_chars", running.removed_chars)
+
+    # 2. 逐单元清洗文本
+    def clean():
+        raw = p.drain(q_raw)
+        for text in iter_clean(raw):
+            p.put(q_clean, text)
+        enough.set()
+        # 同一个生成器接着读：提前停止时读走剩余单元，已读完则直接结束
+        for _ in raw:
+            pass
+
+    # 3. 切分为适合听的 chunk，并落盘逐段文本
+    def split():
+        writer = None
+        if cached is not None:
+            chunks = cached
+        else:
+            if split_mode == "duration":
+                chunks = iter_split_balanced(p.drain(q_clean), rate=rate)
+            else:
+                chunks = iter_split_for_audio(p.drain(q_clean))
+            if text_cache is not None:
+                writer = text_cache.writer(key)
+
+        idx = 0
+        durations = []
+        marked = False      # 书带章节边界
+        chapter = None      # 下一段开始的新章标题
+        base, part = "", 1  # 当前章的标题，过长的章拆开后各部分依次编号
+        try:
+            for chunk in chunks:
+                if not isinstance(chunk, str):
+                    marked, chapter = True, chunk.title
+                    if writer is not None:
+                        writer.add(chunk)
+                    continue
+                if chapter is not None:
+                    if idx > starts[-1]:
+                        starts.append(idx)
+                        titles.append(chapter)
+                    else:
+                        titles[-1] = chapter   # 前一章一段都没有
+                    base, chapter, part = chapter, None, 1
+                elif idx - starts[-1] >= (MAX_CHAPTER_SEGMENTS if marked else segments_per_chapter):
+                    part += 1
+                    starts.append(idx)
+                    titles.append(f"{base}（{part}）" if base else "")
+                sid = segment_id(chunk, voice, rate)
+                prev = old_id(book_dir, idx, old_ids, voice, rate)
+                if pack is None and prev == sid and sid in journal:
+                    placed.add(idx)
+                elif (pack is None or not pack.has(sid)) and adopt(book_dir, idx, sid, prev):
+                    journal.record(sid)
+                if pack is not None:
+                    texts.append(chunk)
+                elif idx not in placed:
+                    seg_file = seg_dir / f"{idx:03d}.txt"
+                    if prev != sid or not seg_file.exists():
+                        seg_file.write_text(chunk, encoding="utf-8")
+                ids.append(sid)
+                if writer is not None:
+                    writer.add(chunk)
+                if metrics:
+                    metrics.count("text_bytes", len(chunk.encode("utf-8")))
+                durations.append(estimate_duration(chunk, rate))
+                if not p.put(q_chunks, (idx, chunk, sid)):
+                    break
+                idx += 1
+                result["chunks"] = idx
+        finally:
+            # 只有完整切完的结果才写入缓存
+            if writer is not None:
+                if p.stop.is_set():
+                    writer.discard()
+                else:
+                    writer.commit()
+        result["durations"] = duration_stats(durations)
+        split_finished.set()
+
+    # 4. 并发生成音频，已有的段落 ID 直接复用，在途请求数受引擎并发上限约束
+    #    首轮失败的段先放进重试队列，整本书提交完后再集中重试，不直接留下空洞
+    def synthesize():
+        engine = get_engine()
+        inflight = tts_slots or threading.BoundedSemaphore(engine.max_concurrency * 2)
+        pending = []
+        retry = []
+        # 同一内容（段落 ID）正在合成时，后来的段号排队等它，不重复请求、不重复写同一个文件
+        waiting = {}
+        finished = set()
+        lock = threading.Lock()
+
+        def submit(idx, chunk, sid, final):
+            with lock:
+                if sid in waiting:
+                    waiting[sid].append(idx)
+                    return
+                waiting[sid] = [idx]
+            inflight.acquire()
+            fut = engine.submit(chunk, store_path(book_dir, sid), voice, rate, metrics=metrics)
+
+            def done(f):
+                inflight.release()
+                ok = not f.cancelled() and f.exception() is None and f.result()
+                with lock:
+                    idxs = waiting.pop(sid)
+                    if ok:
+                        finished.add(sid)
+                for i in idxs:
+                    if ok or final:
+                        q_done.put((i, ok))
+                    else:
+                        retry.append((i, chunk, sid))
+
+            fut.add_done_callback(done)
+            pending.append(fut)
+
+        for idx, chunk, sid in p.drain(q_chunks):
+            # 先看完成日志再看打包存储：合并阶段总是先记日志、写进打包存储，最后才删暂存
+            if sid in journal or sid in finished or (pack is not None and pack.has(sid)):
+                if metrics:
+                    metrics.count("segments_resumed")
+                q_done.put((idx, True))
+                continue
+            result["synthesized"] += 1
+            submit(idx, chunk, sid, final=RETRY_ROUNDS == 0)
+        concurrent.futures.wait(pending)
+
+        for round_no in range(1, RETRY_ROUNDS + 1):
+            if not retry or p.stop.is_set():
+                break
+            batch = sorted(retry)
+            retry.clear()
+            pending.clear()
+            print(f"🔁 第 {round_no} 轮重试 {len(batch)} 个失败段落")
+            if metrics:
+                metrics.count("segments_retried", len(batch))
+            for idx, chunk, sid in batch:
+                submit(idx, chunk, sid, final=round_no == RETRY_ROUNDS)
+            concurrent.futures.wait(pending)
+
+    # 5. 段落就位（链接到 by_id 里的音频），一章的段落全部就绪后立即合并；输入没变的章节跳过
+    def merge():
+        done = set()
+        ready = set()
+        next_chapter = 0
+        listed = 0   # 播放列表已经排到第几段
+
+        def list_segment(idx):
+            if pack is not None:
+                uri, seconds = f"pack/{idx}.mp3", mp3frames.duration(pack.audio(idx))
+            else:
+                # 时长记在完成日志里，早期的日志没有时才读文件
+                uri, seconds = position_path(book_dir, idx).name, journal.seconds(ids[idx])
+                if seconds is None:
+                    seconds = mp3frames.duration(position_path(book_dir, idx))
+            live.add(uri, seconds)
+            if live.count == 1:
+                if metrics:
+                    metrics.observe("first_audio", time.perf_counter() - t_start)
+                # 第一段就绪就让书出现在书架上，不必等第一章合并
+                shelf_index.update_book(book_dir)
+
+        def finish_chapter(c, start, end):
+            if pack is not None:
+                mp3s = [seg for seg in map(pack.segment, range(start, end)) if seg is not None]
+            else:
+                # 成功的段都已就位，不必再逐个确认文件存在
+                mp3s = [position_path(book_dir, i) for i in range(start, end) if i in ready]
+            if mp3s:
+                output_mp3 = chapters_dir / f"chapter_{c:02d}.mp3"
+                result["chapters"] += 1
+                if chapter_up_to_date(book_dir, output_mp3, mp3s, ids):
+                    # 之前没转码（或转成了别的格式）的章节补上
+                    if transcoder is not None and needs_transcode(output_mp3, compact):
+                        transcodes.append(transcoder.submit(transcode_chapter, output_mp3, compact))
+                    return
+                t = time.perf_counter()
+                merge_chapter(mp3s, output_mp3)
+                if metrics:
+                    metrics.observe("chapter_merge", time.perf_counter() - t)
+                record_chapter(book_dir, output_mp3, mp3s, ids)
+                result["rewritten"] += 1
+                if transcoder is not None:
+                    transcodes.append(transcoder.submit(transcode_chapter, output_mp3, compact))
+                # 合并好一章就刷新书架索引，转化过程中即可收听已完成的章节
+                shelf_index.update_book(book_dir)
+
+        for idx, ok in p.drain(q_done):
+            if ok and ids[idx] not in journal and not (pack is not None and pack.has(ids[idx])):
+                # 新合成的段：校验 mp3 完整后才记进日志，不完整的删掉按失败处理
+                ok = journal.record(ids[idx])
+            if pack is None:
+                if idx not in placed:
+                    place(book_dir, idx, ids[idx], ok)
+            elif ok:
+                pack.put(idx, ids[idx], texts[idx], store_path(book_dir, ids[idx]))
+            else:
+                pack.clear(idx)
+            done.add(idx)
+            if ok:
+                ready.add(idx)
+            else:
+                result["failed"].append(idx)
+            if metrics:
+                metrics.count("segments", result="ok" if ok else "failed")
+            if on_segment:
+                on_segment(idx, ok)
+            if on_progress:
+                on_progress(len(done), result["chunks"], split_finished.is_set())
+
+            # 失败的段不进播放列表，后面的段照常接上
+            while live is not None and listed in done:
+                if listed in ready:
+                    list_segment(listed)
+                listed += 1
+
+            # 下一章已经开始（本章的范围确定了）且本章的段都完成了
+            while (next_chapter + 1 < len(starts)
+                   and all(i in done for i in range(starts[next_chapter], starts[next_chapter + 1]))):
+                finish_chapter(next_chapter, starts[next_chapter], starts[next_chapter + 1])
+                next_chapter += 1
+
+        # 收尾：最后一章到全书结尾
+        if not p.stop.is_set() and next_chapter < len(starts) and starts[next_chapter] < result["chunks"]:
+            finish_chapter(next_chapter, starts[next_chapter], result["chunks"])
+
+    if cached is None:
+        p.spawn("ingest", ingest, q_raw)
+        p.spawn("clean", clean, q_clean)
+    p.spawn("split", split, q_chunks)
+    p.spawn("tts", synthesize, q_done)
+    p.spawn("merge", merge)
+    try:
+        p.join()
+        # 整本完成：记下各位置的段落 ID，清理不再引用的音频和多余的位置/章节
+        if pack is not None:
+            pack.truncate(len(ids))
+            pack.save_meta(voice, rate)
+            if pack.garbage() > COMPACT_RATIO:
+                pack.compact()
+            drop_loose(book_dir)
+            remove_extra_chapters(book_dir, len(starts) if ids else 0)
+        else:
+            save_ids(book_dir, ids, voice, rate)
+            cleanup(book_dir, ids, len(starts) if ids else 0)
+            journal.rewrite(ids)
+        save_layout(book_dir, starts if ids else [], titles if ids else [])
+    finally:
+        journal.close()
+        if live is not None:
+            live.end()
+        if pack is not None:
+            pack.close()
+        if transcoder is not None:
+            transcoder.shutdown(wait=True)
+        if own_metrics:
+            result["metrics"] = metrics.close()
+
+    # 转码和删段释放的空间，换算出不做这两步时的大小
+    removed, added = collect(transcodes)
+    if drop_segments and ids and not result["failed"]:
+        removed += drop_segment_audio(book_dir)
+        # 播放列表指向的逐段音频已删掉，书架改用章节播放
+        playlist_path(book_dir).unlink(missing_ok=True)
+    if compact or drop_segments:
+        after = book_size(book_dir)
+        result["sizes"] = {"before": after + removed - added, "after": after}
+
+    shelf_index.update_book(book_dir)
+    return result
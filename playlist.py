@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+# =========================
+# 边转边听的播放列表（HLS 格式的 m3u8）
+# - 转化开始时写好表头，之后每当前面的段都已就绪，就按顺序追加一段
+# - 转化结束追加 #EXT-X-ENDLIST，播放器据此停止轮询
+# - 每次追加是一整条完整记录的一次写入；读者看到末尾不完整的行直接忽略即可
+# =========================
+
+# ===== 可调参数 =====
+PLAYLIST = "playlist.m3u8"
+TARGET_DURATION = 600   # 单段时长上限（秒），HLS 要求写在表头，取一个足够大的值
+# ===================
+
+_ENDLIST = "#EXT-X-ENDLIST"
+
+
+def playlist_path(book_dir: Path) -> Path:
+    return Path(book_dir) / PLAYLIST
+
+
+def is_live(book_dir: Path) -> bool:
+    """有播放列表且还没写结束标记，即正在转化"""
+    try:
+        with open(playlist_path(book_dir), "rb") as f:
+            f.seek(max(0, os.fstat(f.fileno()).st_size - 64))
+            return _ENDLIST.encode() not in f.read()
+    except OSError:
+        return False
+
+
+class Playlist:
+    """
+    一本书的播放列表，段的地址相对书目录（散文件 NNN.mp3 或打包存储的 pack/<段号>.mp3）
+    """
+
+    def __init__(self, book_dir: Path):
+        self.path = playlist_path(book_dir)
+        self.count = 0
+        tmp = self.path.with_name(PLAYLIST + ".part")
+        tmp.write_text(
+            "#EXTM3U\n"
+            "#EXT-X-VERSION:3\n"
+            "#EXT-X-PLAYLIST-TYPE:EVENT\n"
+            f"#EXT-X-TARGETDURATION:{TARGET_DURATION}\n"
+            "#EXT-X-MEDIA-SEQUENCE:0\n",
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.path)
+        self.f = open(self.path, "a", encoding="utf-8")
+
+    def add(self, uri: str, seconds: float):
+        self.f.write(f"#EXTINF:{seconds:.3f},\n{uri}\n")
+        self.f.flush()
+        self.count += 1
+
+    def end(self):
+        if not self.f.closed:
+            self.f.write(_ENDLIST + "\n")
+            self.f.close()
@@ -0,0 +1,209 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from pipeline import PACKED_STORE, run_pipeline
+from segment_pack import SegmentPack, has_pack
+from segment_journal import Journal
+from segment_store import segment_id, store_path
+from text_cache import prepare
+from transcode import COMPACT_FORMAT, DROP_SEGMENTS
+from tts import get_engine
+
+# =========================
+# 多本书调度
+# - 解析（读取/清洗/切分）在进程池里并行，结果写入文本缓存，流水线随后直接命中
+# - 每本书解析完就启动它的流水线；所有书共用一个全局 TTS 名额（TTSBudget），
+#   名额空出来时按策略决定给哪本书：
+#     sjf  剩余段数最少的书优先（短文献不被长书挡住，平均完成时间最短）
+#     fifo 先提交的书优先
+#     rr   各书轮流
+# =========================
+
+# ===== 可调参数 =====
+INGEST_WORKERS = 2      # 并行解析的进程数
+SCHEDULE_POLICY = "sjf"
+BUDGET_HEADROOM = 2     # 全局名额 = 引擎当前并发上限 + 这么多（让引擎始终有下一个请求可发）
+# ===================
+
+POLICIES = ("sjf", "fifo", "rr")
+
+
+class _Job:
+    def __init__(self, name: str, seq: int, remaining: int):
+        self.name = name
+        self.seq = seq
+        self.remaining = remaining   # 还没提交给引擎的段数
+        self.waiting = 0
+
+
+class TTSBudget:
+    """
+    全局 TTS 名额：各本书的流水线提交请求前先 acquire，请求结束 release
+    名额数跟随引擎的自适应并发上限，超出的请求在这里按策略排队，而不是在引擎里先来先服务
+    """
+
+    def __init__(self, policy=SCHEDULE_POLICY, engine=None, headroom=BUDGET_HEADROOM):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}（可选 {', '.join(POLICIES)}）")
+        self.policy = policy
+        self.engine = engine or get_engine()
+        self.headroom = headroom
+        self.cond = threading.Condition()
+        self.jobs = {}
+        self.inflight = 0
+        self.seq = 0
+        self.last = -1   # rr：上一次拿到名额的书
+
+    def capacity(self) -> int:
+        return self.engine.concurrency + self.headroom
+
+    def register(self, name: str, remaining: int, order=None):
+        """
+        登记一本书，返回该书专用的名额对象（传给 run_pipeline 的 tts_slots）
+        order 为提交顺序（fifo / rr 按它排），缺省按登记先后
+        """
+        with self.cond:
+            if order is None:
+                order = self.seq
+            self.seq = max(self.seq, order) + 1
+            job = self.jobs[name] = _Job(name, order, remaining)
+        return _Slots(self, job)
+
+    def unregister(self, name: str):
+        with self.cond:
+            self.jobs.pop(name, None)
+            self.cond.notify_all()
+
+    def _pick(self):
+        waiting = [j for j in self.jobs.values() if j.waiting]
+        if not waiting:
+            return None
+        if self.policy == "sjf":
+            return min(waiting, key=lambda j: (j.remaining, j.seq))
+        if self.policy == "fifo":
+            return min(waiting, key=lambda j: j.seq)
+        # rr：按登记顺序，取上一个之后的第一本
+        later = [j for j in waiting if j.seq > self.last]
+        return min(later or waiting, key=lambda j: j.seq)
+
+    def _acquire(self, job: _Job):
+        with self.cond:
+            job.waiting += 1
+            while not (self.inflight < self.capacity() and self._pick() is job):
+                # 名额随引擎并发上限变化，定时醒来重新检查
+                self.cond.wait(timeout=1)
+            job.waiting -= 1
+            job.remaining = max(0, job.remaining - 1)
+            self.inflight += 1
+            self.last = job.seq
+            self.cond.notify_all()
+
+    def _release(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+
+class _Slots:
+    def __init__(self, budget: TTSBudget, job: _Job):
+        self.budget = budget
+        self.job = job
+
+    def acquire(self):
+        self.budget._acquire(self.job)
+
+    def release(self):
+        self.budget._release()
+
+
+def _remaining(book_dir: Path, chunks, voice="zh-CN-YunxiNeural", rate="0%") -> int:
+    # 还需要合成的段数：完成日志（没有日志的旧书看 by_id）和打包存储里都还没有的段落
+    ids = [segment_id(c, voice, rate) for c in chunks if isinstance(c, str)]
+    journal = Journal(book_dir)
+    if journal.exists:
+        missing = [sid for sid in ids if sid not in journal]
+    else:
+        missing = [sid for sid in ids if not store_path(book_dir, sid).exists()]
+    if missing and has_pack(book_dir):
+        with SegmentPack(book_dir, readonly=True) as pack:
+            missing = [sid for sid in missing if not pack.has(sid)]
+    return len(missing)
+
+
+def book_names(files):
+    """
+    每个文件对应的书名（即书目录名）：默认是文件名去掉扩展名，
+    同名的（如 a.pdf 和 a.txt）按出现顺序依次加 -2、-3……，各写各的目录
+    """
+    names = []
+    used = set()
+    for f in files:
+        name = Path(f).stem
+        n = 2
+        while name in used:
+            name = f"{Path(f).stem}-{n}"
+            n += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def run_books(files, books_dir: Path, policy=SCHEDULE_POLICY, split_mode="chars",
+              voice="zh-CN-YunxiNeural", rate="0%",
+              ingest_workers=INGEST_WORKERS, packed=PACKED_STORE, compact=COMPACT_FORMAT,
+              drop_segments=DROP_SEGMENTS, on_segment=None, on_book_done=None):
+    """
+    并行解析、按策略共享 TTS，处理一批文件；voice / rate 对每本书生效（也参与文本缓存的 key）
+    on_segment(name, idx, ok) 每段完成时回调
+    on_book_done(name, result_or_exception, seconds) 每本书结束时回调（seconds 从批次开始算）
+    返回 {书名: run_pipeline 的结果或异常}，书名见 book_names
+    """
+    books_dir = Path(books_dir)
+    budget = TTSBudget(policy)
+    results = {}
+    threads = []
+    t0 = time.perf_counter()
+
+    names = book_names(files)
+
+    def run_book(f: Path, order: int, chunks):
+        name = names[order]
+        book_dir = books_dir / name
+        slots = budget.register(name, _remaining(book_dir, chunks, voice, rate), order)
+        try:
+            results[name] = run_pipeline(
+                f, book_dir, voice=voice, rate=rate, split_mode=split_mode, tts_slots=slots, packed=packed,
+                compact=compact, drop_segments=drop_segments,
+                on_segment=(lambda idx, ok: on_segment(name, idx, ok)) if on_segment else None,
+            )
+        except Exception as e:
+            results[name] = e
+        finally:
+            budget.unregister(name)
+        if on_book_done:
+            on_book_done(name, results[name], time.perf_counter() - t0)
+
+    # 子进程里 PDF 不再开子进程，并行度由进程池统一控制
+    # 先提交的书已经在各自线程里合成，进程池用 spawn 启动，避免 fork 正在运行的线程
+    with ProcessPoolExecutor(max_workers=ingest_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(prepare, f, split_mode, rate, 1): (i, f) for i, f in enumerate(files)}
+        for fut in as_completed(futures):
+            order, f = futures[fut]
+            try:
+                chunks = fut.result()
+            except Exception as e:
+                results[names[order]] = e
+                if on_book_done:
+                    on_book_done(names[order], e, time.perf_counter() - t0)
+                continue
+            t = threading.Thread(target=run_book, args=(f, order, chunks), name=f"book-{names[order]}",
+                                 daemon=True)
+            threads.append(t)
+            t.start()
+
+    for t in threads:
+        t.join()
+    return results
@@ -0,0 +1,259 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import mp3frames
+from segment_store import STORE_DIR, load_ids, place, position_path, store_path
+from timing import words_path
+
+# =========================
+# 逐段音频的完成日志（断点续跑用）
+# - <书>/journal.log 只追加，一行一段：段落 ID、字节数、CRC32、时长（秒）
+# - TTS 先写临时文件、落盘后再改名（见 tts._tts_once），合并阶段校验 mp3 完整后才记一行，
+#   所以日志里有的段一定是完整的；续跑时读这一个文件（加上 segments.json），不再逐个 stat 音频文件，
+#   播放列表需要的时长也从日志里取
+# - 写到一半崩溃的最后一行不完整，读取时忽略
+# - 整本完成后按本次仍引用的段重写一遍，去掉已删除的段
+# 校验 / 修复：python segment_journal.py <书目录>... [--repair]
+# =========================
+
+# ===== 可调参数 =====
+JOURNAL = "journal.log"
+JOURNAL_FSYNC = True   # 每记一段就 fsync：断电也不会丢掉已记下的段（代价是每段一次落盘）
+VERIFY_WORKERS = os.cpu_count() or 2
+# ===================
+
+
+def journal_path(book_dir: Path) -> Path:
+    return Path(book_dir) / JOURNAL
+
+
+def _seconds(data):
+    """mp3 完整时返回时长（秒），否则返回 None"""
+    try:
+        info = mp3frames.scan(data)
+    except mp3frames.Mp3FormatError:
+        return None
+    tail = len(data) - info["end"]
+    if tail == 0 or (tail == 128 and bytes(data[-128:-125]) == b"TAG"):
+        return info["samples"] / info["first"]["sample_rate"]
+    return None
+
+
+def intact(data) -> bool:
+    """mp3 是否完整：能解析出帧，且最后一帧没有被截断（允许末尾的 ID3v1 标签）"""
+    return _seconds(data) is not None
+
+
+def _entry(data):
+    return len(data), zlib.crc32(data)
+
+
+def _line(seg_id, entry):
+    size, crc, seconds = entry
+    if seconds is None:
+        return f"{seg_id} {size} {crc:08x}\n"
+    return f"{seg_id} {size} {crc:08x} {seconds:.3f}\n"
+
+
+class Journal:
+    """
+    一本书的完成日志；record 可在多个线程里调用
+    sid in journal 表示这段音频已完整地存在 by_id 里
+    """
+
+    def __init__(self, book_dir: Path):
+        self.book_dir = Path(book_dir)
+        self.path = journal_path(book_dir)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.exists = self.path.exists()
+        if self.exists:
+            with open(self.path, encoding="ascii", errors="replace") as f:
+                for line in f:
+                    parts = line.split()
+                    # 早期的日志没有时长一列
+                    if not line.endswith("\n") or len(parts) not in (3, 4):
+                        continue
+                    try:
+                        seconds = float(parts[3]) if len(parts) == 4 else None
+                        self.entries[parts[0]] = (int(parts[1]), int(parts[2], 16), seconds)
+                    except ValueError:
+                        continue
+        self.f = None
+
+    def __contains__(self, seg_id) -> bool:
+        return seg_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def seconds(self, seg_id):
+        """记录里这段的时长（秒），没有记录时返回 None"""
+        entry = self.entries.get(seg_id)
+        return entry[2] if entry else None
+
+    def _append(self, lines):
+        if self.f is None:
+            self.f = open(self.path, "a", encoding="ascii")
+            self.exists = True
+        self.f.write(lines)
+        self.f.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self.f.fileno())
+
+    def record(self, seg_id: str) -> bool:
+        """
+        校验 by_id 里这段音频并记入日志
+        音频不完整（或不存在）时删掉它和逐词时间，返回 False，调用方按合成失败处理
+        """
+        path = store_path(self.book_dir, seg_id)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return False
+        seconds = _seconds(data)
+        if seconds is None:
+            path.unlink(missing_ok=True)
+            words_path(path).unlink(missing_ok=True)
+            return False
+        entry = (*_entry(data), seconds)
+        with self.lock:
+            # 同一段重新合成过就再记一行，读取时以最后一行为准
+            if self.entries.get(seg_id) != entry:
+                self._append(_line(seg_id, entry))
+                self.entries[seg_id] = entry
+        return True
+
+    def rewrite(self, keep):
+        """只保留 keep 里的段，原子地重写日志"""
+        keep = set(keep)
+        with self.lock:
+            self.close()
+            self.entries = {sid: e for sid, e in self.entries.items() if sid in keep}
+            tmp = self.path.with_name(JOURNAL + ".tmp")
+            tmp.write_text("".join(_line(sid, e) for sid, e in self.entries.items()),
+                           encoding="ascii")
+            os.replace(tmp, self.path)
+            self.exists = True
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+# =========================
+# 校验 / 修复
+# =========================
+def _check_file(path: str):
+    # 子进程里执行：读一个音频文件，返回 (字节数, CRC32, 时长)，不完整时时长为 None
+    try:
+        data = Path(path).read_bytes()
+    except OSError:
+        return None
+    return (*_entry(data), _seconds(data))
+
+
+def _check_audio(data: bytes):
+    return intact(data)
+
+
+def verify_book(book_dir: Path, repair=False, workers=VERIFY_WORKERS):
+    """
+    并行校验一本书的逐段音频，返回各类问题的计数：
+    - corrupt      by_id 里不完整或与日志记录（字节数/CRC）不符的音频
+    - missing      日志里有、文件却不在了
+    - unjournaled  完整但没记进日志（旧版本转化的书、记日志前崩溃）
+    - positions    位置文件 NNN.mp3 没有指向 segments.json 里该位置的段
+    - temp         残留的临时文件（*.part）
+    - pack         打包存储里不完整的段
+    repair=True 时删掉坏的音频和临时文件、重写日志、重新链接位置文件、清空打包存储里的坏段，
+    之后重新转化只会补合成这些段
+    """
+    from segment_pack import SegmentPack, has_pack
+
+    book_dir = Path(book_dir)
+    journal = Journal(book_dir)
+    report = {"checked": 0, "corrupt": 0, "missing": 0, "unjournaled": 0, "positions": 0, "temp": 0, "pack": 0}
+    store_dir = book_dir / STORE_DIR
+    files = sorted(store_dir.glob("*.mp3")) if store_dir.is_dir() else []
+
+    good = {}
+    bad = []
+    # 流水线开始时调用，别的书可能正在合成：用 spawn 启动，避免 fork 正在运行的线程
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for path, res in zip(files, pool.map(_check_file, map(str, files), chunksize=32)):
+            report["checked"] += 1
+            sid = path.stem
+            recorded = journal.entries.get(sid)
+            if res is None or res[2] is None or (recorded is not None and recorded[:2] != res[:2]):
+                report["corrupt"] += 1
+                bad.append(path)
+                continue
+            if recorded is None:
+                report["unjournaled"] += 1
+            good[sid] = res
+        report["missing"] = sum(1 for sid in journal.entries if not store_path(book_dir, sid).exists())
+
+        # 打包存储：逐段检查 mp3 是否完整（打包时不记 CRC）
+        broken = []
+        if has_pack(book_dir):
+            with SegmentPack(book_dir) as pack:
+                idxs = [i for i in range(len(pack)) if pack.locate(i)]
+                audio = (bytes(pack.audio(i)) for i in idxs)
+                broken = [i for i, ok in zip(idxs, pool.map(_check_audio, audio, chunksize=16)) if not ok]
+            report["pack"] = len(broken)
+
+    ids = load_ids(book_dir) if not has_pack(book_dir) else None
+    for idx, sid in enumerate(ids or []):
+        pos = position_path(book_dir, idx)
+        if sid in good:
+            if not (pos.exists() and os.path.samefile(pos, store_path(book_dir, sid))):
+                report["positions"] += 1
+        elif pos.exists():
+            report["positions"] += 1
+    temps = [p for d in (book_dir, store_dir, book_dir / "chapters") if d.is_dir() for p in d.glob("*.part")]
+    report["temp"] = len(temps)
+
+    if repair:
+        for path in bad + temps:
+            path.unlink(missing_ok=True)
+            if path.suffix == ".mp3":
+                words_path(path).unlink(missing_ok=True)
+        if files or journal.exists:
+            journal.entries = good
+            journal.rewrite(good)
+        for idx, sid in enumerate(ids or []):
+            place(book_dir, idx, sid, ok=sid in good)
+        if broken:
+            with SegmentPack(book_dir) as pack:
+                for i in broken:
+                    pack.clear(i)
+    journal.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验（并修复）书目录里的逐段音频")
+    parser.add_argument("books", nargs="+", help="书目录")
+    parser.add_argument("--repair", action="store_true", help="删掉坏的段、重写日志，之后重新转化即可补齐（不要在这本书转化时修复）")
+    parser.add_argument("-j", "--workers", type=int, default=VERIFY_WORKERS, help="并行校验的进程数")
+    args = parser.parse_args()
+
+    for book in map(Path, args.books):
+        r = verify_book(book, args.repair, args.workers)
+        problems = r["corrupt"] + r["missing"] + r["positions"] + r["temp"] + r["pack"]
+        print(f"{'✅' if not problems else ('🔧' if args.repair else '❌')} {book.name}：校验 {r['checked']} 段，"
+              f"损坏 {r['corrupt']}，缺失 {r['missing']}，未记日志 {r['unjournaled']}，"
+              f"位置不符 {r['positions']}，临时文件 {r['temp']}，打包存储损坏 {r['pack']}")
+        if problems and not args.repair:
+            print("   加 --repair 修复，之后重新转化这本书会补合成缺的段")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+from pathlib import Path
+
+from timing import save_words, words_path
+from segment_journal import journal_path
+from segment_store import (SEGMENT_MANIFEST, STORE_DIR, load_count, load_ids, place, position_path, save_ids,
+                           segment_id, store_path)
+
+# =========================
+# 打包的逐段存储（可选，见 pipeline.PACKED_STORE）
+# 一本书的逐段音频/文本不再是成千上万个小文件，而是 <书>/pack/ 下的几个文件：
+# - audio.bin  所有段的 mp3 首尾相接，只追加
+# - text.bin   所有段的文本和逐词时间（UTF-8 / JSON），只追加
+# - index.bin  定长记录，第 i 条就是第 i 段：段落 ID，音频/文本/逐词时间各自的 (偏移, 长度)
+# - meta.json  播音员、语速
+# 段数 = 索引大小 / 记录长度，取第 i 段只读一条记录再从 mmap 里切片，都是 O(1)
+# 内容变了的段只追加新数据、改写那一条记录；旧数据成为垃圾，超过 COMPACT_RATIO 时整体压缩
+# =========================
+
+# ===== 可调参数 =====
+PACK_DIR = "pack"
+COMPACT_RATIO = 0.5   # 垃圾字节占比超过它时，转化结束后压缩
+# ===================
+
+_MAGIC = b"LPK1"
+_HEADER = struct.Struct("<4sI")          # 魔数，记录长度
+_RECORD = struct.Struct("<32sQIQIQI")   # 段落 ID（sha256），音频、文本、逐词时间的 (偏移, 长度)
+_EMPTY = bytes(32)
+
+
+def has_pack(book_dir: Path) -> bool:
+    return (Path(book_dir) / PACK_DIR / "index.bin").exists()
+
+
+class Segment:
+    """打包存储里的一段：audio 是 audio.bin 的 mmap 切片（memoryview），不复制"""
+
+    def __init__(self, idx: int, seg_id: str, audio, text: str, words):
+        self.name = str(idx)
+        self.id = seg_id
+        self.audio = audio
+        self.text = text
+        self.words = words
+
+
+class SegmentPack:
+    """
+    一本书的打包存储；create=True 时不存在就新建
+    写入（put / clear / truncate / compact）只在转化流水线里进行，加锁后可与读取并发
+    readonly=True 时三个文件都只读打开（媒体服务、阅读页用），不能调用写入方法
+    """
+
+    def __init__(self, book_dir: Path, create=False, readonly=False):
+        self.dir = Path(book_dir) / PACK_DIR
+        self.lock = threading.RLock()
+        self.readonly = readonly
+        if create and not has_pack(book_dir):
+            self.dir.mkdir(parents=True, exist_ok=True)
+            for name in ("audio.bin", "text.bin"):
+                (self.dir / name).touch()
+            (self.dir / "index.bin").write_bytes(_HEADER.pack(_MAGIC, _RECORD.size))
+        self._open()
+
+    def _open(self):
+        self.index = open(self.dir / "index.bin", "rb" if self.readonly else "r+b")
+        magic, size = _HEADER.unpack(self.index.read(_HEADER.size))
+        if magic != _MAGIC or size != _RECORD.size:
+            self.index.close()
+            raise ValueError(f"不是打包存储的索引文件: {self.dir / 'index.bin'}")
+        blob_mode = "rb" if self.readonly else "a+b"
+        self.audio_file = open(self.dir / "audio.bin", blob_mode)
+        self.text_file = open(self.dir / "text.bin", blob_mode)
+        self._map = None
+        self._by_id = None
+
+    def close(self):
+        with self.lock:
+            self._map = None
+            for f in (self.index, self.audio_file, self.text_file):
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return (os.fstat(self.index.fileno()).st_size - _HEADER.size) // _RECORD.size
+
+    # ---------- 读 ----------
+    def _record(self, idx: int):
+        if idx < 0:
+            return None
+        raw = os.pread(self.index.fileno(), _RECORD.size, _HEADER.size + idx * _RECORD.size)
+        if len(raw) < _RECORD.size or raw[:32] == _EMPTY:
+            return None
+        return _RECORD.unpack(raw)
+
+    def _records(self):
+        fd = self.index.fileno()
+        data = os.pread(fd, os.fstat(fd).st_size - _HEADER.size, _HEADER.size)
+        for pos in range(0, len(data) - _RECORD.size + 1, _RECORD.size):
+            rec = _RECORD.unpack_from(data, pos)
+            yield rec if rec[0] != _EMPTY else None
+
+    def ids(self):
+        """各位置的段落 ID（空位为 None）"""
+        return [rec[0].hex() if rec else None for rec in self._records()]
+
+    def segment_id(self, idx: int):
+        rec = self._record(idx)
+        return rec[0].hex() if rec else None
+
+    def locate(self, idx: int):
+        """第 idx 段音频在 audio.bin 里的 (偏移, 长度)；该位置没有音频时返回 None"""
+        rec = self._record(idx)
+        return (rec[1], rec[2]) if rec and rec[2] else None
+
+    def _audio_map(self, end: int):
+        # 只追加：映射过的区域不会变，文件变长后重新映射（旧映射随引用释放）
+        with self.lock:
+            if self._map is None or len(self._map) < end:
+                self.audio_file.flush()
+                self._map = mmap.mmap(self.audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+
+    def audio(self, idx: int):
+        rec = self._record(idx)
+        if not rec or not rec[2]:
+            return None
+        _, off, length = rec[:3]
+        return memoryview(self._audio_map(off + length))[off:off + length]
+
+    def _text_at(self, off: int, length: int) -> str:
+        with self.lock:
+            self.text_file.flush()
+        return os.pread(self.text_file.fileno(), length, off).decode("utf-8")
+
+    def text(self, idx: int) -> str:
+        rec = self._record(idx)
+        return self._text_at(rec[3], rec[4]) if rec else ""
+
+    def words(self, idx: int):
+        rec = self._record(idx)
+        if not rec or not rec[6]:
+            return []
+        return json.loads(self._text_at(rec[5], rec[6]))
+
+    def segment(self, idx: int):
+        rec = self._record(idx)
+        if not rec:
+            return None
+        words = json.loads(self._text_at(rec[5], rec[6])) if rec[6] else []
+        return Segment(idx, rec[0].hex(), self.audio(idx), self._text_at(rec[3], rec[4]), words)
+
+    def has(self, seg_id: str) -> bool:
+        """书里是否已有这段内容的音频（可能在别的位置）"""
+        with self.lock:
+            return bytes.fromhex(seg_id) in self._index_by_id()
+
+    def _index_by_id(self):
+        if self._by_id is None:
+            self._by_id = {rec[0]: rec for rec in self._records() if rec and rec[2]}
+        return self._by_id
+
+    # ---------- 写 ----------
+    def _append(self, f, data: bytes) -> int:
+        f.seek(0, os.SEEK_END)
+        off = f.tell()
+        f.write(data)
+        return off
+
+    def _write_record(self, idx: int, rec):
+        self.index.seek(_HEADER.size + idx * _RECORD.size)
+        self.index.write(_RECORD.pack(*rec) if rec else bytes(_RECORD.size))
+        self.index.flush()
+
+    def put(self, idx: int, seg_id: str, text: str, mp3: Path = None) -> bool:
+        """
+        让第 idx 段为 seg_id：位置上已是这段内容则不动（返回 False）
+        书里别处已有这段音频就复用，否则把 mp3 及其逐词时间追加进来
+        """
+        key = bytes.fromhex(seg_id)
+        with self.lock:
+            old = self._record(idx)
+            if old and old[0] == key and old[2]:
+                return False
+            shared = self._index_by_id().get(key)
+            if shared:
+                audio, words = shared[1:3], shared[5:7]
+            else:
+                data = Path(mp3).read_bytes()
+                audio = (self._append(self.audio_file, data), len(data))
+                try:
+                    blob = words_path(mp3).read_bytes()
+                except OSError:
+                    blob = b""
+                words = (self._append(self.text_file, blob), len(blob))
+            blob = text.encode("utf-8")
+            rec = (key, *audio, self._append(self.text_file, blob), len(blob), *words)
+            # 先落数据再写索引：中途退出最多留下垃圾，不会有指向半截数据的记录
+            self.audio_file.flush()
+            self.text_file.flush()
+            self._write_record(idx, rec)
+            self._index_by_id()[key] = rec
+            return True
+
+    def clear(self, idx: int):
+        # 合成失败：该位置置空，避免留下过期内容
+        with self.lock:
+            if idx < len(self):
+                self._write_record(idx, None)
+                self._by_id = None
+
+    def truncate(self, count: int):
+        with self.lock:
+            self.index.truncate(_HEADER.size + count * _RECORD.size)
+            self._by_id = None
+
+    def drop_audio(self) -> int:
+        """
+        删掉全部音频（章节已合并好、只留章节音频时用），文本和逐词时间保留
+        各记录的音频长度置 0，之后 has() 为假、再次转化时重新合成；返回释放的字节数
+        """
+        with self.lock:
+            index = bytearray(_HEADER.pack(_MAGIC, _RECORD.size))
+            for rec in self._records():
+                if rec is None:
+                    index += bytes(_RECORD.size)
+                else:
+                    index += _RECORD.pack(rec[0], 0, 0, *rec[3:])
+            freed = os.fstat(self.audio_file.fileno()).st_size
+            self._map = None
+            self.index.seek(0)
+            self.index.write(index)
+            self.index.flush()
+            self.audio_file.truncate(0)
+            self._by_id = None
+            return freed
+
+    def garbage(self) -> float:
+        """不再被任何位置引用的字节占比"""
+        live = {}
+        for rec in self._records():
+            if rec:
+                live[("a", rec[1])] = rec[2]
+                live[("t", rec[3])] = rec[4]
+                live[("w", rec[5])] = rec[6]
+        total = sum(os.fstat(f.fileno()).st_size for f in (self.audio_file, self.text_file))
+        return 1 - sum(live.values()) / total if total else 0.0
+
+    def compact(self):
+        """只保留仍被引用的数据，重写三个文件（索引最后替换）"""
+        with self.lock:
+            self.audio_file.flush()
+            self.text_file.flush()
+            records = list(self._records())
+            moved = {}
+            with open(self.dir / "audio.bin.part", "wb") as audio, open(self.dir / "text.bin.part", "wb") as text:
+                def copy(src, dst, kind, off, length):
+                    if (kind, off) not in moved:
+                        moved[kind, off] = self._append(dst, os.pread(src.fileno(), length, off))
+                    return moved[kind, off]
+
+                index = bytearray(_HEADER.pack(_MAGIC, _RECORD.size))
+                for rec in records:
+                    if rec is None:
+                        index += bytes(_RECORD.size)
+                        continue
+                    key, a_off, a_len, t_off, t_len, w_off, w_len = rec
+                    index += _RECORD.pack(
+                        key,
+                        copy(self.audio_file, audio, "a", a_off, a_len), a_len,
+                        copy(self.text_file, text, "t", t_off, t_len), t_len,
+                        copy(self.text_file, text, "w", w_off, w_len), w_len,
+                    )
+            (self.dir / "index.bin.part").write_bytes(index)
+            self.close()
+            for name in ("audio.bin", "text.bin", "index.bin"):
+                os.replace(self.dir / f"{name}.part", self.dir / name)
+            self._open()
+
+    def save_meta(self, voice: str, rate: str):
+        (self.dir / "meta.json").write_text(json.dumps({"voice": voice, "rate": rate}), encoding="utf-8")
+
+    def meta(self):
+        try:
+            return json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+
+# =========================
+# 阅读页 / 书架用：不管是打包还是散文件，都按位置 O(1) 取一段
+# =========================
+def segment_count(book_dir: Path) -> int:
+    book_dir = Path(book_dir)
+    if has_pack(book_dir):
+        return (os.path.getsize(book_dir / PACK_DIR / "index.bin") - _HEADER.size) // _RECORD.size
+    count = load_count(book_dir)
+    if count is not None:
+        return count
+    # 还没写过清单（第一次转化进行中）才数逐段文本
+    seg_dir = book_dir / "segments"
+    return sum(1 for _ in seg_dir.glob("*.txt")) if seg_dir.is_dir() else 0
+
+
+def segment_text(book_dir: Path, idx: int) -> str:
+    book_dir = Path(book_dir)
+    if has_pack(book_dir):
+        with SegmentPack(book_dir, readonly=True) as pack:
+            return pack.text(idx)
+    try:
+        return (book_dir / "segments" / f"{idx:03d}.txt").read_text(encoding="utf-8")
+    except OSError:
+        return ""
+
+
+def segment_audio(book_dir: Path, idx: int):
+    """
+    第 idx 段音频的路径；没有时返回 None
+    打包存储返回虚拟路径 <书>/pack/<idx>.mp3，由媒体服务从 audio.bin 里按偏移读取
+    """
+    book_dir = Path(book_dir)
+    if has_pack(book_dir):
+        with SegmentPack(book_dir, readonly=True) as pack:
+            return book_dir / PACK_DIR / f"{idx}.mp3" if pack.locate(idx) else None
+    path = position_path(book_dir, idx)
+    return path if path.exists() else None
+
+
+# =========================
+# 散文件 ↔ 打包 互相转换
+# =========================
+def drop_loose(book_dir: Path):
+    """删掉散文件形式的逐段数据（位置文件、逐段文本、by_id 及其完成日志、segments.json）"""
+    book_dir = Path(book_dir)
+    for pos in book_dir.glob("*.mp3"):
+        if pos.stem.isdigit():
+            pos.unlink(missing_ok=True)
+            words_path(pos).unlink(missing_ok=True)
+    for txt in (book_dir / "segments").glob("*.txt"):
+        if txt.stem.isdigit():
+            txt.unlink(missing_ok=True)
+    shutil.rmtree(book_dir / STORE_DIR, ignore_errors=True)
+    journal_path(book_dir).unlink(missing_ok=True)
+    (book_dir / SEGMENT_MANIFEST).unlink(missing_ok=True)
+
+
+def drop_segment_audio(book_dir: Path) -> int:
+    """
+    章节都合并好后删掉逐段音频，只保留逐段文本（阅读页、再次转化比对用）
+    返回释放的字节数（硬链接只算一次）
+    """
+    book_dir = Path(book_dir)
+    if has_pack(book_dir):
+        with SegmentPack(book_dir) as pack:
+            return pack.drop_audio()
+
+    freed = 0
+    seen = set()
+    files = [p for p in book_dir.glob("*.mp3") if p.stem.isdigit()]
+    store_dir = book_dir / STORE_DIR
+    if store_dir.is_dir():
+        files += store_dir.glob("*.mp3")
+    for mp3 in files:
+        for path in (mp3, words_path(mp3)):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                freed += st.st_size
+            path.unlink(missing_ok=True)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    journal_path(book_dir).unlink(missing_ok=True)
+    return freed
+
+
+def pack_book(book_dir: Path, voice="zh-CN-YunxiNeural", rate="0%") -> int:
+    """把散文件形式的书打包，返回段数"""
+    book_dir = Path(book_dir)
+    manifest = book_dir / SEGMENT_MANIFEST
+    if manifest.exists():
+        meta = json.loads(manifest.read_text(encoding="utf-8"))
+        voice, rate = meta.get("voice", voice), meta.get("rate", rate)
+    ids = load_ids(book_dir)
+
+    count = segment_count(book_dir)
+    with SegmentPack(book_dir, create=True) as pack:
+        for idx in range(count):
+            text = (book_dir / "segments" / f"{idx:03d}.txt").read_text(encoding="utf-8")
+            mp3 = position_path(book_dir, idx)
+            sid = ids[idx] if ids and idx < len(ids) else segment_id(text, voice, rate)
+            if mp3.exists():
+                pack.put(idx, sid, text, mp3)
+        # 没有音频的位置留空
+        pack.truncate(count)
+        pack.save_meta(voice, rate)
+    drop_loose(book_dir)
+    return count
+
+
+def export_book(book_dir: Path) -> int:
+    """把打包存储还原成散文件（by_id + 位置硬链接 + segments/NNN.txt），返回段数"""
+    book_dir = Path(book_dir)
+    seg_dir = book_dir / "segments"
+    seg_dir.mkdir(exist_ok=True)
+    (book_dir / STORE_DIR).mkdir(exist_ok=True)
+
+    with SegmentPack(book_dir) as pack:
+        meta = pack.meta()
+        ids = pack.ids()
+        for idx, sid in enumerate(ids):
+            seg = pack.segment(idx)
+            if seg is None:
+                continue
+            (seg_dir / f"{idx:03d}.txt").write_text(seg.text, encoding="utf-8")
+            if seg.audio is None:
+                # 音频已删掉（只留章节音频）的书
+                continue
+            store = store_path(book_dir, sid)
+            if not store.exists():
+                tmp = store.with_name(store.name + ".part")
+                tmp.write_bytes(seg.audio)
+                os.replace(tmp, store)
+                if seg.words:
+                    save_words(store, seg.words)
+            place(book_dir, idx, sid)
+    save_ids(book_dir, ids, meta.get("voice", ""), meta.get("rate", ""))
+    shutil.rmtree(book_dir / PACK_DIR)
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="逐段数据在散文件和打包存储之间转换")
+    parser.add_argument("action", choices=["pack", "export", "compact"])
+    parser.add_argument("books", nargs="+", help="书目录")
+    args = parser.parse_args()
+
+    for book in map(Path, args.books):
+        if args.action == "pack":
+            print(f"📦 {book.name}：打包 {pack_book(book)} 段")
+        elif args.action == "export":
+            print(f"📂 {book.name}：导出 {export_book(book)} 段")
+        else:
+            with SegmentPack(book) as pack:
+                before = pack.garbage()
+                pack.compact()
+            print(f"🧹 {book.name}：压缩前垃圾占比 {before:.0%}")
+
+
+if __name__ == "__main__":
+    main()
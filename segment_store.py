@@ -0,0 +1,159 @@
+import json
+import os
+from pathlib import Path
+
+from timing import words_path
+from tts import detect_language
+from tts_cache import cache_key, link_or_copy
+
+# =========================
+# 按内容寻址的逐段音频
+# - 段落 ID = 文本 + 实际播音员 + 语速 的哈希（与 TTS 缓存的 key 相同）
+# - 音频存一份在 <书>/by_id/<ID>.mp3，书目录下的 NNN.mp3 只是指向它的硬链接
+# - <书>/segments.json 按顺序记录每个位置的段落 ID
+# 重新转化时逐位置比较 ID：没变的不动，挪了位置的重新链接，只有新内容才走 TTS；
+# 没变的位置文件不变，章节合并的清单据此只重做受影响的章节
+# =========================
+SEGMENT_MANIFEST = "segments.json"
+STORE_DIR = "by_id"
+
+
+def segment_id(text: str, voice: str, rate: str) -> str:
+    return cache_key(text, detect_language(text, voice), rate)
+
+
+def store_path(book_dir: Path, seg_id: str) -> Path:
+    return Path(book_dir) / STORE_DIR / f"{seg_id}.mp3"
+
+
+def position_path(book_dir: Path, idx: int) -> Path:
+    return Path(book_dir) / f"{idx:03d}.mp3"
+
+
+def load_ids(book_dir: Path):
+    """上次转化时各位置的段落 ID；没有清单（旧版本转化的书）返回 None"""
+    try:
+        return json.loads((Path(book_dir) / SEGMENT_MANIFEST).read_text(encoding="utf-8"))["segments"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_count(book_dir: Path):
+    """清单里记下的段数；没有清单返回 None"""
+    try:
+        data = json.loads((Path(book_dir) / SEGMENT_MANIFEST).read_text(encoding="utf-8"))
+        # 早先写的清单没有 count
+        return int(data["count"]) if "count" in data else len(data["segments"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_ids(book_dir: Path, ids, voice: str, rate: str):
+    path = Path(book_dir) / SEGMENT_MANIFEST
+    tmp = path.with_name(SEGMENT_MANIFEST + ".tmp")
+    # count 供书架直接读段数，不必列目录
+    tmp.write_text(json.dumps({"voice": voice, "rate": rate, "count": len(ids), "segments": ids}),
+                   encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def old_id(book_dir: Path, idx: int, old_ids, voice: str, rate: str):
+    """
+    位置 idx 上一次的段落 ID
+    旧版本转化的书没有清单，用 segments/NNN.txt 里的旧文本现算（须在覆盖文本之前调用）
+    """
+    if old_ids is not None:
+        return old_ids[idx] if idx < len(old_ids) else None
+    try:
+        text = (Path(book_dir) / "segments" / f"{idx:03d}.txt").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    return segment_id(text, voice, rate)
+
+
+def adopt(book_dir: Path, idx: int, seg_id: str, previous_id):
+    """
+    位置上已有的音频正是这段内容、但还没收进 by_id（旧版本转化的书），把它收进去
+    返回 True 表示收进去了（调用方再校验、记进完成日志）
+    """
+    store = store_path(book_dir, seg_id)
+    pos = position_path(book_dir, idx)
+    if store.exists() or previous_id != seg_id or not pos.exists():
+        return False
+    store.parent.mkdir(exist_ok=True)
+    link_or_copy(pos, store)
+    if words_path(pos).exists():
+        link_or_copy(words_path(pos), words_path(store))
+    return True
+
+
+def _same(a: Path, b: Path) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def place(book_dir: Path, idx: int, seg_id, ok=True):
+    """
+    让位置 idx 指向 seg_id 的音频；已经指向它就什么都不做（文件 mtime 不变）
+    ok 为 False（合成失败）时删掉该位置上的旧音频，避免留下过期内容
+    返回 True 表示位置上的文件有变化
+    """
+    pos = position_path(book_dir, idx)
+    if not ok or seg_id is None:
+        existed = pos.exists()
+        pos.unlink(missing_ok=True)
+        words_path(pos).unlink(missing_ok=True)
+        return existed
+
+    store = store_path(book_dir, seg_id)
+    if _same(store, pos):
+        return False
+    link_or_copy(store, pos)
+    if words_path(store).exists():
+        link_or_copy(words_path(store), words_path(pos))
+    else:
+        words_path(pos).unlink(missing_ok=True)
+    return True
+
+
+def cleanup(book_dir: Path, ids, chapters: int):
+    """
+    整本转化完成后：删掉多出来的位置文件、不再引用的 by_id 音频、残留的临时文件和多出来的章节
+    返回删除的 by_id 音频数
+    """
+    book_dir = Path(book_dir)
+    count = len(ids)
+
+    for pos in book_dir.glob("*.mp3"):
+        if pos.stem.isdigit() and int(pos.stem) >= count:
+            pos.unlink(missing_ok=True)
+            words_path(pos).unlink(missing_ok=True)
+    for txt in (book_dir / "segments").glob("*.txt"):
+        if txt.stem.isdigit() and int(txt.stem) >= count:
+            txt.unlink(missing_ok=True)
+
+    removed = 0
+    keep = set(ids)
+    store_dir = book_dir / STORE_DIR
+    if store_dir.is_dir():
+        for mp3 in store_dir.glob("*.mp3"):
+            if mp3.stem not in keep:
+                mp3.unlink(missing_ok=True)
+                words_path(mp3).unlink(missing_ok=True)
+                removed += 1
+        # 上次崩溃时没写完的 TTS 临时文件（见 tts._tts_once）
+        for tmp in store_dir.glob("*.part"):
+            tmp.unlink(missing_ok=True)
+
+    remove_extra_chapters(book_dir, chapters)
+    return removed
+
+
+def remove_extra_chapters(book_dir: Path, chapters: int):
+    # 章数变少了：删掉多出来的章节（含转码后的紧凑文件）及其时间索引
+    for ch in (Path(book_dir) / "chapters").glob("chapter_*"):
+        num = ch.name.split(".")[0].split("_")[-1]
+        if num.isdigit() and int(num) >= chapters:
+            ch.unlink(missing_ok=True)
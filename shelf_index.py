@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import mp3frames
+import playlist
+import timing
+from transcode import chapter_files
+from segment_pack import PACK_DIR, segment_count
+
+# =========================
+# 书架索引
+# - 每本书一个 book.json：格式、章节列表（含时长、是否有逐词时间）、逐段文本数、是否正在转化
+# - books/.index/catalog.json 汇总所有书，书架页面只读这一个文件
+#   （放在子目录里，写它不会改动书架目录本身的 mtime）
+# - 用目录 mtime 判断是否过期，过期才重新扫描该书
+# =========================
+BOOK_INDEX = "book.json"
+CATALOG = Path(".index") / "catalog.json"
+
+_lock = threading.Lock()
+
+
+def _write_json(path: Path, data):
+    # 先写临时文件再原子替换，读者永远看不到写了一半的 json
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _signature(book_dir: Path):
+    # 章节目录、逐段文本目录的 mtime，增删文件都会改变它；打包存储看索引文件的 mtime
+    # （不含书目录本身：写 book.json 会改动它）
+    sig = []
+    for d in (book_dir / "chapters", book_dir / "segments", book_dir / PACK_DIR / "index.bin"):
+        try:
+            sig.append(d.stat().st_mtime_ns)
+        except OSError:
+            sig.append(0)
+    return sig
+
+
+def _book_format(book_dir: Path):
+    fmt = book_dir / "format.txt"
+    if fmt.exists():
+        return fmt.read_text().replace(".", "").upper()
+    src = list(book_dir.glob("source.*"))
+    return src[0].suffix.replace(".", "").upper() if src else "UNK"
+
+
+def _chapter_number(path: Path):
+    num = path.stem.rsplit("_", 1)[-1]
+    return (0, int(num), "") if num.isdigit() else (1, 0, path.name)
+
+
+def _duration(chapter: Path) -> float:
+    if chapter.suffix == ".mp3":
+        return mp3frames.duration(chapter)
+    # 转码后的 aac / opus 不逐帧解析，时长取自时间索引（各段时长之和）
+    data = _read_json(timing.chapter_timing_path(chapter)) or {}
+    return sum(seg["dur"] for seg in data.get("segments", [])) / 1000
+
+
+def scan_book(book_dir: Path):
+    """
+    扫描一本书的目录并写入 book.json
+    """
+    book_dir = Path(book_dir)
+    sig = _signature(book_dir)
+    chapters_dir = book_dir / "chapters"
+
+    chapters = []
+    if chapters_dir.is_dir():
+        # 按书本身分章时，流水线在合并清单里记下了各章标题
+        titles = (_read_json(chapters_dir / "manifest.json") or {}).get("titles") or []
+        # 按章号的数值排序，超过 99 章也不乱序；转码过的章节列出紧凑文件
+        for ch in sorted(chapter_files(chapters_dir), key=_chapter_number):
+            other, num, _ = _chapter_number(ch)
+            chapters.append({
+                "file": ch.name,
+                "title": titles[num] if not other and num < len(titles) else "",
+                "duration": round(_duration(ch), 1),
+                # 是否有逐词时间索引（同步阅读用）
+                "timing": timing.chapter_timing_path(ch).exists(),
+            })
+
+    segments = segment_count(book_dir)
+
+    info = {
+        "name": book_dir.name,
+        "format": _book_format(book_dir),
+        "chapters": chapters,
+        "segments": segments,
+        # 正在转化：书架用播放列表边转边听
+        "live": playlist.is_live(book_dir),
+        "duration": round(sum(c["duration"] for c in chapters), 1),
+        "signature": sig,
+    }
+    if book_dir.is_dir():
+        _write_json(book_dir / BOOK_INDEX, info)
+    return info
+
+
+def load_book(book_dir: Path, cached=None):
+    """
+    读取一本书的索引；mtime 变了才重新扫描
+    cached 为 catalog 里已有的条目，可省去一次读文件
+    """
+    book_dir = Path(book_dir)
+    sig = _signature(book_dir)
+    info = cached or _read_json(book_dir / BOOK_INDEX)
+    if info and info.get("signature") == sig:
+        return info
+    return scan_book(book_dir)
+
+
+def _load_catalog_file(books_dir: Path):
+    return _read_json(books_dir / CATALOG) or {"books": {}}
+
+
+def _save_catalog_file(books_dir: Path, catalog):
+    (books_dir / CATALOG).parent.mkdir(exist_ok=True)
+    _write_json(books_dir / CATALOG, catalog)
+
+
+def update_book(book_dir: Path):
+    """
+    转化流程里调用：重新扫描这本书并刷新总目录
+    （新建的书会改动书架目录 mtime，下次 load_catalog 时自然会整体校验一遍）
+    """
+    book_dir = Path(book_dir)
+    info = scan_book(book_dir)
+    books_dir = book_dir.parent
+    with _lock:
+        catalog = _load_catalog_file(books_dir)
+        catalog["books"][book_dir.name] = info
+        _save_catalog_file(books_dir, catalog)
+    return info
+
+
+def remove_book(books_dir: Path, name: str):
+    books_dir = Path(books_dir)
+    with _lock:
+        catalog = _load_catalog_file(books_dir)
+        if catalog["books"].pop(name, None) is not None:
+            _save_catalog_file(books_dir, catalog)
+
+
+def load_catalog(books_dir: Path):
+    """
+    返回按书名排序的书目列表（各条目未逐本校验，翻到哪页再用 load_book 校验哪页）
+    书架目录 mtime 变化（有书增删）时重建总目录，未变化的书沿用旧条目
+    """
+    books_dir = Path(books_dir)
+    with _lock:
+        catalog = _load_catalog_file(books_dir)
+        mtime = books_dir.stat().st_mtime_ns
+        if catalog.get("mtime") != mtime:
+            old = catalog["books"]
+            books = {}
+            for d in books_dir.iterdir():
+                if d.is_dir() and not d.name.startswith("."):
+                    books[d.name] = load_book(d, old.get(d.name))
+            catalog = {"books": books}
+            _save_catalog_file(books_dir, catalog)
+            # 首次创建 .index 目录会改动书架目录 mtime，所以写完再取
+            catalog["mtime"] = books_dir.stat().st_mtime_ns
+            _save_catalog_file(books_dir, catalog)
+    return [catalog["books"][name] for name in sorted(catalog["books"])]
+
+
+def validate(books_dir: Path, entries):
+    """
+    校验当前页的书目：过期的重新扫描，并写回总目录
+    """
+    books_dir = Path(books_dir)
+    fresh, changed = [], {}
+    for entry in entries:
+        info = load_book(books_dir / entry["name"], entry)
+        if info is not entry:
+            changed[entry["name"]] = info
+        fresh.append(info)
+
+    if changed:
+        with _lock:
+            catalog = _load_catalog_file(books_dir)
+            catalog["books"].update(changed)
+            _save_catalog_file(books_dir, catalog)
+    return fresh
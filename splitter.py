@@ -1,19 +1,275 @@
 import re
+import zlib
 
-def split_for_audio(text: str, max_chars=700):
+# 切分规则有变化时加 1，使已缓存的解析文本失效（见 text_cache.py）
+SPLITTER_VERSION = 2
+MAX_CHARS = 700   # 按字数切分时每段的字数上限
+
+# ===== 可调参数 =====
+# 内容定义的切分点：一段够长后，在"锚点句"之后就切（是不是锚点只看这句本身的内容）
+# 改动一句只会影响它所在的段（最多再波及到下一个锚点），后面的段边界不变，
+# 按内容寻址的段落 ID（见 segment_store.py）照常复用，只需重新合成一两段
+CUT_MIN_RATIO = 0.5    # 按字数切分：段落达到字数上限的这个比例后才会在锚点处切
+ANCHOR_SPAN = 0.35     # 按字数切分：锚点之间平均相隔的字数（占上限的比例）
+BALANCED_CUT_MIN = 0.7 # 按时长切分：达到目标时长的这个比例后才会在锚点处切
+BALANCED_SPAN = 0.25   # 按时长切分：锚点之间平均相隔的时长（占目标时长的比例）
+# ===================
+
+
+def _anchor(sentence: str, size: float, span: float) -> bool:
     """
-    继承您验证成功的 700 字逻辑
+    sentence 是否为锚点：按句子内容的 CRC32 决定，与它在书里的位置、前后的切分无关
+    size 为这句的长度（字数或秒数），越长的句子越可能是锚点，平均每 span 出现一个
     """
-    sentences = re.split(r"(?<=[。！？；.!?])", text)
-    chunks = []
-    current = ""
-    for s in sentences:
-        s = s.strip()
-        if not s: continue
+    return zlib.crc32(sentence.encode("utf-8")) < size / span * 0x100000000
+
+
+def _finish_chars(current, tail, max_chars):
+    # 文本结束（或一章结束）：接上最后半句，产出剩下的内容
+    s = tail.strip()
+    if s:
         if len(current) + len(s) <= max_chars:
             current += s
         else:
-            if current.strip(): chunks.append(current.strip())
+            if current.strip(): yield current.strip()
             current = s
-    if current.strip(): chunks.append(current.strip())
-    return chunks
\ No newline at end of file
+    if current.strip(): yield current.strip()
+
+
+def iter_split_for_audio(texts, max_chars=MAX_CHARS):
+    """
+    流式切分：texts 是依次到来的文本片段（页/章节）
+    跨片段的半句话会接到下一片段开头，切分结果与整段切分一致
+    texts 里的章节标记（ingest.ChapterMark）原样产出，段落不跨章
+    每段不超过 max_chars；够长后在锚点句之后切（见 _anchor），修改一句不会让后面的段边界整体移动
+    """
+    min_chars = max_chars * CUT_MIN_RATIO
+    span = max_chars * ANCHOR_SPAN
+    current = ""
+    tail = ""
+    for text in texts:
+        if not isinstance(text, str):
+            yield from _finish_chars(current, tail, max_chars)
+            current = tail = ""
+            yield text
+            continue
+        if tail:
+            text = tail + " " + text
+        sentences = re.split(r"(?<=[。！？；.!?])", text)
+        # 最后一块没有句末标点，留给下一个片段
+        tail = sentences.pop()
+        for s in sentences:
+            s = s.strip()
+            if not s: continue
+            if len(current) + len(s) <= max_chars:
+                current += s
+            else:
+                if current.strip(): yield current.strip()
+                current = s
+            if len(current) >= min_chars and _anchor(s, len(s), span):
+                yield current.strip()
+                current = ""
+    yield from _finish_chars(current, tail, max_chars)
+
+def split_for_audio(text: str, max_chars=MAX_CHARS):
+    """
+    继承您验证成功的 700 字逻辑
+    """
+    return list(iter_split_for_audio([text], max_chars))
+
+
+# =========================
+# 按朗读时长均衡切分
+# =========================
+TARGET_SECONDS = 90    # 每段期望的朗读时长
+MAX_SECONDS = 150      # 单段时长硬上限，超长的单句会在逗号/空白处再切
+
+# 语速为 0% 时每秒朗读的字符数（按文字类别）
+CHARS_PER_SECOND = {
+    "cjk": 4.5,     # 汉字
+    "latin": 14.0,  # 英文字母、空格
+    "digit": 4.0,   # 数字逐位/按数值读出，较慢
+}
+# 标点带来的停顿（秒）
+PAUSE_SECONDS = {
+    "long": 0.4,    # 句末：。！？；.!?;
+    "short": 0.15,  # 句中：，、,：:
+}
+
+
+def _rate_factor(rate: str) -> float:
+    # "+20%" → 1.2，"-20%" → 0.8
+    m = re.fullmatch(r"\s*([+-]?\d+(?:\.\d+)?)%\s*", rate or "0%")
+    return max(0.1, 1 + float(m.group(1)) / 100) if m else 1.0
+
+
+def estimate_duration(text: str, rate="0%") -> float:
+    """
+    估算一段文字的朗读时长（秒）
+    """
+    seconds = 0.0
+    for c in text:
+        if '\u4e00' <= c <= '\u9fff':
+            seconds += 1 / CHARS_PER_SECOND["cjk"]
+        elif c.isdigit():
+            seconds += 1 / CHARS_PER_SECOND["digit"]
+        elif c in "。！？；.!?;":
+            seconds += PAUSE_SECONDS["long"]
+        elif c in "，、,：:":
+            seconds += PAUSE_SECONDS["short"]
+        else:
+            seconds += 1 / CHARS_PER_SECOND["latin"]
+    return seconds / _rate_factor(rate)
+
+
+def _split_long_sentence(s: str, max_seconds: float, rate: str):
+    """
+    单句超过硬上限：先按逗号切，还太长按空白切，最后按字数硬切
+    """
+    for pattern in (r"(?<=[，、,；;：:])", r"(?<=\s)"):
+        pieces = [p for p in re.split(pattern, s) if p.strip()]
+        if len(pieces) > 1:
+            break
+    else:
+        pieces = [s]
+
+    out, current = [], ""
+    for p in pieces:
+        if estimate_duration(current + p, rate) <= max_seconds:
+            current += p
+            continue
+        if current.strip():
+            out.append(current.strip())
+        current = p
+        if estimate_duration(p, rate) > max_seconds:
+            if len(pieces) > 1:
+                out.extend(_split_long_sentence(p, max_seconds, rate))
+            else:
+                # 既没有逗号也没有空白：按估算的字数硬切
+                step = max(1, int(len(p) * max_seconds / estimate_duration(p, rate)))
+                out.extend(p[i:i + step].strip() for i in range(0, len(p), step) if p[i:i + step].strip())
+            current = ""
+    if current.strip():
+        out.append(current.strip())
+    return out
+
+
+def _iter_sentences(texts):
+    # 与 iter_split_for_audio 相同的跨片段断句；章节标记前先产出剩下的半句
+    tail = ""
+    for text in texts:
+        if not isinstance(text, str):
+            if tail.strip():
+                yield tail.strip()
+            tail = ""
+            yield text
+            continue
+        if tail:
+            text = tail + " " + text
+        sentences = re.split(r"(?<=[。！？；.!?])", text)
+        tail = sentences.pop()
+        for s in sentences:
+            if s.strip():
+                yield s.strip()
+    if tail.strip():
+        yield tail.strip()
+
+
+def iter_split_balanced(texts, target_seconds=TARGET_SECONDS, max_seconds=MAX_SECONDS, rate="0%"):
+    """
+    按预估朗读时长切分，让每段时长尽量接近 target_seconds：
+    - 加入下一句后更接近目标就加入，否则另起一段
+    - 任何一段都不超过 max_seconds
+    - 最后一段太短时并入前一段（不超过上限的前提下）
+    - 达到目标的 BALANCED_CUT_MIN 后在锚点句之后切（见 _anchor），修改一句不会让后面的段边界整体移动
+    - 章节标记原样产出，段落不跨章（每章各自按上面的规则收尾）
+    """
+    min_seconds = target_seconds * BALANCED_CUT_MIN
+    span = target_seconds * BALANCED_SPAN
+    pending = None          # 已切好、暂缓产出的上一段，用于吸收过短的结尾
+    current, current_dur = "", 0.0
+
+    def emit(chunk):
+        nonlocal pending
+        if pending is not None:
+            yield pending
+        pending = chunk
+
+    def finish():
+        nonlocal pending, current, current_dur
+        if current:
+            if (pending is not None and current_dur < target_seconds / 2
+                    and estimate_duration(pending, rate) + current_dur <= max_seconds):
+                pending, current = pending + current, ""
+            else:
+                yield from emit(current)
+        if pending is not None:
+            yield pending
+        pending, current, current_dur = None, "", 0.0
+
+    for s in _iter_sentences(texts):
+        if not isinstance(s, str):
+            yield from finish()
+            yield s
+            continue
+        dur = estimate_duration(s, rate)
+        pieces = [s] if dur <= max_seconds else _split_long_sentence(s, max_seconds, rate)
+        for piece in pieces:
+            dur = estimate_duration(piece, rate)
+            total = current_dur + dur
+            if not current or (total <= max_seconds and abs(total - target_seconds) <= abs(current_dur - target_seconds)):
+                current, current_dur = current + piece, total
+            else:
+                yield from emit(current)
+                current, current_dur = piece, dur
+            if current_dur >= min_seconds and _anchor(piece, dur, span):
+                yield from emit(current)
+                current, current_dur = "", 0.0
+
+    yield from finish()
+
+
+def split_balanced(text: str, target_seconds=TARGET_SECONDS, max_seconds=MAX_SECONDS, rate="0%"):
+    return list(iter_split_balanced([text], target_seconds, max_seconds, rate))
+
+
+def chunk_stats(chunks, rate="0%"):
+    """
+    段落时长统计（秒）：数量、均值、标准差、变异系数、最短、最长
+    """
+    return duration_stats([estimate_duration(c, rate) for c in chunks])
+
+
+def duration_stats(durations):
+    if not durations:
+        return {"count": 0, "mean": 0.0, "std": 0.0, "cv": 0.0, "min": 0.0, "max": 0.0}
+    mean = sum(durations) / len(durations)
+    std = (sum((d - mean) ** 2 for d in durations) / len(durations)) ** 0.5
+    return {
+        "count": len(durations),
+        "mean": round(mean, 1),
+        "std": round(std, 1),
+        "cv": round(std / mean, 3) if mean else 0.0,
+        "min": round(min(durations), 1),
+        "max": round(max(durations), 1),
+    }
+
+
+def cache_params(split_mode="chars", rate="0%"):
+    """影响切分结果的全部版本号和参数，text_cache.text_key 据此判断缓存是否失效"""
+    if split_mode == "duration":
+        return [SPLITTER_VERSION, "duration", TARGET_SECONDS, MAX_SECONDS, rate,
+                CHARS_PER_SECOND, PAUSE_SECONDS, BALANCED_CUT_MIN, BALANCED_SPAN]
+    return [SPLITTER_VERSION, "chars", MAX_CHARS, CUT_MIN_RATIO, ANCHOR_SPAN]
+
+
+if __name__ == "__main__":
+    # 对比两种切分方式的时长分布：python splitter.py 文档路径 [语速]
+    import sys
+    from ingest import load_document
+    from cleaner import clean_text
+
+    text = clean_text(load_document(sys.argv[1]))
+    rate = sys.argv[2] if len(sys.argv) > 2 else "0%"
+    print("按字数切分:", chunk_stats(split_for_audio(text), rate))
+    print("按时长切分:", chunk_stats(split_balanced(text, rate=rate), rate))
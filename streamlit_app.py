@@ -1,5 +1,5 @@
 import streamlit as st
-import os, shutil, re, subprocess, base64, time
+import os, shutil, re, time
 from pathlib import Path
 
 # =====================================================
@@ -112,11 +112,6 @@ with st.sidebar:
     st.selectbox("选择播音员", list(voice_map.keys()), key="voice_label")
     st.select_slider("语速调节", ["-20%", "正常", "+20%"], value="正常", key="rate_label")
 
-    if st.button("🗑 清空整个书架"):
-        shutil.rmtree("books", ignore_errors=True)
-        Path("books").mkdir(exist_ok=True)
-        st.rerun()
-
 # =====================================================
 # TTS 参数获取（让 Sidebar 设置真正生效）
 # =====================================================
@@ -138,15 +133,50 @@ def get_tts_config():
 # =====================================================
 # 核心模块
 # =====================================================
-from ingest import load_document
-from cleaner import clean_text
-from splitter import split_for_audio
-from tts import text_to_mp3
+from jobs import JobQueue, WorkerPool
+from media_server import MEDIA_HOST, start_media_server, media_path, media_url_js, media_base_js
+import json
+import timing
+import shelf_index
+import segment_pack
+import playlist
+from text_cache import save_upload
 
 BASE_DIR = Path(__file__).parent.resolve()
 BOOKS_DIR = BASE_DIR / "books"
 BOOKS_DIR.mkdir(exist_ok=True)
 
+# =====================================================
+# 音频走本地媒体服务（支持 Range），页面里只放 URL
+# =====================================================
+@st.cache_resource
+def _media_server():
+    # 没有用 LISTEN_MEDIA_HOST 指定时，跟 Streamlit 监听同一地址（server.address 没配置时两者都监听所有网卡，
+    # 局域网里打开页面的手机、电脑也能拿到音频）
+    host = MEDIA_HOST or st.get_option("server.address") or ""
+    return start_media_server(BOOKS_DIR, host=host)
+
+_media_server()
+
+# =====================================================
+# 后台转化：任务进 SQLite 队列，由本进程的 worker 线程池执行
+# 页面刷新/关闭不影响转化，多人同时提交也共用同一个 TTS 并发上限
+# =====================================================
+@st.cache_resource
+def _job_workers():
+    queue = JobQueue()
+    return queue, WorkerPool(queue)
+
+job_queue, _ = _job_workers()
+
+with st.sidebar:
+    # 有任务在排队/转化时不能清空：worker 还在往书目录里写，删掉会留下孤儿任务和转了一半的书
+    busy = job_queue.has_active()
+    if st.button("🗑 清空整个书架", disabled=busy, help="还有转化任务未结束" if busy else None):
+        shutil.rmtree(BOOKS_DIR, ignore_errors=True)
+        BOOKS_DIR.mkdir(exist_ok=True)
+        st.rerun()
+
 # =====================================================
 # Session State
 # =====================================================
@@ -154,7 +184,8 @@ for k, v in {
     "shelf_playing_book": None,
     "shelf_chapter_idx": {},
     "active_book": None,
-    "play_idx": 0
+    "play_idx": 0,
+    "shelf_page": 1
 }.items():
     if k not in st.session_state:
         st.session_state[k] = v
@@ -162,31 +193,258 @@ for k, v in {
 # =====================================================
 # 工具函数
 # =====================================================
-def get_book_format(book_dir):
-    fmt = book_dir / "format.txt"
-    if fmt.exists():
-        return fmt.read_text().replace(".", "").upper()
-    src = list(book_dir.glob("source.*"))
-    return src[0].suffix.replace(".", "").upper() if src else "UNK"
+SHELF_PAGE_SIZE = 20   # 书架每页显示的书数
+
+def _render_job_list():
+    jobs = job_queue.list_jobs()
+    if not jobs:
+        return
+    st.markdown("#### 🛠 转化任务")
+    icons = {"queued": "⏳", "running": "🔊", "done": "✅", "partial": "⚠️", "failed": "❌"}
+    for job in jobs:
+        name = Path(job["book_dir"]).name
+        label = f"{icons[job['status']]} {name}"
+        if job["total"]:
+            label += f"　{job['done']}/{job['total']}{'' if job['total_final'] else '+'} 段"
+        if job["eta"] is not None:
+            label += f"　预计剩余 {int(job['eta'] // 60)} 分 {int(job['eta'] % 60)} 秒"
+        if job["status"] in ("queued", "running"):
+            st.progress(job["fraction"], text=label)
+        else:
+            st.write(label + (f"　{job['error']}" if job["error"] else ""))
+
+@st.fragment(run_every=2)
+def _render_jobs_live():
+    # 只有这一块定时刷新，不会打断书架上正在播放的音频
+    _render_job_list()
+    # 任务全部结束后整页刷新一次：书架显示新书，之后不再轮询
+    if not job_queue.has_active():
+        st.rerun()
 
-def render_chapter_player(mp3_path, book_id):
-    with open(mp3_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
+def render_jobs():
+    # 有任务在排队/转化时才轮询进度
+    if job_queue.has_active():
+        _render_jobs_live()
+    else:
+        _render_job_list()
+
+def render_audio(mp3_path, player_id, next_label, height=70):
+    """
+    播放器只拿到文件 URL，由浏览器按需分段下载；播完点击隐藏的 next_label 按钮
+    """
+    src = media_url_js(media_path(mp3_path, BOOKS_DIR))
     st.components.v1.html(f"""
-    <audio id="player-{book_id}" controls autoplay style="width:100%">
-      <source src="data:audio/mp3;base64,{b64}">
-    </audio>
+    <audio id="{player_id}" controls autoplay preload="metadata" style="width:100%"></audio>
     <script>
-      document.getElementById("player-{book_id}").onended = function() {{
+      var player = document.getElementById("{player_id}");
+      player.src = {src};
+      player.onended = function() {{
         var btns = window.parent.document.querySelectorAll("button");
         for (var b of btns) {{
-          if (b.innerText.includes("NEXT_CH_{book_id}")) {{
+          if (b.innerText.includes("{next_label}")) {{
             b.click(); break;
           }}
         }}
       }};
     </script>
-    """, height=70)
+    """, height=height)
+
+def render_chapter_player(mp3_path, book_id):
+    render_audio(mp3_path, f"player-{book_id}", f"NEXT_CH_{book_id}")
+
+# 边转边听：轮询书的播放列表（playlist.m3u8），按顺序接着播已经合成好的段
+# 两个 audio 交替：一个在播，另一个预先加载下一段，切换时没有等待
+LIVE_PLAYER_HTML = """
+<audio id="lv-a" controls preload="auto" style="width:100%"></audio>
+<audio id="lv-b" controls preload="auto" style="width:100%;display:none"></audio>
+<div id="lv-status" style="font-size:0.85rem;color:#6b7280"></div>
+<script>
+  var base = __BASE__;
+  var url = __PLAYLIST__;
+  var dir = url.split("?")[0].replace(/[^/]*$/, "");
+  var players = [document.getElementById("lv-a"), document.getElementById("lv-b")];
+  var items = [], ended = false, cur = -1, stalled = false;
+
+  function status() {
+    document.getElementById("lv-status").textContent =
+      "第 " + (cur + 1) + " / " + items.length + " 段" + (ended ? "" : "（转化中，新段落会自动接上）");
+  }
+
+  function preload(i) {
+    var p = players[(i + 1) % 2];
+    if (i < items.length && p.dataset.i != i) {
+      p.dataset.i = i;
+      p.src = base + dir + items[i];
+    }
+  }
+
+  function play(i) {
+    cur = i;
+    stalled = false;
+    var p = players[i % 2], other = players[(i + 1) % 2];
+    if (p.dataset.i != i) { p.dataset.i = i; p.src = base + dir + items[i]; }
+    other.pause();
+    other.style.display = "none";
+    p.style.display = "";
+    p.play();
+    preload(i + 1);
+    status();
+  }
+
+  players.forEach(function(p) {
+    p.onended = function() {
+      if (cur + 1 < items.length) play(cur + 1); else stalled = true;
+    };
+  });
+
+  function parse(text) {
+    var lines = text.split("\\n");
+    lines.pop();   // 最后一行可能还没写完
+    var list = [];
+    lines.forEach(function(l) {
+      l = l.trim();
+      if (l === "#EXT-X-ENDLIST") ended = true;
+      else if (l && l[0] !== "#") list.push(l);
+    });
+    items = list;
+    if (cur < 0 && items.length) play(0);
+    else if (stalled && cur + 1 < items.length) play(cur + 1);
+    else { preload(cur + 1); status(); }
+  }
+
+  function poll() {
+    fetch(base + url.split("?")[0] + "?t=" + Date.now())
+      .then(function(r) { return r.text(); })
+      .then(parse)
+      .finally(function() { if (!ended) setTimeout(poll, 2000); });
+  }
+  poll();
+</script>
+"""
+
+def render_live_player(book_dir):
+    html = (LIVE_PLAYER_HTML
+            .replace("__BASE__", media_base_js())
+            .replace("__PLAYLIST__", json.dumps(media_path(playlist.playlist_path(book_dir), BOOKS_DIR))))
+    st.components.v1.html(html, height=100)
+
+# 同步阅读器：整章音频连续播放，逐词高亮、点词跳转、自动下一章全在浏览器里完成
+SYNC_READER_HTML = """
+<style>
+  #sr-text { position:relative; height:420px; overflow-y:auto; padding:16px;
+             border:2px solid #f59e0b; border-radius:8px; line-height:1.9; font-size:1.05rem; }
+  #sr-text .w { cursor:pointer; border-radius:3px; }
+  #sr-text .w.on { background:#fde68a; }
+  #sr-text .seg { margin:0 0 12px 0; cursor:pointer; }
+  #sr-text .seg.on { background:#fffbeb; }
+  #sr-title { font-size:0.85rem; color:#6b7280; margin:4px 0; }
+</style>
+<audio id="sr-audio" controls preload="metadata" style="width:100%"></audio>
+<div id="sr-title"></div>
+<div id="sr-text"></div>
+<script>
+  var base = __BASE__;
+  var chapters = __CHAPTERS__;
+  var audio = document.getElementById("sr-audio");
+  var box = document.getElementById("sr-text");
+  var cur = -1, segs = [], words = [], lastS = null, lastW = null;
+
+  function load(i, autoplay) {
+    if (i < 0 || i >= chapters.length) return;
+    cur = i;
+    document.getElementById("sr-title").textContent = "第 " + (i + 1) + " / " + chapters.length + " 章";
+    fetch(base + chapters[i].timing).then(function(r) { return r.json(); }).then(function(t) {
+      render(t.segments);
+      audio.src = base + chapters[i].audio;
+      if (autoplay) audio.play();
+    });
+  }
+
+  function render(list) {
+    segs = []; words = []; lastS = lastW = null; box.innerHTML = "";
+    list.forEach(function(s) {
+      var p = document.createElement("p");
+      p.className = "seg";
+      p.dataset.t = s.start;
+      var pos = 0;
+      s.words.forEach(function(w) {
+        if (w[2] < pos) return;   // 没对上文本的词
+        if (w[2] > pos) p.appendChild(document.createTextNode(s.text.slice(pos, w[2])));
+        var span = document.createElement("span");
+        span.className = "w";
+        span.textContent = s.text.substr(w[2], w[3]);
+        span.dataset.t = s.start + w[0];
+        p.appendChild(span);
+        words.push([s.start + w[0], span]);
+        pos = w[2] + w[3];
+      });
+      if (pos < s.text.length) p.appendChild(document.createTextNode(s.text.slice(pos)));
+      box.appendChild(p);
+      segs.push([s.start, p]);
+    });
+  }
+
+  // 点哪个词（或哪段）就从哪里开始播
+  box.onclick = function(e) {
+    var el = e.target.closest("[data-t]");
+    if (!el) return;
+    audio.currentTime = el.dataset.t / 1000;
+    audio.play();
+  };
+
+  // 找最后一个起点 <= ms 的条目
+  function find(list, ms) {
+    var lo = 0, hi = list.length - 1, ans = -1;
+    while (lo <= hi) {
+      var mid = (lo + hi) >> 1;
+      if (list[mid][0] <= ms) { ans = mid; lo = mid + 1; } else { hi = mid - 1; }
+    }
+    return ans < 0 ? null : list[ans][1];
+  }
+
+  function update() {
+    var ms = audio.currentTime * 1000;
+    var s = find(segs, ms), w = find(words, ms);
+    if (s !== lastS) {
+      if (lastS) lastS.classList.remove("on");
+      if (s) {
+        s.classList.add("on");
+        box.scrollTop = s.offsetTop - box.clientHeight / 3;
+      }
+      lastS = s;
+    }
+    if (w !== lastW) {
+      if (lastW) lastW.classList.remove("on");
+      if (w) w.classList.add("on");
+      lastW = w;
+    }
+  }
+
+  function tick() {
+    update();
+    if (!audio.paused) requestAnimationFrame(tick);
+  }
+
+  audio.onplay = tick;
+  audio.onseeked = update;
+  audio.onended = function() { load(cur + 1, true); };
+  load(__START__, false);
+</script>
+"""
+
+def render_sync_reader(book_dir, chapters, start):
+    items = []
+    for c in chapters:
+        mp3 = book_dir / "chapters" / c["file"]
+        items.append({
+            "audio": media_path(mp3, BOOKS_DIR),
+            "timing": media_path(timing.chapter_timing_path(mp3), BOOKS_DIR),
+        })
+    html = (SYNC_READER_HTML
+            .replace("__BASE__", media_base_js())
+            .replace("__CHAPTERS__", json.dumps(items))
+            .replace("__START__", str(start)))
+    st.components.v1.html(html, height=520)
 
 # =====================================================
 # Tabs
@@ -206,9 +464,15 @@ with t1:
     )
 
     if files and st.button("🚀 开始转化"):
+        skipped = False
         for f in files:
             book_name = re.sub(r"[^\w\u4e00-\u9fa5]", "_", Path(f.name).stem)
             book_dir = BOOKS_DIR / book_name
+            # 这本书还在排队/转化时不能覆盖它的源文件，等任务结束后再上传
+            if job_queue.active_job(book_dir):
+                st.warning(f"《{book_name}》正在转化，已跳过这次上传；转化结束后再上传即可更新")
+                skipped = True
+                continue
             book_dir.mkdir(exist_ok=True)
             (book_dir / "segments").mkdir(exist_ok=True)
             (book_dir / "chapters").mkdir(exist_ok=True)
@@ -216,63 +480,38 @@ with t1:
             ext = Path(f.name).suffix
             (book_dir / "format.txt").write_text(ext)
 
-            with open(book_dir / f"source{ext}", "wb") as wf:
-                wf.write(f.getbuffer())
-
-            with st.status(f"📘 正在处理：{f.name}") as status:
-                status.write("📄 读取文献")
-                raw = load_document(book_dir / f"source{ext}")
-
-                status.write("🧹 清洗文本")
-                cleaned = clean_text(raw)
-
-                status.write("✂️ 切分文本")
-                chunks = split_for_audio(cleaned)
-
-                prog = st.progress(0)
-                mp3s = []
-
-                # ⭐ TTS 参数（作用域正确）
-                voice, rate = get_tts_config()
-
-                for i, c in enumerate(chunks):
-                    seg_txt = book_dir / "segments" / f"{i:03d}.txt"
-                    seg_txt.write_text(c, encoding="utf-8")
-
-                    mp3 = book_dir / f"{i:03d}.mp3"
-                    text_to_mp3(c, mp3, voice=voice, rate=rate)
-                    mp3s.append(mp3)
+            # 边写盘边算哈希，转化时据此查找已解析好的文本
+            f.seek(0)
+            save_upload(f, book_dir / f"source{ext}")
 
-                    prog.progress((i + 1) / len(chunks))
-                    status.write(f"🔊 转化音频 {i+1}/{len(chunks)}")
+            # ⭐ TTS 参数（作用域正确）
+            voice, rate = get_tts_config()
+            job_queue.enqueue(book_dir, book_dir / f"source{ext}", voice, rate)
 
-                status.write("📦 合并章节")
-                for i in range(0, len(mp3s), 10):
-                    batch = mp3s[i:i+10]
-                    list_file = book_dir / "list.txt"
-                    with open(list_file, "w", encoding="utf-8") as lf:
-                        for m in batch:
-                            lf.write(f"file '{m.name}'\n")
-
-                    out = book_dir / "chapters" / f"chapter_{i//10+1:02d}.mp3"
-                    subprocess.run(
-                        ["ffmpeg", "-y", "-f", "concat", "-safe", "0",
-                         "-i", list_file, "-c", "copy", out],
-                        capture_output=True
-                    )
-
-                status.update(label=f"✅ 完成：{f.name}", state="complete")
+        # 有跳过的上传时不立即刷新，让提示留在页面上
+        if not skipped:
+            st.rerun()
 
-        st.rerun()
+    render_jobs()
 
 # =====================================================
 # 📚 智能书架（含删除）
 # =====================================================
 with t2:
-    books = sorted([d for d in BOOKS_DIR.iterdir() if d.is_dir()])
-
-    for book in books:
-        fmt = get_book_format(book)
+    catalog = shelf_index.load_catalog(BOOKS_DIR)
+
+    # 分页：只校验、渲染当前页的书
+    pages = max(1, (len(catalog) + SHELF_PAGE_SIZE - 1) // SHELF_PAGE_SIZE)
+    if pages > 1:
+        st.number_input(f"页码（共 {pages} 页，{len(catalog)} 本）", 1, pages, key="shelf_page")
+    page = min(st.session_state.shelf_page, pages)
+    entries = catalog[(page - 1) * SHELF_PAGE_SIZE: page * SHELF_PAGE_SIZE]
+    busy_books = job_queue.active_books()
+
+    for info in shelf_index.validate(BOOKS_DIR, entries):
+        book = BOOKS_DIR / info["name"]
+        fmt = info["format"]
+        busy = str(book) in busy_books
         colA, colB = st.columns([8, 1])
 
         with colA:
@@ -282,15 +521,29 @@ with t2:
             )
 
         with colB:
-            if st.button("🗑", key=f"del_{book.name}"):
+            # 转化中的书不能删：worker 会重新建出半本书，任务也成了孤儿
+            if st.button("🗑", key=f"del_{book.name}", disabled=busy, help="正在转化，结束后才能删除" if busy else None):
                 shutil.rmtree(book, ignore_errors=True)
+                shelf_index.remove_book(BOOKS_DIR, book.name)
                 if st.session_state.active_book == book.name:
                     st.session_state.active_book = None
                 if st.session_state.shelf_playing_book == book.name:
                     st.session_state.shelf_playing_book = None
                 st.rerun()
 
-        chapters = sorted((book / "chapters").glob("*.mp3"))
+        # 播放列表没写结束标记、且确实有任务在转化才算转化中：
+        # 进程被强杀时来不及写结束标记，不能让这本书一直显示"转化中"、把已合并的章节藏起来
+        if info.get("live") and busy:
+            # 还在转化：从播放列表边转边听，章节合并完后再用章节播放
+            st.caption("⏳ 转化中，已合成的段落可以先听")
+            if st.button("🎧 边转边听", key=f"live_{book.name}"):
+                st.session_state.shelf_playing_book = book.name
+                st.rerun()
+            if st.session_state.shelf_playing_book == book.name:
+                render_live_player(book)
+            continue
+
+        chapters = [book / "chapters" / c["file"] for c in info["chapters"]]
         if not chapters:
             continue
 
@@ -320,7 +573,8 @@ with t2:
                 "章节",
                 list(range(1, len(chapters) + 1)),
                 index=cur,
-                key=f"sel_{book.name}"
+                key=f"sel_{book.name}",
+                format_func=lambda n, cs=info["chapters"]: f"{n}. {cs[n - 1].get('title')}" if cs[n - 1].get("title") else str(n)
             )
             st.session_state.shelf_chapter_idx[book.name] = sel - 1
 
@@ -344,43 +598,36 @@ with t3:
         st.info("请从智能书架选择一本书")
     else:
         bp = BOOKS_DIR / st.session_state.active_book
-        segs = sorted((bp / "segments").glob("*.txt"))
+        info = shelf_index.load_book(bp)
+        count = info["segments"]
 
         st.subheader(f"📖 同步阅读：{bp.name}")
 
-        if not segs:
+        if info["chapters"] and all(c.get("timing") for c in info["chapters"]):
+            # 有逐词时间索引：整章连续播放，阅读过程中不再触发页面刷新
+            start = st.selectbox(
+                "从第几章开始",
+                list(range(1, len(info["chapters"]) + 1)),
+                key=f"read_ch_{bp.name}"
+            )
+            render_sync_reader(bp, info["chapters"], start - 1)
+        elif not count:
             st.info("该书暂无逐段文本，仅支持章节音频播放")
-            chapters = sorted((bp / "chapters").glob("*.mp3"))
-            if chapters:
-                render_chapter_player(chapters[0], bp.name)
+            if info["chapters"]:
+                render_chapter_player(bp / "chapters" / info["chapters"][0]["file"], bp.name)
         else:
-            idx = min(st.session_state.play_idx, len(segs) - 1)
+            idx = min(st.session_state.play_idx, count - 1)
             st.session_state.play_idx = idx
 
             st.markdown(
-                f"<div style='padding:20px;border:2px solid #f59e0b;border-radius:8px'>{segs[idx].read_text(encoding='utf-8')}</div>",
+                f"<div style='padding:20px;border:2px solid #f59e0b;border-radius:8px'>{segment_pack.segment_text(bp, idx)}</div>",
                 unsafe_allow_html=True
             )
 
-            audio = bp / f"{idx:03d}.mp3"
-            if audio.exists():
-                with open(audio, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode()
-                st.components.v1.html(f"""
-                <audio id="rd" controls autoplay style="width:100%">
-                  <source src="data:audio/mp3;base64,{b64}">
-                </audio>
-                <script>
-                  document.getElementById("rd").onended = function() {{
-                    var btns = window.parent.document.querySelectorAll("button");
-                    for (var b of btns) {{
-                      if (b.innerText.includes("下一段")) {{
-                        b.click(); break;
-                      }}
-                    }}
-                  }};
-                </script>
-                """, height=80)
+            # 散文件或打包存储，都按段号直接取
+            audio = segment_pack.segment_audio(bp, idx)
+            if audio is not None:
+                render_audio(audio, "rd", "下一段", height=80)
 
             c1, c2, c3 = st.columns(3)
             with c1:
@@ -388,8 +635,8 @@ with t3:
                     st.session_state.play_idx -= 1
                     st.rerun()
             with c2:
-                st.write(f"{idx+1}/{len(segs)}")
+                st.write(f"{idx+1}/{count}")
             with c3:
-                if st.button("下一段 ➡") and idx < len(segs) - 1:
+                if st.button("下一段 ➡") and idx < count - 1:
                     st.session_state.play_idx += 1
                     st.rerun()
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 模块都平放在仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tts
+
+
+@pytest.fixture
+def engine():
+    """
+    用本地假后端替换共享引擎：engine(backend=FakeBackend(...), ...) 参数同 tts.configure_engine
+    测试结束后关闭引擎，下一个测试重新创建
+    """
+    def make(**kwargs):
+        kwargs.setdefault("rate", 1000)
+        kwargs.setdefault("burst", 1000)
+        return tts.configure_engine(**kwargs)
+
+    yield make
+    with tts._engine_lock:
+        old, tts._engine = tts._engine, None
+    if old is not None:
+        old.close()
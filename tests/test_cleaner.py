@@ -0,0 +1,27 @@
+import pytest
+
+from bench_cleaner import legacy_iter_clean, make_corpus
+from cleaner import RunningLines, clean_text, iter_clean
+
+
+def _with_breaks(corpus, brk):
+    return [[page.replace("\n", brk) for page in doc] for doc in corpus]
+
+
+# 规则引擎的输出与旧的逐行实现（按 str.splitlines 分行）一致，换行用哪种字符都一样
+@pytest.mark.parametrize("brk", ["\n", "\r\n", "\r", "\v", "\f", "\x1c", "\x1d", "\x1e", "\x85",
+                                 "\u2028", "\u2029"])
+def test_matches_legacy_for_every_line_break(brk):
+    corpus = _with_breaks(make_corpus(docs=5, pages=6, seed=3), brk)
+    for doc in corpus:
+        assert list(iter_clean(doc)) == list(legacy_iter_clean(doc))
+
+
+def test_rules_apply_to_lines_split_by_carriage_returns():
+    assert clean_text("正文一\r12\r\nFigure 3 略 正文二\x85References\r参考文献") == "正文一 正文二"
+
+
+def test_running_lines_split_on_any_line_break():
+    pages = [f"Journal of Tests\r正文第 {i} 页。\r\n第 {i} 页" for i in range(12)]
+    kept = list(RunningLines().filter(pages))
+    assert all("Journal" not in page for page in kept[RunningLines().window:])
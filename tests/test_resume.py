@@ -0,0 +1,127 @@
+import pytest
+
+import pipeline
+from fake_tts import FRAME_HEADER, FakeBackend
+from segment_journal import JOURNAL, Journal, journal_path, verify_book
+from segment_store import STORE_DIR, load_ids, position_path, store_path
+
+MP3 = FRAME_HEADER + b"\x00" * 140   # 一帧 24 kHz mp3
+MP3_SECONDS = 576 / 24000
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    # 不读写仓库里的文本缓存和指标目录
+    monkeypatch.setattr(pipeline, "TEXT_CACHE", False)
+    monkeypatch.setattr(pipeline, "METRICS", False)
+    src = tmp_path / "book.txt"
+    src.write_text("\n".join(f"第 {i} 段的内容。" * 40 for i in range(6)), encoding="utf-8")
+    return src, tmp_path / "book"
+
+
+def _store(book_dir, sid, data=MP3):
+    (book_dir / STORE_DIR).mkdir(parents=True, exist_ok=True)
+    store_path(book_dir, sid).write_bytes(data)
+
+
+# ---------- 完成日志 ----------
+
+def test_journal_replays_complete_lines_only(tmp_path):
+    for sid in ("aa", "bb"):
+        _store(tmp_path, sid)
+    journal = Journal(tmp_path)
+    assert journal.record("aa") and journal.record("bb")
+    journal.close()
+    # 模拟写到一半崩溃：最后一行没有换行
+    with open(journal_path(tmp_path), "a", encoding="ascii") as f:
+        f.write("cc 144 0000")
+
+    replay = Journal(tmp_path)
+    assert "aa" in replay and "bb" in replay and "cc" not in replay
+    assert replay.seconds("aa") == pytest.approx(MP3_SECONDS)
+
+
+def test_journal_last_line_wins_and_rewrite_drops_unused(tmp_path):
+    _store(tmp_path, "aa")
+    journal = Journal(tmp_path)
+    journal.record("aa")
+    _store(tmp_path, "aa", MP3 * 2)
+    journal.record("aa")
+    _store(tmp_path, "bb")
+    journal.record("bb")
+    journal.close()
+    assert len(journal_path(tmp_path).read_text().splitlines()) == 3
+
+    replay = Journal(tmp_path)
+    assert replay.entries["aa"][0] == len(MP3) * 2
+    replay.rewrite(["aa"])
+    assert journal_path(tmp_path).read_text().split()[0] == "aa"
+    assert "bb" not in Journal(tmp_path)
+
+
+def test_truncated_audio_is_not_recorded(tmp_path):
+    _store(tmp_path, "aa", MP3[:100])
+    journal = Journal(tmp_path)
+    assert not journal.record("aa")
+    assert "aa" not in journal
+    # 写了一半的音频直接删掉，续跑时重新合成
+    assert not store_path(tmp_path, "aa").exists()
+
+
+# ---------- 断点续跑 ----------
+
+def test_rerun_skips_journaled_segments(engine, book):
+    src, book_dir = book
+    backend = FakeBackend(latency=0.001, jitter=0)
+    engine(backend=backend)
+
+    first = pipeline.run_pipeline(src, book_dir)
+    assert not first["failed"]
+    assert first["synthesized"] == first["chunks"] == backend.calls
+    assert len(Journal(book_dir)) == first["chunks"]
+
+    again = pipeline.run_pipeline(src, book_dir)
+    assert again["synthesized"] == 0
+    assert backend.calls == first["chunks"]
+
+
+def test_resume_after_crash_redoes_only_lost_segments(engine, book):
+    src, book_dir = book
+    backend = FakeBackend(latency=0.001, jitter=0)
+    engine(backend=backend)
+    first = pipeline.run_pipeline(src, book_dir)
+    ids = load_ids(book_dir)
+
+    # 崩溃现场：最后一段的音频写了一半、也没记进日志；日志最后一行只写了一半
+    lines = journal_path(book_dir).read_text().splitlines(keepends=True)
+    kept = [line for line in lines if not line.startswith(ids[-1])]
+    journal_path(book_dir).write_text("".join(kept[:-1]) + kept[-1][:10])
+    store_path(book_dir, ids[-1]).write_bytes(MP3[:100])
+    position_path(book_dir, len(ids) - 1).unlink()
+    (book_dir / STORE_DIR / f"{ids[0]}.mp3.part").write_bytes(b"x")
+
+    calls = backend.calls
+    resumed = pipeline.run_pipeline(src, book_dir)
+    assert not resumed["failed"]
+    # 只补合成丢了的段：被截断日志行对应的段和写了一半的最后一段
+    assert resumed["synthesized"] == backend.calls - calls == 2
+    assert load_ids(book_dir) == ids
+    assert len(Journal(book_dir)) == first["chunks"]
+    report = verify_book(book_dir, workers=1)
+    assert report["corrupt"] == report["missing"] == report["positions"] == 0
+
+
+def test_verify_repairs_book_without_journal(book, engine):
+    src, book_dir = book
+    engine(backend=FakeBackend(latency=0.001, jitter=0))
+    pipeline.run_pipeline(src, book_dir)
+    ids = load_ids(book_dir)
+    (book_dir / JOURNAL).unlink()
+    store_path(book_dir, ids[1]).write_bytes(MP3[:50])
+
+    report = verify_book(book_dir, repair=True, workers=1)
+    assert report["corrupt"] == 1
+    assert report["unjournaled"] == len(set(ids)) - 1
+    journal = Journal(book_dir)
+    assert ids[1] not in journal and ids[0] in journal
+    assert not position_path(book_dir, 1).exists()
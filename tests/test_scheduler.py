@@ -0,0 +1,13 @@
+from pathlib import Path
+
+from scheduler import book_names
+
+
+def test_book_names_are_unique_per_stem():
+    files = [Path("in/a.pdf"), Path("in/a.txt"), Path("b.epub"), Path("other/a.mobi")]
+    assert book_names(files) == ["a", "a-2", "b", "a-3"]
+
+
+def test_book_names_skip_taken_suffix():
+    # 已经有叫 a-2 的文件时，第二个 a 顺延到 a-3
+    assert book_names([Path("a-2.txt"), Path("a.txt"), Path("a.pdf")]) == ["a-2", "a", "a-3"]
@@ -0,0 +1,65 @@
+import segment_pack
+from fake_tts import FRAME_HEADER
+from segment_pack import SegmentPack, export_book, has_pack, pack_book, segment_count, segment_text
+from segment_store import STORE_DIR, load_ids, place, position_path, save_ids, segment_id, store_path
+
+VOICE, RATE = "zh-CN-YunxiNeural", "0%"
+
+
+def make_loose_book(book_dir, texts, missing=()):
+    """散文件形式的书：segments/NNN.txt、by_id/<ID>.mp3 + 位置硬链接、segments.json"""
+    (book_dir / "segments").mkdir(parents=True)
+    (book_dir / STORE_DIR).mkdir()
+    ids = []
+    for idx, text in enumerate(texts):
+        sid = segment_id(text, VOICE, RATE)
+        ids.append(sid)
+        (book_dir / "segments" / f"{idx:03d}.txt").write_text(text, encoding="utf-8")
+        if idx in missing:
+            continue
+        store_path(book_dir, sid).write_bytes(FRAME_HEADER + bytes([idx]) * 140)
+        place(book_dir, idx, sid)
+    save_ids(book_dir, ids, VOICE, RATE)
+    return ids
+
+
+def test_segment_count_reads_manifest(tmp_path, monkeypatch):
+    make_loose_book(tmp_path, ["一。", "二。", "三。"])
+    # 有清单时不再列目录
+    monkeypatch.setattr(segment_pack.Path, "glob", lambda *a: (_ for _ in ()).throw(AssertionError("glob")))
+    assert segment_count(tmp_path) == 3
+
+
+def test_segment_count_without_manifest_counts_texts(tmp_path):
+    make_loose_book(tmp_path, ["一。", "二。"])
+    (tmp_path / "segments.json").unlink()
+    assert segment_count(tmp_path) == 2
+
+
+def test_pack_then_export_round_trip(tmp_path):
+    texts = ["第一段。", "第二段。", "第一段。", "没有音频的一段。"]
+    ids = make_loose_book(tmp_path, texts, missing={3})
+    audio = {idx: position_path(tmp_path, idx).read_bytes() for idx in range(3)}
+
+    assert pack_book(tmp_path) == 4
+    assert has_pack(tmp_path)
+    # 散文件全部删掉，只留打包存储
+    assert not (tmp_path / STORE_DIR).exists()
+    assert not position_path(tmp_path, 0).exists()
+    assert segment_count(tmp_path) == 4
+    assert segment_text(tmp_path, 1) == "第二段。"
+    with SegmentPack(tmp_path, readonly=True) as pack:
+        assert pack.ids() == ids[:3] + [None]
+        assert pack.audio(1) == audio[1]
+        assert pack.has(ids[0])
+
+    assert export_book(tmp_path) == 4
+    assert not has_pack(tmp_path)
+    assert load_ids(tmp_path) == ids[:3] + [None]
+    assert segment_count(tmp_path) == 4
+    for idx in range(3):
+        assert position_path(tmp_path, idx).read_bytes() == audio[idx]
+        assert (tmp_path / "segments" / f"{idx:03d}.txt").read_text(encoding="utf-8") == texts[idx]
+    # 相同内容只存一份：位置 0 和 2 指向同一个 by_id 文件
+    assert position_path(tmp_path, 0).samefile(position_path(tmp_path, 2))
+    assert not position_path(tmp_path, 3).exists()
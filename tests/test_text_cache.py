@@ -0,0 +1,70 @@
+import pytest
+
+import cleaner
+import ingest
+import splitter
+import text_cache
+
+
+# 每个影响输出的参数改动后，缓存 key 都必须变化
+@pytest.mark.parametrize("module, name, value", [
+    (ingest, "INGEST_VERSION", 99),
+    (ingest, "TXT_BLOCK_SIZE", 4096),
+    (cleaner, "CLEANER_VERSION", 99),
+    (cleaner, "RUNNING_EDGE_LINES", 5),
+    (cleaner, "RUNNING_RATIO", 0.9),
+    (cleaner, "RUNNING_MIN_PAGES", 7),
+    (cleaner, "RUNNING_WINDOW", 20),
+    (cleaner, "RUNNING_MAX_CHARS", 40),
+    (cleaner, "RULES", [("drop", "page_number", r"\d+", "line")]),
+    (splitter, "SPLITTER_VERSION", 99),
+    (splitter, "MAX_CHARS", 300),
+    (splitter, "CUT_MIN_RATIO", 0.9),
+    (splitter, "ANCHOR_SPAN", 0.1),
+])
+def test_chars_key_tracks_params(monkeypatch, module, name, value):
+    before = text_cache.text_key("abc")
+    monkeypatch.setattr(module, name, value)
+    assert text_cache.text_key("abc") != before
+
+
+@pytest.mark.parametrize("name, value", [
+    ("TARGET_SECONDS", 60),
+    ("MAX_SECONDS", 200),
+    ("CHARS_PER_SECOND", {"cjk": 5.0, "latin": 14.0, "digit": 4.0}),
+    ("PAUSE_SECONDS", {"long": 0.5, "short": 0.15}),
+    ("BALANCED_CUT_MIN", 0.5),
+    ("BALANCED_SPAN", 0.4),
+])
+def test_duration_key_tracks_params(monkeypatch, name, value):
+    before = text_cache.text_key("abc", "duration", "+20%")
+    monkeypatch.setattr(splitter, name, value)
+    assert text_cache.text_key("abc", "duration", "+20%") != before
+
+
+def test_key_depends_on_source_mode_and_rate():
+    keys = {
+        text_cache.text_key("abc"),
+        text_cache.text_key("abd"),
+        text_cache.text_key("abc", "duration", "0%"),
+        text_cache.text_key("abc", "duration", "+20%"),
+    }
+    assert len(keys) == 4
+    # 按字数切分与语速无关
+    assert text_cache.text_key("abc", "chars", "+20%") == text_cache.text_key("abc")
+
+
+def test_prepare_misses_cache_after_param_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_cache, "TEXT_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(text_cache.TextCache.__init__, "__defaults__", (tmp_path / "cache",))
+    src = tmp_path / "book.txt"
+    src.write_text("第一句话。第二句话。", encoding="utf-8")
+
+    # 当前参数下的缓存条目：命中时直接返回，不重新解析
+    writer = text_cache.TextCache().writer(text_cache.text_key(text_cache.file_hash(src)))
+    writer.add("缓存里的旧结果")
+    writer.commit()
+    assert text_cache.prepare(src) == ["缓存里的旧结果"]
+
+    monkeypatch.setattr(cleaner, "RUNNING_RATIO", 0.9)
+    assert text_cache.prepare(src) == ["第一句话。第二句话。"]
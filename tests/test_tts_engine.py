@@ -0,0 +1,191 @@
+import asyncio
+import threading
+
+import pytest
+
+import tts
+from fake_tts import FakeBackend
+from timing import words_path
+from tts_cache import AudioCache
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    # 重试退避缩到毫秒级，测试不用真等
+    monkeypatch.setattr(tts, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(tts, "RETRY_MAX_DELAY", 0.01)
+
+
+class ThrottleError(Exception):
+    status = 429
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# ---------- 令牌桶 / 自适应限速 ----------
+
+def test_token_bucket_limits_rate():
+    async def main():
+        bucket = tts.TokenBucket(rate=50, burst=2)
+        loop = asyncio.get_running_loop()
+        t = loop.time()
+        for _ in range(7):
+            await bucket.acquire()
+        return loop.time() - t, bucket.waited
+
+    elapsed, waited = run(main())
+    # 前 2 个用突发额度，其余 5 个按每秒 50 个发出
+    assert elapsed >= 5 / 50 * 0.9
+    assert waited
+
+
+def test_throttle_error_backs_off_once_per_round():
+    async def main():
+        bucket = tts.TokenBucket(rate=4, burst=4)
+        limiter = tts.AdaptiveLimiter(bucket, concurrency=8)
+        limiter.rtt = 60   # 一轮足够长：第二次限流不再减
+        for _ in range(2):
+            await limiter.acquire()
+        await limiter.release(error=ThrottleError("429"))
+        await limiter.release(error=ThrottleError("429"))
+        return limiter, bucket
+
+    limiter, bucket = run(main())
+    assert limiter.limit == 8 * tts.TTS_BACKOFF
+    assert bucket.rate == 4 * tts.TTS_BACKOFF
+    assert limiter.changed
+
+
+def test_plain_error_does_not_back_off():
+    async def main():
+        limiter = tts.AdaptiveLimiter(tts.TokenBucket(rate=4, burst=4), concurrency=8)
+        await limiter.acquire()
+        await limiter.release(error=ConnectionError("reset"))
+        return limiter
+
+    assert run(main()).limit == 8
+
+
+def test_success_grows_limit_only_when_saturated():
+    async def main():
+        limiter = tts.AdaptiveLimiter(tts.TokenBucket(rate=4, burst=4), concurrency=2)
+        await limiter.acquire()
+        await limiter.release(0.1, 10)
+        unchanged = limiter.limit
+        limiter.saturated = True
+        await limiter.acquire()
+        await limiter.release(0.1, 10)
+        return unchanged, limiter.limit
+
+    unchanged, grown = run(main())
+    assert unchanged == 2
+    assert grown == pytest.approx(2.5)
+
+
+def test_retry_delay_is_exponential_with_jitter(monkeypatch):
+    monkeypatch.setattr(tts, "RETRY_BASE_DELAY", 1.0)
+    monkeypatch.setattr(tts, "RETRY_MAX_DELAY", 30.0)
+    monkeypatch.setattr(tts.random, "uniform", lambda a, b: 1.0)
+    assert [tts.retry_delay(n) for n in (1, 2, 3, 6, 10)] == [1, 2, 4, 30, 30]
+
+
+# ---------- 引擎：重试 / 熔断 / 缓存 ----------
+
+def test_engine_retries_until_success(engine, tmp_path, monkeypatch):
+    # 只看重试：连续失败不触发熔断
+    monkeypatch.setattr(tts, "BREAKER_FAILURES", 1000)
+    backend = FakeBackend(latency=0.001, jitter=0, error_rate=0.5, seed=1)
+    eng = engine(backend=backend, max_retry=10)
+    outputs = [tmp_path / f"{i:03d}.mp3" for i in range(8)]
+    assert all(eng.synthesize_batch([(f"第 {i} 段。", out) for i, out in enumerate(outputs)]))
+    assert backend.errors > 0
+    assert backend.calls == len(outputs) + backend.errors
+    assert all(out.stat().st_size > 0 for out in outputs)
+    # 失败的尝试不留临时文件
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_engine_gives_up_after_max_retry(engine, tmp_path):
+    backend = FakeBackend(latency=0.001, jitter=0, error_rate=1.0)
+    eng = engine(backend=backend, max_retry=3)
+    assert eng.submit("失败的一段。", tmp_path / "000.mp3").result() is False
+    assert backend.calls == 3
+    assert not (tmp_path / "000.mp3").exists()
+    with pytest.raises(RuntimeError):
+        tts.text_to_mp3("失败的一段。", tmp_path / "001.mp3")
+
+
+def test_breaker_opens_then_recovers_on_probe(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(tts, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(tts, "BREAKER_COOLDOWN", 0.2)
+    backend = FakeBackend(latency=0.001, jitter=0, error_rate=1.0)
+    eng = engine(backend=backend, max_retry=2)
+
+    assert eng.submit("一段。", tmp_path / "000.mp3").result() is False
+    assert eng.limiter.state == "open"
+
+    # 冷却结束后放行一个探测请求，成功即恢复
+    backend.error_rate = 0.0
+    assert eng.submit("一段。", tmp_path / "000.mp3").result() is True
+    assert eng.limiter.state == "closed"
+    assert eng.limiter.cooldown == 0.2
+
+
+def test_failed_probe_doubles_cooldown(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(tts, "BREAKER_FAILURES", 1)
+    monkeypatch.setattr(tts, "BREAKER_COOLDOWN", 0.05)
+    eng = engine(backend=FakeBackend(latency=0.001, jitter=0, error_rate=1.0), max_retry=2)
+    assert eng.submit("一段。", tmp_path / "000.mp3").result() is False
+    assert eng.limiter.state == "open"
+    assert eng.limiter.cooldown == pytest.approx(0.1)
+
+
+def test_cache_hit_skips_backend(engine, tmp_path):
+    backend = FakeBackend(latency=0.001, jitter=0)
+    cache = AudioCache(tmp_path / "cache")
+    eng = engine(backend=backend, cache=cache)
+
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first, second = tmp_path / "a" / "001.mp3", tmp_path / "b" / "005.mp3"
+    assert eng.submit("同一段文字。", first).result()
+    calls = backend.calls
+    # 空白不同、内容相同也命中
+    assert eng.submit("同一段文字。  ", second).result()
+
+    assert backend.calls == calls
+    assert cache.stats()["hits"] == 1
+    assert second.read_bytes() == first.read_bytes()
+    # 逐词时间随音频一起命中
+    assert words_path(second).exists()
+
+
+def test_cache_key_depends_on_voice_and_rate(engine, tmp_path):
+    backend = FakeBackend(latency=0.001, jitter=0)
+    eng = engine(backend=backend, cache=AudioCache(tmp_path / "cache"))
+    eng.submit("语速不同。", tmp_path / "0.mp3", rate="0%").result()
+    eng.submit("语速不同。", tmp_path / "1.mp3", rate="+20%").result()
+    eng.submit("语速不同。", tmp_path / "2.mp3", voice="zh-CN-XiaoxiaoNeural").result()
+    assert backend.calls == 3
+
+
+def test_limits_saved_off_the_loop_thread(engine, tmp_path, monkeypatch):
+    writers = []
+    real_save = tts.save_limits
+
+    def save(*args):
+        writers.append(threading.current_thread().name)
+        real_save(*args)
+
+    monkeypatch.setattr(tts, "save_limits", save)
+    limits = tmp_path / "limits.json"
+    eng = engine(backend=FakeBackend(latency=0.001, jitter=0), limits_file=limits)
+    eng.limiter.changed = True
+    assert eng.submit("一段。", tmp_path / "000.mp3").result()
+    eng.close()
+
+    # 定期写盘在线程池里做，不阻塞事件循环
+    assert writers and "tts-loop" not in writers
+    assert tts.load_limits(limits) is not None
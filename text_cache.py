@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import ingest
+import cleaner
+import splitter
+
+# =========================
+# 解析文本缓存
+# - 读取 → 清洗 → 切分 的结果按（源文件 sha256、各阶段版本号与参数）存一份
+# - 一本书一个 JSON-lines 文件：每行一段切好的文本，章节边界记为 {"chapter": 标题}
+# - 断点续跑时直接读缓存，不再重新解析 PDF / EPUB
+# =========================
+
+# ===== 可调参数 =====
+TEXT_CACHE_DIR = Path(__file__).parent / "cache" / "text"
+HASH_CHUNK = 1 << 20   # 计算哈希 / 保存上传文件时每次读取的字节数
+# ===================
+
+
+def _record_path(path: Path) -> Path:
+    # 源文件的哈希记录放在缓存目录里，按绝对路径区分，不在 uploads / 书目录里留多余文件
+    name = hashlib.sha1(str(Path(path).resolve()).encode("utf-8")).hexdigest()
+    return TEXT_CACHE_DIR / "sources" / f"{name}.txt"
+
+
+def _write_record(path: Path, digest: str):
+    st = path.stat()
+    record = _record_path(path)
+    try:
+        record.parent.mkdir(parents=True, exist_ok=True)
+        record.write_text(f"{st.st_size} {st.st_mtime_ns} {digest}")
+    except OSError:
+        # 只是少了记录，下次重新计算
+        pass
+
+
+def save_upload(fileobj, dst: Path) -> str:
+    """
+    边写盘边计算 sha256，返回十六进制摘要
+    同时记下哈希，之后转化时不必再把源文件读一遍
+    """
+    dst = Path(dst)
+    h = hashlib.sha256()
+    tmp = dst.with_name(dst.name + ".part")
+    with open(tmp, "wb") as out:
+        while True:
+            block = fileobj.read(HASH_CHUNK)
+            if not block:
+                break
+            h.update(block)
+            out.write(block)
+    os.replace(tmp, dst)
+
+    digest = h.hexdigest()
+    _write_record(dst, digest)
+    return digest
+
+
+def file_hash(path: Path) -> str:
+    """
+    源文件的 sha256；文件大小和 mtime 与记录一致时直接用记录
+    """
+    path = Path(path)
+    st = path.stat()
+    try:
+        size, mtime, digest = _record_path(path).read_text().split()
+        if int(size) == st.st_size and int(mtime) == st.st_mtime_ns:
+            return digest
+    except (OSError, ValueError):
+        pass
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_CHUNK)
+            if not block:
+                break
+            h.update(block)
+    digest = h.hexdigest()
+    _write_record(path, digest)
+    return digest
+
+
+def text_key(source_hash: str, split_mode="chars", rate="0%") -> str:
+    """
+    缓存 key：源文件内容 + 影响切分结果的全部版本号和参数
+    各模块自己列出影响输出的参数（cache_params），新增可调参数时只需改那一处
+    """
+    params = {
+        "source": source_hash,
+        "ingest": ingest.cache_params(),
+        "cleaner": cleaner.cache_params(),
+        "splitter": splitter.cache_params(split_mode, rate),
+    }
+
+    blob = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class TextCache:
+    """
+    切分结果缓存：<cache_dir>/ab/abcdef....jsonl，每行一个 JSON 字符串
+    写入时先写 .part，整本切完才改名，中途中断的结果不会被当成缓存
+    """
+
+    def __init__(self, cache_dir=TEXT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.jsonl"
+
+    def load(self, key: str):
+        """命中返回切好的段落列表（其中可能有 ingest.ChapterMark），否则返回 None"""
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return [_decode(json.loads(line)) for line in f]
+        except (OSError, ValueError):
+            return None
+
+    def writer(self, key: str):
+        return _ChunkWriter(self._path(key))
+
+
+def _decode(item):
+    return ingest.ChapterMark(item["chapter"]) if isinstance(item, dict) else item
+
+
+def _encode(item):
+    return item if isinstance(item, str) else {"chapter": item.title}
+
+
+class _ChunkWriter:
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(exist_ok=True)
+        self.tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        self.f = open(self.tmp, "w", encoding="utf-8")
+
+    def add(self, chunk: str):
+        self.f.write(json.dumps(_encode(chunk), ensure_ascii=False))
+        self.f.write("\n")
+
+    def commit(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+    def discard(self):
+        self.f.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+def prepare(file_path: Path, split_mode="chars", rate="0%", workers=None):
+    """
+    解析 → 清洗 → 切分 整本书并写入缓存，返回段落列表（含章节标记）；已缓存则直接读取
+    供调度器在子进程里提前解析，随后 run_pipeline 直接命中缓存
+    """
+    cache = TextCache()
+    key = text_key(file_hash(file_path), split_mode, rate)
+    chunks = cache.load(key)
+    if chunks is not None:
+        return chunks
+
+    units = cleaner.RunningLines().filter(ingest.iter_document(file_path, workers=workers))
+    texts = cleaner.iter_clean(ingest.iter_texts(units))
+    if split_mode == "duration":
+        chunks = list(splitter.iter_split_balanced(texts, rate=rate))
+    else:
+        chunks = list(splitter.iter_split_for_audio(texts))
+
+    writer = cache.writer(key)
+    for chunk in chunks:
+        writer.add(chunk)
+    writer.commit()
+    return chunks
@@ -0,0 +1,90 @@
+import json
+import os
+from pathlib import Path
+
+import mp3frames
+
+# =========================
+# 逐词时间索引
+# - TTS 时把 WordBoundary 存成每段一个 NNN.words.json：[[起点ms, 时长ms, 词], ...]
+# - 合并章节时汇总成 chapter_XX.timing.json：每段在章节里的起点、文本、逐词时间
+#   阅读页一次拿到整章，播放、高亮、点词跳转都在浏览器里完成
+# =========================
+
+
+def words_path(mp3: Path) -> Path:
+    return Path(mp3).with_suffix(".words.json")
+
+
+def chapter_timing_path(chapter_mp3: Path) -> Path:
+    return Path(chapter_mp3).with_suffix(".timing.json")
+
+
+def save_words(mp3: Path, words):
+    path = words_path(mp3)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(json.dumps(words, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _load_words(mp3: Path):
+    try:
+        return json.loads(words_path(mp3).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return []
+
+
+def _align(text: str, words):
+    """
+    把每个词对应到段落文本中的位置：[[起点ms, 时长ms, 字符起点, 字符数], ...]
+    找不到的词（例如数字被读成中文）字符起点记为 -1
+    """
+    aligned = []
+    cursor = 0
+    for start, dur, word in words:
+        pos = text.find(word, cursor) if word else -1
+        if pos >= 0:
+            cursor = pos + len(word)
+        aligned.append([start, dur, pos, len(word)])
+    return aligned
+
+
+def _segment_source(src):
+    """
+    一段的 (名字, 音频, 文本, 逐词时间)
+    src 是书目录下的 NNN.mp3（文本在 segments/NNN.txt），或打包存储里的一段（见 segment_pack.py）
+    """
+    if isinstance(src, (str, Path)):
+        mp3 = Path(src)
+        try:
+            text = (mp3.parent / "segments" / f"{mp3.stem}.txt").read_text(encoding="utf-8")
+        except OSError:
+            text = ""
+        return mp3.stem, mp3, text, _load_words(mp3)
+    return src.name, src.audio, src.text, src.words
+
+
+def write_chapter_timing(chapter_mp3: Path, mp3_files):
+    """
+    为刚合并好的章节生成时间索引
+    mp3_files 为该章的分段音频：书目录下的 NNN.mp3，或打包存储里的段
+    """
+    segments = []
+    offset = 0
+    for src in mp3_files:
+        name, audio, text, words = _segment_source(src)
+        dur = round(mp3frames.duration(audio) * 1000)
+        segments.append({
+            "seg": name,
+            "start": offset,
+            "dur": dur,
+            "text": text,
+            "words": _align(text, words),
+        })
+        offset += dur
+
+    path = chapter_timing_path(chapter_mp3)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(json.dumps({"segments": segments}, ensure_ascii=False, separators=(",", ":")),
+                   encoding="utf-8")
+    os.replace(tmp, path)
@@ -0,0 +1,205 @@
+import argparse
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# =========================
+# 紧凑输出：章节合并完后转成适合语音的低码率格式
+# - edge-tts 输出 24 kHz / 48 kbps 单声道 mp3，分段 + 章节等于每本书存两份
+# - 章节转码交给线程池里的 ffmpeg 并行执行（每个 ffmpeg 一个进程）
+# - 转码后删掉原章节 mp3；可选再删掉逐段音频，每本书只剩一份紧凑的章节音频
+# =========================
+
+# ===== 可调参数 =====
+COMPACT_FORMAT = None   # None 为不转码；"aac"（手机通用）/ "opus"（体积最小）/ "mp3"（低码率单声道）
+DROP_SEGMENTS = False   # 章节都合并好后删掉逐段音频（之后重新转化需要重新合成）
+TRANSCODE_WORKERS = os.cpu_count() or 2
+COMPACT_KBPS = 32       # "mp3" 格式原地转码，帧码率不高于它就认为已经转过
+# ===================
+
+BOOKS_DIR = Path("books")
+
+# 格式 → (扩展名, ffmpeg 编码参数)，码率按单声道语音选取
+FORMATS = {
+    "aac": (".m4a", ["-c:a", "aac", "-b:a", "32k", "-ac", "1", "-movflags", "+faststart"]),
+    "opus": (".opus", ["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-ac", "1"]),
+    "mp3": (".mp3", ["-c:a", "libmp3lame", "-b:a", "32k", "-ac", "1", "-ar", "24000"]),
+}
+AUDIO_EXTS = (".mp3", ".m4a", ".opus")
+
+
+def chapter_audio(chapter_mp3: Path) -> Path:
+    """
+    章节实际的音频文件：转码过就是紧凑文件（可能已没有 mp3），多个版本并存时取最新的
+    都不存在时返回 chapter_mp3 本身
+    """
+    chapter_mp3 = Path(chapter_mp3)
+    found = [p for p in (chapter_mp3.with_suffix(ext) for ext in AUDIO_EXTS) if p.exists()]
+    return max(found, key=lambda p: p.stat().st_mtime_ns) if found else chapter_mp3
+
+
+def chapter_files(chapters_dir: Path):
+    """章节目录下每章实际的音频文件（每章一个，不含转码中的临时文件）"""
+    names = {p.name.split(".")[0] for p in Path(chapters_dir).glob("chapter_*")
+             if p.suffix in AUDIO_EXTS and ".part" not in p.name}
+    return [chapter_audio(Path(chapters_dir) / f"{name}.mp3") for name in names]
+
+
+def discard_compact(chapter_mp3: Path):
+    # 章节重新合并后，旧的紧凑文件就过期了
+    for ext in AUDIO_EXTS:
+        if ext != ".mp3":
+            Path(chapter_mp3).with_suffix(ext).unlink(missing_ok=True)
+
+
+def _is_compact_mp3(path: Path) -> bool:
+    import mp3frames
+    try:
+        with open(path, "rb") as f:
+            info = mp3frames.scan(f.read(64 * 1024))
+    except (OSError, mp3frames.Mp3FormatError):
+        return False
+    return info["first"]["mono"] and max(info["bitrates"]) <= COMPACT_KBPS * 1000
+
+
+def needs_transcode(chapter_mp3: Path, fmt: str) -> bool:
+    src = chapter_audio(chapter_mp3)
+    if not src.exists():
+        return False
+    if fmt == "mp3":
+        return src.suffix != ".mp3" or not _is_compact_mp3(src)
+    return src.suffix != FORMATS[fmt][0]
+
+
+def transcode_chapter(chapter_mp3: Path, fmt: str):
+    """
+    把一章转成 fmt，成功后删掉原文件（"mp3" 格式原地替换）
+    返回 (删掉的字节数, 新增的字节数)
+    """
+    ext, args = FORMATS[fmt]
+    src = chapter_audio(chapter_mp3)
+    out = Path(chapter_mp3).with_suffix(ext)
+    # ffmpeg 按扩展名选封装格式，临时文件保留原扩展名
+    tmp = out.with_name(f"{out.stem}.part{ext}")
+    cmd = ["ffmpeg", "-nostdin", "-y", "-v", "error", "-i", str(src), "-map_metadata", "-1", "-vn", *args, str(tmp)]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    removed = src.stat().st_size
+    os.replace(tmp, out)
+    if src != out:
+        src.unlink()
+    return removed, out.stat().st_size
+
+
+def collect(futures):
+    """
+    等 transcode_chapter 的 future 全部结束，返回 (删掉的字节数, 新增的字节数)
+    单章失败只打印，原文件保留（转码先写临时文件，失败不影响原章节）
+    """
+    removed = added = 0
+    for fut in as_completed(futures):
+        try:
+            r, a = fut.result()
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"⚠️ 章节转码失败，保留原文件：{e}")
+            continue
+        removed += r
+        added += a
+    return removed, added
+
+
+def transcode_all(chapters, fmt: str, workers=TRANSCODE_WORKERS):
+    """并行转码若干章，返回 (删掉的字节数, 新增的字节数)"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return collect([pool.submit(transcode_chapter, ch, fmt) for ch in chapters])
+
+
+def book_size(book_dir: Path) -> int:
+    """书目录占用的字节数；硬链接（位置文件和 by_id）只算一次"""
+    seen = set()
+    total = 0
+    for root, _, files in os.walk(book_dir):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def format_size(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GB"
+
+
+def compact_book(book_dir: Path, fmt: str, drop_segments=False, workers=TRANSCODE_WORKERS):
+    """已转化好的书：转码全部章节（已是该格式的跳过），可选删掉逐段音频；返回 (之前, 之后) 字节数"""
+    from segment_pack import drop_segment_audio
+    import shelf_index
+
+    book_dir = Path(book_dir)
+    before = book_size(book_dir)
+    chapters = [ch.with_suffix(".mp3") for ch in chapter_files(book_dir / "chapters")]
+    todo = [ch for ch in sorted(chapters) if needs_transcode(ch, fmt)]
+    transcode_all(todo, fmt, workers)
+    if drop_segments:
+        drop_segment_audio(book_dir)
+    shelf_index.update_book(book_dir)
+    return before, book_size(book_dir)
+
+
+def confirm_drop_segments(books) -> bool:
+    """
+    删逐段音频前列出代价并确认：segments.json 还在，但重新转化时每一段都没有音频可复用，
+    （TTS 缓存里没有的）整本都要重新合成
+    """
+    from segment_pack import segment_count
+    import shelf_index
+
+    segments = seconds = 0
+    for book in books:
+        segments += segment_count(book)
+        seconds += shelf_index.load_book(book).get("duration", 0)
+    print(f"⚠️ 将删掉 {len(books)} 本书共 {segments} 段的逐段音频（约 {seconds / 3600:.1f} 小时朗读）")
+    print("   之后重新转化这些书（如换了清洗/切分参数）时，这些段都要重新调用 TTS 合成")
+    return input("继续？[y/N] ").strip().lower() in ("y", "yes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把已转化的书的章节转成紧凑格式，并报告前后大小")
+    parser.add_argument("books", nargs="*", help="书目录，缺省为 books/ 下所有书")
+    parser.add_argument("-f", "--format", default=COMPACT_FORMAT or "aac", choices=sorted(FORMATS))
+    parser.add_argument("--drop-segments", action="store_true", default=DROP_SEGMENTS,
+                        help="同时删掉逐段音频（之后重新转化需要重新合成）")
+    parser.add_argument("-j", "--workers", type=int, default=TRANSCODE_WORKERS, help="并行的 ffmpeg 数")
+    parser.add_argument("-y", "--yes", action="store_true", help="删逐段音频前不再确认")
+    args = parser.parse_args()
+
+    books = [Path(b) for b in args.books] or sorted(
+        b for b in BOOKS_DIR.iterdir() if b.is_dir() and not b.name.startswith("."))
+    if args.drop_segments and not args.yes and not confirm_drop_segments(books):
+        print("已取消。")
+        return
+    total_before = total_after = 0
+    for book in books:
+        before, after = compact_book(book, args.format, args.drop_segments, args.workers)
+        total_before += before
+        total_after += after
+        print(f"📦 {book.name}：{format_size(before)} → {format_size(after)}")
+    if len(books) > 1:
+        print(f"🔹 合计：{format_size(total_before)} → {format_size(total_after)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,460 @@
 import asyncio
+import collections
+import concurrent.futures
 import edge_tts
+import json
+import os
 from pathlib import Path
+import random
+import threading
 import time
 import re
+import uuid
+
+from tts_cache import AudioCache, cache_key
+from timing import save_words
+
+# ===== 可调参数 =====
+TTS_CONCURRENCY = 4     # 同时进行的合成请求数
+TTS_RATE = 2.0          # 令牌桶：每秒最多发起的请求数（保护 IP）
+TTS_BURST = 4           # 令牌桶：允许的瞬时突发请求数
+TTS_CACHE = True        # 是否启用跨书共享的音频缓存（见 tts_cache.py）
+
+# 自适应限速（AIMD）：上面的并发数/速率只是初始值，运行中按延迟和错误自动调整
+TTS_ADAPTIVE = True
+TTS_MIN_CONCURRENCY = 1
+TTS_MAX_CONCURRENCY = 16
+TTS_MIN_RATE = 0.2      # 每秒请求数下限
+TTS_MAX_RATE = 10.0     # 每秒请求数上限
+TTS_BACKOFF = 0.5       # 遇到限流时并发数和速率乘以这个系数
+TTS_LATENCY_TOLERANCE = 2.0   # 每字延迟超过基线的这么多倍视为变慢，不再加并发
+TTS_ERROR_HOLD = 0.1    # 最近请求的错误率超过它时不再加并发
+TTS_LIMITS_FILE = Path(__file__).parent / "cache" / "tts_limits.json"   # 学到的并发数/速率，下次启动沿用
+
+# 熔断：连续失败这么多次后暂停发请求，冷却后放一个探测请求
+BREAKER_FAILURES = 6
+BREAKER_COOLDOWN = 30   # 秒，探测失败则加倍
+BREAKER_MAX_COOLDOWN = 300
+
+# 单段重试：指数退避 + 随机抖动
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# ===================
 
 def detect_language(text: str, default_voice: str):
     # 自动识别中英文
     has_chinese = any('\u4e00' <= c <= '\u9fff' for c in text)
     return default_voice if has_chinese else "en-US-AriaNeural"
 
-async def _tts_once(text: str, output: Path, voice: str, rate: str):
+async def edge_backend(text: str, voice: str, rate: str, output: Path):
+    """
+    默认后端：微软 Edge TTS
+    边收音频边记录 WordBoundary，返回 [[起点ms, 时长ms, 词], ...]
+    """
+    try:
+        communicate = edge_tts.Communicate(text, voice, rate=rate, boundary="WordBoundary")
+    except TypeError:
+        # 旧版 edge-tts 没有 boundary 参数，默认就是逐词
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+
+    words = []
+    with open(output, "wb") as audio:
+        async for message in communicate.stream():
+            if message["type"] == "audio":
+                audio.write(message["data"])
+            elif message["type"] == "WordBoundary":
+                # offset / duration 单位是 100 纳秒
+                words.append([message["offset"] // 10000, message["duration"] // 10000, message["text"]])
+    return words
+
+def _fsync_size(path: Path) -> int:
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+        return os.fstat(f.fileno()).st_size
+
+
+async def _tts_once(text: str, output: Path, voice: str, rate: str, backend=edge_backend):
     if not text.strip(): return False
     final_voice = detect_language(text, voice)
-    communicate = edge_tts.Communicate(text, final_voice, rate=rate)
-    await communicate.save(str(output))
+    # 先写临时文件，落盘后再改名：中途崩溃或被杀不会留下半截的 mp3 被当成已完成
+    # （同一段可能同时在合成，临时文件名各不相同）
+    tmp = output.with_name(f"{output.name}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        words = await backend(text, final_voice, rate, tmp)
+        if not await asyncio.to_thread(_fsync_size, tmp):
+            raise RuntimeError("TTS 没有返回音频")
+        # 后端提供了逐词时间就存下来，供同步阅读使用
+        if words is not None:
+            save_words(output, words)
+        os.replace(tmp, output)
+    finally:
+        tmp.unlink(missing_ok=True)
     return True
 
-def text_to_mp3(text: str, output: Path, voice="zh-CN-YunxiNeural", rate="0%", max_retry=3):
-    # 彻底过滤非法字符，防止微软接口因特殊符号报错导致合成中断
-    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-    
-    for attempt in range(1, max_retry + 1):
+
+class TokenBucket:
+    """
+    令牌桶限速：平均每秒 rate 个请求，最多攒 burst 个令牌
+    只能在同一个事件循环里使用
+    """
+
+    def __init__(self, rate=TTS_RATE, burst=TTS_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.waited = False   # 最近是否因令牌不足等待过（自适应调速据此判断速率是否是瓶颈）
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.waited = True
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def is_throttle_error(e: Exception) -> bool:
+    """限流 / 过载类错误：需要降速，而不是单纯重试"""
+    if getattr(e, "status", None) in (429, 503):
+        return True
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    msg = str(e).lower()
+    return any(s in msg for s in ("429", "too many requests", "throttl", "rate limit"))
+
+
+def retry_delay(attempt: int) -> float:
+    # 第 n 次失败后等待 base × 2^(n-1)，封顶后再乘 0.5~1.5 的随机系数，避免多段同时重试
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+class AdaptiveLimiter:
+    """
+    并发上限 + 熔断，只能在引擎的事件循环里使用
+    - 加性增：请求成功、每字延迟不超过基线的 TTS_LATENCY_TOLERANCE 倍、近期错误率不高时，
+      每次成功并发上限 +1/上限（约每轮 +1），令牌桶速率同步上调
+    - 乘性减：限流类错误（429/503/超时）时并发上限和速率乘以 TTS_BACKOFF，一轮内只减一次
+    - 熔断：连续失败 BREAKER_FAILURES 次后暂停发请求；冷却结束放行一个探测请求，
+      成功恢复，失败则冷却时间加倍
+    adaptive=False 时只保留熔断，并发上限固定
+    """
+
+    def __init__(self, bucket: TokenBucket, concurrency, min_concurrency=TTS_MIN_CONCURRENCY,
+                 max_concurrency=TTS_MAX_CONCURRENCY, adaptive=TTS_ADAPTIVE):
+        self.bucket = bucket
+        self.limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, concurrency)
+        self.adaptive = adaptive
+
+        self.inflight = 0
+        self.cond = asyncio.Condition()
+        self.outcomes = collections.deque(maxlen=20)   # 最近请求是否出错
+        self.char_latency = None     # 每字延迟的 EWMA（秒）
+        self.baseline = None         # 健康时的每字延迟
+        self.rtt = 1.0               # 单次请求耗时的 EWMA（秒），一轮的长度
+        self.last_decrease = 0.0
+        self.changed = False
+        self.saturated = False       # 最近是否有请求因并发上限而排队
+
+        self.failures = 0            # 连续失败次数
+        self.state = "closed"        # closed / open / half-open
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.probing = False
+
+    async def acquire(self):
+        async with self.cond:
+            while True:
+                if self.state == "open":
+                    wait = self.open_until - time.monotonic()
+                    if wait > 0:
+                        try:
+                            await asyncio.wait_for(self.cond.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    self.state, self.probing = "half-open", False
+
+                if self.state == "half-open":
+                    if not self.probing and self.inflight == 0:
+                        self.probing = True
+                        self.inflight += 1
+                        return
+                elif self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return
+                self.saturated = True
+                await self.cond.wait()
+
+    async def release(self, seconds=None, chars=1, error=None):
+        """请求结束：成功时传耗时和字数，失败时传异常"""
+        async with self.cond:
+            self.inflight -= 1
+            if error is None:
+                self._on_success(seconds, max(1, chars))
+            else:
+                self._on_error(error)
+            self.cond.notify_all()
+
+    def _on_success(self, seconds, chars):
+        self.failures = 0
+        self.outcomes.append(False)
+        if self.state == "half-open":
+            print("✅ TTS 探测请求成功，恢复正常")
+            self.state, self.cooldown = "closed", BREAKER_COOLDOWN
+
+        per_char = seconds / chars
+        self.rtt = 0.8 * self.rtt + 0.2 * seconds
+        self.char_latency = per_char if self.char_latency is None else 0.8 * self.char_latency + 0.2 * per_char
+        # 基线取健康时的最低水平，并缓慢上浮，服务整体变慢后也能重新增长
+        self.baseline = self.char_latency if self.baseline is None else min(self.baseline * 1.001,
+                                                                            self.char_latency)
+
+        healthy = (self.char_latency <= self.baseline * TTS_LATENCY_TOLERANCE
+                   and sum(self.outcomes) / len(self.outcomes) <= TTS_ERROR_HOLD)
+        if self.adaptive and healthy:
+            # 只放宽确实卡住了请求的那一项，否则上限会在没有反馈的情况下一路涨上去
+            if self.saturated and self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.changed = True
+            if self.bucket.waited and self.bucket.rate < TTS_MAX_RATE:
+                self.bucket.rate = min(TTS_MAX_RATE, self.bucket.rate * (1 + 1 / (self.limit * 4)))
+                self.changed = True
+            self.saturated = self.bucket.waited = False
+
+    def _on_error(self, error):
+        self.failures += 1
+        self.outcomes.append(True)
+        now = time.monotonic()
+
+        if self.adaptive and is_throttle_error(error) and now - self.last_decrease >= self.rtt:
+            self.limit = max(self.min_concurrency, self.limit * TTS_BACKOFF)
+            self.bucket.rate = max(TTS_MIN_RATE, self.bucket.rate * TTS_BACKOFF)
+            self.last_decrease = now
+            self.changed = True
+            print(f"🐢 TTS 被限流，并发降到 {int(self.limit)}，速率 {self.bucket.rate:.2f}/s")
+
+        if self.state == "half-open":
+            self.cooldown = min(BREAKER_MAX_COOLDOWN, self.cooldown * 2)
+            self._trip(now)
+        elif self.state == "closed" and self.failures >= BREAKER_FAILURES:
+            self._trip(now)
+
+    def _trip(self, now):
+        self.state = "open"
+        self.open_until = now + self.cooldown
+        print(f"🔌 TTS 连续失败 {self.failures} 次，暂停 {self.cooldown:.0f}s 后再试")
+
+    def snapshot(self):
+        return {"concurrency": round(self.limit, 2), "rate": round(self.bucket.rate, 3),
+                "state": self.state, "inflight": self.inflight}
+
+
+def load_limits(path: Path):
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return float(data["concurrency"]), float(data["rate"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_limits(path: Path, concurrency: float, rate: float):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+    tmp.write_text(json.dumps({"concurrency": concurrency, "rate": rate, "updated": time.time()}),
+                   encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class TTSEngine:
+    """
+    并发 TTS 引擎：
+    - 后台线程里跑一个常驻事件循环，所有请求共用
+    - 并发上限和发起速率由 AdaptiveLimiter 按延迟/错误自动调整，连续失败时熔断
+    - 任意线程都可以 submit，拿到 concurrent.futures.Future
+    - 传入 cache 时先查缓存，命中则直接链接/复制，不走网络
+    - 传入 limits_file 时从中读取上次学到的并发数/速率，运行中定期写回
+    """
+
+    def __init__(self, concurrency=TTS_CONCURRENCY, rate=TTS_RATE, burst=TTS_BURST,
+                 backend=edge_backend, max_retry=3, cache=None, adaptive=TTS_ADAPTIVE,
+                 max_concurrency=TTS_MAX_CONCURRENCY, limits_file=None):
+        self.backend = backend
+        self.max_retry = max_retry
+        self.cache = cache
+        self.limits_file = limits_file
+        self.saved = 0.0
+
+        if adaptive and limits_file is not None:
+            learned = load_limits(limits_file)
+            if learned:
+                concurrency = min(max(learned[0], TTS_MIN_CONCURRENCY), max_concurrency)
+                rate = min(max(learned[1], TTS_MIN_RATE), TTS_MAX_RATE)
+        # 并发上限可能增长到 max_concurrency，调用方据此决定在途请求数
+        self.max_concurrency = max(max_concurrency, int(concurrency)) if adaptive else int(concurrency)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="tts-loop", daemon=True)
+        self.thread.start()
+
+        async def init():
+            self.bucket = TokenBucket(rate, burst)
+            self.limiter = AdaptiveLimiter(self.bucket, concurrency, max_concurrency=self.max_concurrency,
+                                           adaptive=adaptive)
+        asyncio.run_coroutine_threadsafe(init(), self.loop).result()
+
+    @property
+    def concurrency(self) -> int:
+        """当前的并发上限"""
+        return int(self.limiter.limit)
+
+    def _take_limits(self, force=False):
+        # 在事件循环线程里取要保存的限额；学到的限额最多每 30 秒写一次盘
+        if self.limits_file is None or not self.limiter.changed:
+            return None
+        if not force and time.monotonic() - self.saved < 30:
+            return None
+        self.limiter.changed = False
+        self.saved = time.monotonic()
+        return round(self.limiter.limit, 2), round(self.bucket.rate, 3)
+
+    def _write_limits(self, concurrency, rate):
         try:
+            save_limits(self.limits_file, concurrency, rate)
+        except OSError as e:
+            print(f"⚠️ 保存 TTS 限额失败: {e}")
+            # 下次再试
+            self.loop.call_soon_threadsafe(setattr, self.limiter, "changed", True)
+
+    def _save_limits(self):
+        # 写盘放到线程池里，不阻塞事件循环上的其它请求
+        limits = self._take_limits()
+        if limits:
+            self.loop.run_in_executor(None, self._write_limits, *limits)
+
+    async def _synthesize(self, text: str, output: Path, voice: str, rate: str, max_retry: int,
+                          metrics=None):
+        # 彻底过滤非法字符，防止微软接口因特殊符号报错导致合成中断
+        text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+        if not text.strip(): return False
+
+        key = None
+        if self.cache is not None:
+            key = cache_key(text, detect_language(text, voice), rate)
+            if self.cache.fetch(key, output):
+                if metrics:
+                    metrics.count("tts_cache", result="hit")
+                return True
+            if metrics:
+                metrics.count("tts_cache", result="miss")
+
+        error = None
+        for attempt in range(1, max_retry + 1):
+            queued = time.perf_counter()
+            # 先取令牌再占并发名额：并发名额只统计真正发出去的请求
+            await self.bucket.acquire()
+            await self.limiter.acquire()
             try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            
-            asyncio.run(_tts_once(text, output, voice, rate))
-            # 物理限速，保护 IP
-            time.sleep(0.8) 
-            return True
-        except Exception as e:
-            print(f"⚠️ TTS 尝试 {attempt} 失败: {e}")
-            time.sleep(attempt * 2)
-    return False
\ No newline at end of file
+                started = time.perf_counter()
+                ok = await _tts_once(text, output, voice, rate, self.backend)
+            except Exception as e:
+                await self.limiter.release(error=e)
+                error = type(e).__name__
+                if metrics:
+                    metrics.count("tts_retries", error=error, throttle=is_throttle_error(e))
+                print(f"⚠️ TTS 尝试 {attempt} 失败: {e}")
+                if attempt < max_retry:
+                    await asyncio.sleep(retry_delay(attempt))
+            else:
+                elapsed = time.perf_counter() - started
+                await self.limiter.release(elapsed, len(text))
+                if metrics:
+                    # 排队（并发上限 + 令牌桶）与合成本身分开统计
+                    metrics.observe("tts_wait", started - queued)
+                    metrics.observe("tts_latency", elapsed)
+                break
+            finally:
+                self._save_limits()
+        else:
+            if metrics:
+                metrics.count("tts_failures", error=error)
+            return False
+
+        if ok and key is not None:
+            self.cache.store(key, output)
+        if ok and metrics:
+            metrics.count("audio_bytes", output.stat().st_size)
+        return ok
+
+    def submit(self, text: str, output: Path, voice="zh-CN-YunxiNeural", rate="0%", max_retry=None,
+               metrics=None):
+        """metrics 为 metrics.RunMetrics 时记录延迟、重试、失败和输出字节数"""
+        coro = self._synthesize(text, Path(output), voice, rate, max_retry or self.max_retry, metrics)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def synthesize_batch(self, items, voice="zh-CN-YunxiNeural", rate="0%", on_done=None):
+        """
+        批量合成 [(text, output), ...]，返回与 items 对应的成功标记列表
+        on_done(i, ok) 在调用方线程中按完成顺序回调（方便刷新 Streamlit 进度条）
+        """
+        futures = {self.submit(text, output, voice, rate): i for i, (text, output) in enumerate(items)}
+        results = [False] * len(futures)
+        for fut in concurrent.futures.as_completed(futures):
+            i = futures[fut]
+            results[i] = fut.result()
+            if on_done:
+                on_done(i, results[i])
+        return results
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+        async def flush():
+            # 等线程池里还没写完的限额落盘，再取最终值
+            await self.loop.shutdown_default_executor()
+            return self._take_limits(force=True)
+        limits = asyncio.run_coroutine_threadsafe(flush(), self.loop).result()
+        if limits:
+            # 循环马上要停，直接在调用方线程写盘
+            self._write_limits(*limits)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> TTSEngine:
+    # 进程内共享一个引擎，所有调用方共用同一个并发上限和令牌桶
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TTSEngine(cache=AudioCache() if TTS_CACHE else None, limits_file=TTS_LIMITS_FILE)
+        return _engine
+
+def configure_engine(**kwargs) -> TTSEngine:
+    """
+    替换进程内共享引擎，例如调整并发/限速，或换成本地假后端（见 fake_tts.py）
+    参数同 TTSEngine
+    """
+    global _engine
+    with _engine_lock:
+        old, _engine = _engine, TTSEngine(**kwargs)
+    if old is not None:
+        old.close()
+    return _engine
+
+def text_to_mp3(text: str, output: Path, voice="zh-CN-YunxiNeural", rate="0%", max_retry=3):
+    # 兼容旧接口：单段同步合成，内部走共享引擎；重试后仍失败时抛异常，调用方不会误以为成功
+    ok = get_engine().submit(text, output, voice, rate, max_retry).result()
+    if not ok and text.strip():
+        raise RuntimeError(f"TTS 合成失败: {Path(output).name}")
+    return ok
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from timing import words_path
+
+# ===== 可调参数 =====
+CACHE_DIR = Path(__file__).parent / "cache" / "tts"
+CACHE_MAX_BYTES = 2 * 1024 ** 3   # 缓存总大小上限，超出后按最近最少使用淘汰
+# ===================
+
+
+def normalize_text(text: str) -> str:
+    # 与合成前的过滤保持一致：去控制字符、合并空白
+    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text: str, voice: str, rate: str) -> str:
+    """
+    内容寻址：同一段文字 + 实际使用的播音员 + 语速 → 同一个 key
+    voice 应是 detect_language 之后真正用于合成的播音员
+    """
+    h = hashlib.sha256()
+    for part in (normalize_text(text), voice, rate):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path):
+    # 同一文件系统用硬链接（零拷贝），否则退回复制
+    # 页面进程和 jobs.py 的 worker 共用缓存和书目录，临时文件名各不相同，互不覆盖
+    tmp = dst.with_name(f"{dst.name}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class AudioCache:
+    """
+    跨书、跨运行共享的 TTS 音频缓存：
+    - 音频按 key 存一份：<cache_dir>/ab/abcdef....mp3（逐词时间存在同名 .words.json）
+    - SQLite 索引记录大小和最近访问时间，超过 max_bytes 按 LRU 淘汰
+    - hits / misses 计数方便观察命中率
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(str(self.cache_dir / "index.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, atime REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.mp3"
+
+    def fetch(self, key: str, output: Path) -> bool:
+        """命中则把缓存音频链接/复制到 output 并返回 True"""
+        path = self._path(key)
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not path.exists():
+                self.misses += 1
+                return False
+            self.db.execute("UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+
+        link_or_copy(path, Path(output))
+        # 逐词时间随音频一起缓存
+        if words_path(path).exists():
+            link_or_copy(words_path(path), words_path(output))
+        return True
+
+    def store(self, key: str, output: Path):
+        """把刚合成好的 output 收进缓存"""
+        output = Path(output)
+        if not output.exists() or output.stat().st_size == 0:
+            return
+
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        link_or_copy(output, path)
+        if words_path(output).exists():
+            link_or_copy(words_path(output), words_path(path))
+
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, atime) VALUES (?, ?, ?)",
+                (key, path.stat().st_size, time.time())
+            )
+            self.db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY atime").fetchall():
+            self._path(key).unlink(missing_ok=True)
+            words_path(self._path(key)).unlink(missing_ok=True)
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": size,
+        }